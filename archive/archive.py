@@ -0,0 +1,791 @@
+#!/usr/bin/python3
+import io
+import os
+import glob
+import json
+import time
+import stat
+import hashlib
+import subprocess
+import tarfile
+import queue
+import threading
+import logging
+from archive_index import archive_index
+from checksum import checksum
+from compression import compression as compression_module
+from encryption import encryption
+from utils import utils
+
+logger = logging.getLogger("backup_logger")
+
+# size of the blocks that travel between the pipeline stages, 1MB
+CHUNK_SIZE = 1048576
+
+# suffixes of the parts and the manifest of a split archive, i.e. archive.tar.gz.part0001
+PART_SUFFIX = '.part'
+MANIFEST_SUFFIX = '.manifest'
+
+
+class FileSink:
+
+    def __init__(self, file_name):
+        """
+        Last stage of the pipeline, it writes the stream to a file on disk
+
+        :param file_name: The file that will be created
+        """
+        self.file_name = file_name
+        self.bytes_written = 0
+        self.__file = open(file_name, 'wb')
+
+    def write(self, data):
+        self.__file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        self.__file.close()
+
+    def abort(self):
+        """
+        It closes and removes the incomplete file
+        """
+        self.__file.close()
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+
+
+class SplitSink:
+
+    def __init__(self, file_name, split_size):
+        """
+        Last stage of the pipeline, it writes the stream into numbered parts of split_size bytes
+        (file_name.part0001, file_name.part0002, ...). When it is closed it writes file_name.manifest with
+        the size and sha256 of every part, so every part can be copied, uploaded and verified on its own.
+        Concatenated parts are the same as the archive without split.
+
+        :param file_name: The name of the archive, parts and manifest are created next to it
+        :param split_size: Size of one part in bytes
+        """
+        self.file_name = file_name
+        self.split_size = int(split_size)
+        self.bytes_written = 0
+        self.parts = []
+        self.__file = None
+        self.__hash = None
+        self.__part_size = 0
+
+    def __open_part(self):
+        name = part_name(self.file_name, len(self.parts) + 1)
+        self.__file = open(name, 'wb')
+        self.__hash = hashlib.sha256()
+        self.__part_size = 0
+        self.parts.append({'name': os.path.basename(name)})
+
+    def __close_part(self):
+        self.__file.close()
+        self.__file = None
+        self.parts[-1]['size'] = self.__part_size
+        self.parts[-1]['sha256'] = self.__hash.hexdigest()
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            if self.__file is None:
+                self.__open_part()
+            size = min(len(view), self.split_size - self.__part_size)
+            self.__file.write(view[:size])
+            self.__hash.update(view[:size])
+            self.__part_size += size
+            view = view[size:]
+            if self.__part_size == self.split_size:
+                self.__close_part()
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        if len(self.parts) == 0:
+            self.__open_part()
+        if self.__file is not None:
+            self.__close_part()
+        manifest = {
+            'archive': os.path.basename(self.file_name),
+            'size': self.bytes_written,
+            'split_size': self.split_size,
+            'parts': self.parts
+        }
+        with open(self.file_name + MANIFEST_SUFFIX + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.file_name + MANIFEST_SUFFIX + '.tmp', self.file_name + MANIFEST_SUFFIX)
+
+    def abort(self):
+        """
+        It closes and removes all parts that are written, the manifest isn't written
+        """
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        for part in self.parts:
+            path = os.path.join(os.path.dirname(self.file_name), part['name'])
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def open_sink(file_name, split_size=None):
+    """
+    :param file_name: The file that will be created
+    :param split_size: Size of one part in bytes, the archive isn't split if it is 0 or None (optional)
+    :return: SplitSink if split_size is provided, otherwise FileSink.
+    """
+    if split_size is not None and int(split_size) > 0:
+        return SplitSink(file_name, split_size)
+    return FileSink(file_name)
+
+
+def part_name(file_name, number):
+    return file_name + PART_SUFFIX + '{0:04d}'.format(number)
+
+
+def archive_files(file_name):
+    """
+    It finds the files of the archive, the archive itself or its parts and manifest if it is split,
+    and the index and checksums of the archive if they exist
+
+    :param file_name: The name of the archive
+    :return: A list of files.
+    """
+    files = [file_name]
+    if os.path.exists(file_name + MANIFEST_SUFFIX):
+        with open(file_name + MANIFEST_SUFFIX) as f:
+            manifest = json.load(f)
+        directory = os.path.dirname(file_name)
+        files = [os.path.join(directory, part['name']) for part in manifest['parts']] + [file_name + MANIFEST_SUFFIX]
+    if os.path.exists(file_name + archive_index.INDEX_SUFFIX):
+        files.append(file_name + archive_index.INDEX_SUFFIX)
+    if os.path.exists(file_name + checksum.CHECKSUM_SUFFIX):
+        files.append(file_name + checksum.CHECKSUM_SUFFIX)
+    return files
+
+
+def data_files(file_name):
+    """
+    :param file_name: The name of the archive
+    :return: A list of files with the content of the archive, without the manifest, the index and checksums.
+    """
+    return [f for f in archive_files(file_name)
+            if not f.endswith(MANIFEST_SUFFIX) and not f.endswith(archive_index.INDEX_SUFFIX)
+            and not f.endswith(checksum.CHECKSUM_SUFFIX)]
+
+
+def archive_file_names(file_name):
+    """
+    :param file_name: The name of the archive
+    :return: A list of names, without the directory, of the files of the archive.
+    """
+    return [os.path.basename(f) for f in archive_files(file_name)]
+
+
+def archive_size(file_name):
+    return sum(os.path.getsize(f) for f in data_files(file_name))
+
+
+def remove_archive(file_name):
+    """
+    It removes the archive, or all its parts and the manifest if it is split, and its index and checksums
+
+    :param file_name: The name of the archive
+    """
+    names = [file_name, file_name + MANIFEST_SUFFIX, file_name + MANIFEST_SUFFIX + '.tmp',
+             file_name + archive_index.INDEX_SUFFIX, file_name + archive_index.INDEX_SUFFIX + '.tmp',
+             file_name + checksum.CHECKSUM_SUFFIX, file_name + checksum.CHECKSUM_SUFFIX + '.tmp']
+    names += glob.glob(glob.escape(file_name + PART_SUFFIX) + '[0-9]*')
+    for name in names:
+        if os.path.isfile(name):
+            os.remove(name)
+
+
+def verify_split_archive(file_name):
+    """
+    It checks the size and sha256 of every part of the split archive against the manifest
+
+    :param file_name: The name of the archive
+    :return: A list of parts that are missing or damaged, empty if the archive is fine.
+    """
+    with open(file_name + MANIFEST_SUFFIX) as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(file_name)
+    damaged = []
+    for part in manifest['parts']:
+        path = os.path.join(directory, part['name'])
+        if not os.path.exists(path) or os.path.getsize(path) != part['size']:
+            damaged.append(part['name'])
+            continue
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(data)
+        if h.hexdigest() != part['sha256']:
+            damaged.append(part['name'])
+    return damaged
+
+
+class PartsReader(io.RawIOBase):
+
+    def __init__(self, file_names):
+        """
+        It reads the parts of a split archive one after another, as one stream
+
+        :param file_names: A list of parts in order
+        """
+        self.file_names = list(file_names)
+        self.__file = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.__file is None:
+                if not self.file_names:
+                    return 0
+                self.__file = open(self.file_names.pop(0), 'rb')
+            size = self.__file.readinto(buffer)
+            if size:
+                return size
+            self.__file.close()
+            self.__file = None
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        super().close()
+
+
+def pump(source, pipe):
+    """
+    It copies the source into the pipe of a process and closes both
+
+    :param source: Binary file like object
+    :param pipe: Standard input of the process
+    """
+    try:
+        while True:
+            data = source.read(CHUNK_SIZE)
+            if not data:
+                break
+            pipe.write(data)
+    except OSError as e:
+        logger.debug("Pipe closed: " + str(e))
+    finally:
+        source.close()
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+
+class ThreadedSink:
+
+    def __init__(self, file_name, queue_size=8, split_size=None):
+        """
+        FileSink with its own writer thread and a bounded queue, a failure of the sink is recorded and
+        the rest of the stream is discarded, so it doesn't stop the other sinks
+
+        :param file_name: The file that will be created
+        :param queue_size: Number of chunks that can wait for the writer, defaults to 8 (optional)
+        :param split_size: Size of one part in bytes if the archive is split (optional)
+        """
+        self.file_name = file_name
+        self.error = None
+        self.__aborted = False
+        self.__queue = queue.Queue(maxsize=queue_size)
+        try:
+            self.__sink = open_sink(file_name, split_size)
+        except OSError as e:
+            self.__sink = None
+            self.error = e
+        self.__thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__thread.start()
+
+    def __write_loop(self):
+        while True:
+            data = self.__queue.get()
+            if data is None:
+                break
+            if self.error is not None or self.__aborted:
+                continue
+            try:
+                self.__sink.write(data)
+            except Exception as e:
+                self.error = e
+                logger.error("Error while writing file: " + self.file_name + ", error: " + str(e))
+        if self.__sink is not None:
+            try:
+                if self.__aborted:
+                    self.__sink.abort()
+                else:
+                    self.__sink.close()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def write(self, data):
+        self.__queue.put(data)
+        return len(data)
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+        if self.error is not None and self.__sink is not None:
+            remove_archive(self.file_name)
+
+    def abort(self):
+        """
+        It discards data that waits for the writer, the writer thread is joined and the file is removed
+        """
+        self.__aborted = True
+        self.__queue.put(None)
+        self.__thread.join()
+
+
+class TeeSink:
+
+    def __init__(self, file_names, split_size=None):
+        """
+        Last stage of the pipeline, it writes the same stream to several files at the same time, every file
+        is written by its own thread. The first file is required, a failure of any other file is only logged
+        and that file is removed.
+
+        :param file_names: A list of files that will be created
+        :param split_size: Size of one part in bytes if the archive is split (optional)
+        """
+        self.file_names = file_names
+        self.sinks = [ThreadedSink(file_name, split_size=split_size) for file_name in file_names]
+        self.bytes_written = 0
+
+    def write(self, data):
+        if self.sinks[0].error is not None:
+            raise self.sinks[0].error
+        for sink in self.sinks:
+            sink.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def failed(self):
+        """
+        :return: A list of files that couldn't be written.
+        """
+        return [sink.file_name for sink in self.sinks if sink.error is not None]
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        for sink in self.sinks[1:]:
+            if sink.error is not None:
+                logger.error("Copy: " + sink.file_name + " isn't created, error: " + str(sink.error))
+        if self.sinks[0].error is not None:
+            raise self.sinks[0].error
+
+    def abort(self):
+        for sink in self.sinks:
+            sink.abort()
+
+
+class ChecksumStage:
+
+    def __init__(self, next_stage, file_names, split_size=None):
+        """
+        It calculates checksums of the final bytes of the archive, compressed and encrypted, while they are
+        written, so the archive is never read again to be verified. Chunk hashes start again at every part of
+        a split archive. When it is closed it writes <archive>.sums next to the archive and every copy that
+        is written.
+
+        :param next_stage: The stage that receives the data
+        :param file_names: A list of the archive and its copies
+        :param split_size: Size of one part in bytes if the archive is split (optional)
+        """
+        self.next_stage = next_stage
+        self.file_names = file_names
+        self.split_size = int(split_size) if split_size is not None and int(split_size) > 0 else 0
+        self.files = []
+        self.__tree = checksum.TreeHash()
+
+    def __next_file(self):
+        self.files.append(self.__tree.result(self.__name(len(self.files) + 1)))
+        self.__tree = checksum.TreeHash()
+
+    def __name(self, number):
+        if self.split_size > 0:
+            return os.path.basename(part_name(self.file_names[0], number))
+        return os.path.basename(self.file_names[0])
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            size = len(view) if self.split_size == 0 else min(len(view), self.split_size - self.__tree.size)
+            self.__tree.update(view[:size])
+            view = view[size:]
+            if self.__tree.size == self.split_size:
+                self.__next_file()
+        self.next_stage.write(data)
+        return len(data)
+
+    def close(self):
+        self.next_stage.close()
+        if self.__tree.size > 0 or len(self.files) == 0:
+            self.__next_file()
+        root = None
+        for name in self.file_names:
+            if not os.path.exists(name) and not os.path.exists(name + MANIFEST_SUFFIX):
+                continue
+            try:
+                root = checksum.write_checksums(name + checksum.CHECKSUM_SUFFIX, self.files)
+            except OSError as e:
+                logger.error("Error while writing checksums of archive: " + name + ", error: " + str(e))
+        if root is not None:
+            logger.info("Checksum of archive: " + os.path.basename(self.file_names[0]) + ", root: " + root)
+
+    def abort(self):
+        """
+        It aborts the next stage, checksums aren't written
+        """
+        self.next_stage.abort()
+
+
+def open_pipeline(file_name, encrypt='False', enc_pass=None, threads=1, compression=None, copies=None,
+                  split_size=None):
+    """
+    It builds the compress -> encrypt -> checksum -> write pipeline for the provided file, if copies are
+    provided the same stream is hashed once and written to all of them at the same time
+
+    :param file_name: The final file that will be written
+    :param encrypt: True/False
+    :param enc_pass: The password to encrypt the stream with
+    :param threads: Number of threads used for compression and encryption, defaults to 1 (optional)
+    :param compression: The compression option or Codec object, defaults to gzip:6 (optional)
+    :param copies: A list of additional files with the same content (optional)
+    :param split_size: Size of one part in bytes, the archive isn't split if it is 0 or None (optional)
+    :return: The first stage of the pipeline, a file like object that accepts uncompressed data.
+    """
+    if copies:
+        stage = TeeSink([file_name] + list(copies), split_size)
+    else:
+        stage = open_sink(file_name, split_size)
+    stage = ChecksumStage(stage, [file_name] + list(copies or []), split_size)
+    if str(encrypt).upper() == 'TRUE':
+        try:
+            stage = encryption.EncryptStage(stage, enc_pass, threads)
+        except BaseException:
+            # the header couldn't be written, writer threads of the sinks are stopped
+            stage.abort()
+            raise
+    return compression_module.ParallelCompressStage(stage, codec=compression, threads=threads)
+
+
+def open_reader(file_name, enc_pass=None, threads=1):
+    """
+    It opens an archive for reading, the archive is decrypted (if it ends with .enc) and decompressed
+    on the fly based on its extension. Parts of a split archive are read as one stream. Archives encrypted
+    with `openssl enc` by older versions are decrypted with openssl.
+
+    :param file_name: The archive to read
+    :param enc_pass: The password to decrypt the archive with
+    :param threads: Number of threads used for decryption, defaults to 1 (optional)
+    :return: File like object with the uncompressed content and the list of processes that have to be closed.
+    """
+    codec = compression_module.codec_for_file(file_name)
+    split = not os.path.exists(file_name) and os.path.exists(file_name + MANIFEST_SUFFIX)
+    if split:
+        files = data_files(file_name)
+        fileobj = io.BufferedReader(PartsReader(files), CHUNK_SIZE)
+    else:
+        files = [file_name]
+        fileobj = open(file_name, 'rb')
+    processes = []
+    if file_name.endswith('.enc') and encryption.is_chunked(files[0]):
+        fileobj = io.BufferedReader(encryption.DecryptReader(fileobj, enc_pass, threads), CHUNK_SIZE)
+    elif file_name.endswith('.enc'):
+        env = dict(os.environ)
+        env['BACKUP_ENC_PASS'] = enc_pass
+        proc = subprocess.Popen(
+            ['openssl', 'enc', '-aes-256-cbc', '-d', '-pass', 'env:BACKUP_ENC_PASS'],
+            stdin=subprocess.PIPE if split else fileobj,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env
+        )
+        if split:
+            threading.Thread(target=pump, args=(fileobj, proc.stdin), daemon=True).start()
+        else:
+            fileobj.close()
+        fileobj = proc.stdout
+        processes.append(proc)
+    return codec.open_reader(fileobj), processes
+
+
+def extract_archive(file_name, target_dir='/', enc_pass=None):
+    """
+    It extracts the archive into the target directory, leading '/' is removed from absolute member names
+
+    :param file_name: The archive to extract
+    :param target_dir: The directory where files will be extracted, defaults to / (optional)
+    :param enc_pass: The password to decrypt the archive with
+    :return: True if the archive is extracted, otherwise False.
+    """
+    logger.info("Extracting archive: " + file_name + " to: " + target_dir)
+    reader = None
+    processes = []
+    try:
+        reader, processes = open_reader(file_name, enc_pass)
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            for member in tar:
+                member.name = member.name.lstrip('/')
+                if member.islnk():
+                    member.linkname = member.linkname.lstrip('/')
+                tar.extract(member, path=target_dir)
+        for proc in processes:
+            if proc.wait() > 0:
+                raise RuntimeError("Decryption failed with status code: " + str(proc.returncode) +
+                                   ", Standard Error: " + str(proc.stderr.read(), "utf-8"))
+        return True
+    except Exception as e:
+        logger.error("Error while extracting archive: " + file_name + ", error: " + str(e))
+        return False
+    finally:
+        if reader is not None:
+            reader.close()
+        for proc in processes:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+def walk(path, exclude=None):
+    """
+    It walks the provided path and yields every entry under it, directories before their content.
+    Symbolic links are not followed, excluded directories are not read.
+
+    :param path: A file or a directory
+    :param exclude: The ExcludeMatcher, entries that match it are skipped (optional)
+    """
+    yield path
+    if not os.path.isdir(path) or os.path.islink(path):
+        return
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logger.error("Can't read directory: " + directory + ", error: " + str(e))
+            continue
+        for entry in entries:
+            if exclude and exclude.excluded(entry.path):
+                continue
+            yield entry.path
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+            except OSError:
+                pass
+
+
+def store_incompressible(stream, tar, tarinfo, io_policy=None):
+    """
+    It marks the content of the file in the stream as stored without compression, if the file is already
+    compressed. It has to be called before the file is added to the tar.
+
+    :param stream: The pipeline that receives the tar stream
+    :param tar: The TarFile
+    :param tarinfo: The TarInfo of the regular file
+    :param io_policy: The IoPolicy, the sample of the file is read through it (optional)
+    """
+    if hasattr(stream, 'store') and compression_module.is_incompressible(tarinfo.name, tarinfo.size, io_policy):
+        start = tar.offset + len(tarinfo.tobuf(tar.format, tar.encoding, tar.errors))
+        stream.store(start, start + tarinfo.size)
+
+
+def write_tar(stream, paths, recursive=True, extra=None, members=None, blocks=None, exclude=None, io_policy=None):
+    """
+    It walks the provided paths and writes every entry as a tar member to the stream
+
+    :param stream: The pipeline that receives the tar stream
+    :param paths: A list of files and directories to archive
+    :param recursive: If False, only the provided paths are archived, without their content, defaults to True
+    :param extra: Dictionary name -> bytes with additional members that are written at the end (optional)
+    :param members: A list that receives (path, offset, end, size, mtime, sha256) of every member, offsets are
+    positions in the uncompressed tar stream (optional)
+    :param blocks: The BlockState, large regular files are written through it, as a whole or as a delta (optional)
+    :param exclude: The ExcludeMatcher, entries that match it are not archived (optional)
+    :param io_policy: The IoPolicy, files are read through it (optional)
+    :return: Number of files that were archived.
+    """
+    count = 0
+    with tarfile.open(fileobj=stream, mode='w|', format=tarfile.GNU_FORMAT) as tar:
+        for path in paths:
+            for name in (walk(path, exclude) if recursive else [path]):
+                try:
+                    tarinfo = tar.gettarinfo(name)
+                    if tarinfo is None:
+                        logger.debug("Skipping socket: " + name)
+                        continue
+                    # keep absolute member names, same as `tar --absolute-names`
+                    tarinfo.name = name
+                    offset = tar.offset
+                    sha256 = ''
+                    member_name = name
+                    delta = tarinfo.isreg() and blocks is not None and blocks.applies(tarinfo.size)
+                    if tarinfo.isreg() and not (delta and blocks.is_delta(name)):
+                        store_incompressible(stream, tar, tarinfo, io_policy)
+                    if delta:
+                        member_name, sha256 = blocks.add(tar, name, tarinfo, io_policy)
+                    elif stat.S_ISREG(os.lstat(name).st_mode):
+                        with utils.open_file(name, io_policy) as f:
+                            reader = archive_index.HashingReader(f)
+                            tar.addfile(tarinfo, reader)
+                            sha256 = reader.sha256.hexdigest()
+                    else:
+                        tar.addfile(tarinfo)
+                    if members is not None:
+                        members.append((member_name, offset, tar.offset, tar.members[-1].size, int(tarinfo.mtime),
+                                        sha256))
+                    count += 1
+                except (FileNotFoundError, PermissionError) as e:
+                    logger.error("Skipping file: " + name + ", error: " + str(e))
+        if extra is not None:
+            for name in extra:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(extra[name])
+                tarinfo.mtime = int(time.time())
+                offset = tar.offset
+                tar.addfile(tarinfo, io.BytesIO(extra[name]))
+                if members is not None:
+                    members.append((name, offset, tar.offset, tarinfo.size, tarinfo.mtime,
+                                    hashlib.sha256(extra[name]).hexdigest()))
+    return count
+
+
+def write_process_output(args, stream, args_log=None):
+    """
+    It runs the provided command and writes its standard output to the stream, chunk by chunk
+
+    :param args: The command as a list of arguments
+    :param stream: The pipeline that receives the output
+    :param args_log: The command that will be logged, i.e. without passwords (optional)
+    :return: The return code and standard error of the command.
+    """
+    if args_log is None:
+        args_log = args
+    logger.info('Executing: ' + ' '.join(args_log))
+    start = time.monotonic()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # only the last lines of the standard error are kept
+    err = utils.OutputReader(proc.stderr, keep_lines=100)
+    err.start()
+    try:
+        while True:
+            data = proc.stdout.read(CHUNK_SIZE)
+            if not data:
+                break
+            stream.write(data)
+    except Exception:
+        proc.kill()
+        proc.wait()
+        raise
+    err.join()
+    usage = utils.wait_with_usage(proc)
+    logger.info("Finished: " + args_log[0] + ", " + utils.format_usage(usage, time.monotonic() - start))
+    return proc.returncode, err.text()
+
+
+def write_index(file_name, stream, encrypted, members, copies=None):
+    """
+    It writes the index of the archive (<archive>.index) next to the archive and its copies, the archive
+    is fine without the index, so an error is only logged
+
+    :param file_name: The archive
+    :param stream: The ParallelCompressStage that wrote the archive
+    :param encrypted: True if the archive is encrypted
+    :param members: A list of (path, offset, end, size, mtime, sha256) of every member
+    :param copies: A list of copies of the archive (optional)
+    """
+    parts = [(os.path.basename(f), os.path.getsize(f)) for f in data_files(file_name)] \
+        if os.path.exists(file_name + MANIFEST_SUFFIX) else None
+    for name in [file_name] + list(copies or []):
+        if not os.path.exists(name) and not os.path.exists(name + MANIFEST_SUFFIX):
+            continue
+        try:
+            archive_index.ArchiveIndex(name + archive_index.INDEX_SUFFIX).write(
+                stream.codec, encrypted, stream.frames, members, parts)
+        except Exception as e:
+            logger.error("Error while writing index of archive: " + name + ", error: " + str(e))
+
+
+def create_archive(paths, file_name, encrypt='False', enc_pass=None, cmd=None, threads=1, compression=None,
+                   cmd_log=None, recursive=True, extra=None, host=None, copies=None, split_size=None, blocks=None,
+                   exclude=None, io_policy=None):
+    """
+    It creates a compressed and optionally encrypted archive in a single pass over the sources, without
+    an intermediate plaintext file. If cmd is provided, the standard output of that command is archived
+    (i.e. GNU tar with a snapshot file or mysqldump) instead of the provided paths. If host is provided too,
+    cmd is a string that is executed on that host over SSH and its output is streamed into the pipeline.
+
+    :param paths: A list of files and directories to archive
+    :param file_name: The final archive that will be created
+    :param encrypt: True/False
+    :param enc_pass: The password to encrypt the archive with
+    :param cmd: A command, as a list of arguments, whose standard output is archived (optional)
+    :param threads: Number of threads used for compression, defaults to 1 (optional)
+    :param compression: The compression option or Codec object, defaults to gzip:6 (optional)
+    :param cmd_log: The command that will be logged, i.e. without passwords (optional)
+    :param recursive: If False, only the provided paths are archived, without their content, defaults to True
+    :param extra: Dictionary name -> bytes with additional members that are written at the end (optional)
+    :param host: The host on which cmd is executed (optional)
+    :param copies: A list of additional files that are written at the same time, i.e. on other destinations.
+    A copy that can't be written doesn't fail the archive (optional)
+    :param split_size: Size of one part in bytes, the archive isn't split if it is 0 or None (optional)
+    :param blocks: The BlockState used for large files, only if cmd isn't provided (optional)
+    :param exclude: The ExcludeMatcher, entries that match it are not archived, only if cmd isn't provided (optional)
+    :param io_policy: The IoPolicy, files and the output of cmd on the host are read through its limits (optional)
+    :return: True if the archive is created, otherwise False.
+    """
+    stream = None
+    members = None
+    try:
+        stream = open_pipeline(file_name, encrypt, enc_pass, threads, compression, copies, split_size)
+        if cmd is None:
+            members = []
+            count = write_tar(stream, paths, recursive, extra, members, blocks, exclude, io_policy)
+            logger.debug("Number of archived entries: " + str(count))
+        elif host is not None:
+            code, err = utils.run_remote_stream(cmd, host, stream, cmd_log, policy=io_policy)
+            if code > 0:
+                raise RuntimeError("Command on " + host + " failed with status code: " + str(code) +
+                                   ", Standard Error: " + err)
+        else:
+            code, err = write_process_output(cmd, stream, cmd_log)
+            if code > 0:
+                raise RuntimeError(cmd[0] + " failed with status code: " + str(code) + ", Standard Error: " + err)
+        stream.close()
+        logger.debug("Uncompressed size: " + str(stream.bytes_in) +
+                     ", archive size: " + str(archive_size(file_name)))
+        if stream.bytes_stored > 0:
+            logger.info("Bytes compressed: " + str(stream.bytes_in - stream.bytes_stored) +
+                        ", bytes stored without compression: " + str(stream.bytes_stored))
+        if members is not None:
+            write_index(file_name, stream, str(encrypt).upper() == 'TRUE', members, copies)
+        stream = None
+        return True
+    except Exception as e:
+        logger.error("Error while creating archive: " + file_name + ", error: " + str(e))
+        if stream is not None:
+            try:
+                stream.abort()
+            except Exception as abort_error:
+                logger.debug("Error while aborting pipeline: " + str(abort_error))
+        for name in [file_name] + list(copies or []):
+            remove_archive(name)
+        return False
@@ -0,0 +1,449 @@
+#!/usr/bin/python3
+import os
+import hashlib
+import sqlite3
+import tarfile
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from compression import compression as compression_module
+from encryption import encryption
+
+logger = logging.getLogger("backup_logger")
+
+# suffix of the index that is written next to the archive, i.e. archive.tar.gz.index
+INDEX_SUFFIX = '.index'
+
+# openssl enc writes 'Salted__' and 8 bytes of salt before the encrypted data
+SALT_HEADER_SIZE = 16
+AES_BLOCK_SIZE = 16
+
+# maximum amount of compressed data that is read at once while a member is restored, 32MB
+READ_SIZE = 33554432
+
+
+class HashingReader:
+
+    def __init__(self, fileobj):
+        """
+        File like object that calculates sha256 of the data that is read through it
+
+        :param fileobj: Binary file like object
+        """
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class ArchiveIndex:
+
+    def __init__(self, index_file):
+        """
+        Index of the archive, stored in SQLite. It maps every member to its position in the uncompressed
+        tar stream, and every compressed frame to its position in the archive, so one member can be restored
+        by reading only the frames that contain it.
+
+        :param index_file: The SQLite file where the index is stored
+        """
+        self.index_file = index_file
+
+    def exists(self):
+        return os.path.exists(self.index_file)
+
+    def __connect(self, index_file=None):
+        connection = sqlite3.connect(index_file or self.index_file)
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS frames ('
+            'number INTEGER PRIMARY KEY, offset INTEGER, size INTEGER, raw_offset INTEGER, raw_size INTEGER)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS members ('
+            'path TEXT PRIMARY KEY, offset INTEGER, end INTEGER, size INTEGER, mtime INTEGER, sha256 TEXT)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS parts (number INTEGER PRIMARY KEY, name TEXT, offset INTEGER, size INTEGER)'
+        )
+        return connection
+
+    def write(self, codec, encrypted, frames, members, parts=None):
+        """
+        It writes the index to a temporary file and replaces the index file with it
+
+        :param codec: The Codec object used for compression
+        :param encrypted: True if the archive is encrypted
+        :param frames: A list of (uncompressed size, compressed size) of every frame, in order
+        :param members: A list of (path, offset, end, size, mtime, sha256) of every member
+        :param parts: A list of (name, size) of every part if the archive is split (optional)
+        """
+        tmp_file = self.index_file + '.tmp'
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        connection = self.__connect(tmp_file)
+        try:
+            with connection:
+                connection.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+                    ('codec', str(codec)),
+                    ('encrypted', str(bool(encrypted))),
+                ])
+                rows = []
+                offset = 0
+                raw_offset = 0
+                for number, (raw_size, size) in enumerate(frames):
+                    rows.append((number, offset, size, raw_offset, raw_size))
+                    offset += size
+                    raw_offset += raw_size
+                connection.executemany(
+                    'INSERT INTO frames (number, offset, size, raw_offset, raw_size) VALUES (?, ?, ?, ?, ?)', rows)
+                connection.executemany(
+                    'INSERT OR REPLACE INTO members (path, offset, end, size, mtime, sha256) VALUES (?, ?, ?, ?, ?, ?)',
+                    members)
+                rows = []
+                offset = 0
+                for number, (name, size) in enumerate(parts or []):
+                    rows.append((number, name, offset, size))
+                    offset += size
+                connection.executemany('INSERT INTO parts (number, name, offset, size) VALUES (?, ?, ?, ?)', rows)
+        finally:
+            connection.close()
+        os.replace(tmp_file, self.index_file)
+
+    def meta(self):
+        connection = self.__connect()
+        try:
+            return dict(connection.execute('SELECT key, value FROM meta'))
+        finally:
+            connection.close()
+
+    def find(self, path):
+        """
+        :param path: The path of the member, with or without leading '/'
+        :return: (path, offset, end, size, mtime, sha256) of the member, None if it isn't in the archive.
+        """
+        connection = self.__connect()
+        try:
+            for name in [path, '/' + path.lstrip('/')]:
+                row = connection.execute(
+                    'SELECT path, offset, end, size, mtime, sha256 FROM members WHERE path = ?', (name,)).fetchone()
+                if row is not None:
+                    return row
+            return None
+        finally:
+            connection.close()
+
+    def members(self, prefix=''):
+        """
+        :param prefix: Only members whose path starts with the prefix are returned (optional)
+        :return: A list of (path, offset, end, size, mtime, sha256), ordered by the position in the archive.
+        """
+        connection = self.__connect()
+        try:
+            return connection.execute(
+                'SELECT path, offset, end, size, mtime, sha256 FROM members WHERE substr(path, 1, ?) = ? '
+                'ORDER BY offset', (len(prefix), prefix)).fetchall()
+        finally:
+            connection.close()
+
+    def frames(self, raw_start, raw_end):
+        """
+        :param raw_start: Start of the range in the uncompressed stream
+        :param raw_end: End of the range in the uncompressed stream
+        :return: A list of (offset, size, raw_offset, raw_size) of the frames that contain the range.
+        """
+        connection = self.__connect()
+        try:
+            return connection.execute(
+                'SELECT offset, size, raw_offset, raw_size FROM frames '
+                'WHERE raw_offset < ? AND raw_offset + raw_size > ? ORDER BY number', (raw_end, raw_start)).fetchall()
+        finally:
+            connection.close()
+
+    def parts(self):
+        """
+        :return: A list of (name, offset, size) of the parts, empty if the archive isn't split.
+        """
+        connection = self.__connect()
+        try:
+            return connection.execute('SELECT name, offset, size FROM parts ORDER BY number').fetchall()
+        finally:
+            connection.close()
+
+
+def local_reader(directory):
+    """
+    It creates a function that reads a range of a file from the local directory
+
+    :param directory: The directory where the archive is stored
+    :return: Function (name, offset, length) -> bytes.
+    """
+    def read(name, offset, length):
+        with open(os.path.join(directory, name), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+    return read
+
+
+def evp_bytes_to_key(password, salt, key_size=32, iv_size=16):
+    """
+    It derives the key and the IV from the password the same way as `openssl enc` without -pbkdf2
+    (EVP_BytesToKey with sha256 and one iteration)
+
+    :param password: The password as bytes
+    :param salt: The salt from the header of the encrypted file
+    :return: The key and the IV.
+    """
+    derived = b''
+    block = b''
+    while len(derived) < key_size + iv_size:
+        block = hashlib.sha256(block + password + salt).digest()
+        derived += block
+    return derived[:key_size], derived[key_size:key_size + iv_size]
+
+
+class RangeReader:
+
+    def __init__(self, archive_name, index, read, enc_pass=None):
+        """
+        It reads ranges of the compressed stream of the archive, parts of a split archive are read as one file,
+        encrypted archives are decrypted from the nearest chunk, or from the nearest AES block if they are
+        encrypted with `openssl enc`, so only the requested range is read
+
+        :param archive_name: The name of the archive, without the directory
+        :param index: The ArchiveIndex of the archive
+        :param read: Function (name, offset, length) -> bytes that reads a range of a file
+        :param enc_pass: The password to decrypt the archive with
+        """
+        self.archive_name = archive_name
+        self.read = read
+        self.parts = index.parts()
+        self.encrypted = index.meta().get('encrypted') == 'True'
+        self.key = None
+        self.iv = None
+        self.cipher = None
+        if self.encrypted:
+            header = self.__read_file(0, encryption.HEADER_SIZE)
+            if header[:len(encryption.MAGIC)] == encryption.MAGIC:
+                self.cipher = encryption.ChunkCipher(header, enc_pass)
+            elif header[:8] == encryption.OPENSSL_MAGIC:
+                self.key, self.iv = evp_bytes_to_key(str(enc_pass).encode('utf-8'), header[8:SALT_HEADER_SIZE])
+            else:
+                raise RuntimeError("Archive: " + archive_name + " has unknown encryption")
+
+    def __read_file(self, offset, length):
+        if len(self.parts) == 0:
+            return self.read(self.archive_name, offset, length)
+        data = bytearray()
+        for name, part_offset, size in self.parts:
+            if part_offset + size <= offset or part_offset >= offset + length:
+                continue
+            start = max(offset, part_offset) - part_offset
+            end = min(offset + length, part_offset + size) - part_offset
+            data += self.read(name, start, end - start)
+        return bytes(data)
+
+    def read_range(self, offset, length):
+        """
+        :param offset: Offset in the compressed stream
+        :param length: Number of bytes to read
+        :return: The compressed data.
+        """
+        if not self.encrypted:
+            return self.__read_file(offset, length)
+        if self.cipher is not None:
+            # every chunk is decrypted on its own, so only chunks that contain the range are read
+            chunk_size = self.cipher.chunk_size
+            size = chunk_size + encryption.TAG_SIZE
+            first = offset // chunk_size
+            last = (offset + length - 1) // chunk_size if length > 0 else first
+            data = self.__read_file(encryption.HEADER_SIZE + first * size, (last - first + 1) * size)
+            data = self.cipher.decrypt_chunks(data, first)
+            return data[offset - first * chunk_size:offset - first * chunk_size + length]
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        start = offset - offset % AES_BLOCK_SIZE
+        end = offset + length
+        end = end + (AES_BLOCK_SIZE - end % AES_BLOCK_SIZE) % AES_BLOCK_SIZE
+        # in CBC mode the previous encrypted block is the IV of the next one
+        if start == 0:
+            iv = self.iv
+            data = self.__read_file(SALT_HEADER_SIZE, end)
+        else:
+            data = self.__read_file(SALT_HEADER_SIZE + start - AES_BLOCK_SIZE, end - start + AES_BLOCK_SIZE)
+            iv = data[:AES_BLOCK_SIZE]
+            data = data[AES_BLOCK_SIZE:]
+        decryptor = Cipher(algorithms.AES(self.key), modes.CBC(iv)).decryptor()
+        data = decryptor.update(data) + decryptor.finalize()
+        return data[offset - start:offset - start + length]
+
+
+class MemberStream:
+
+    def __init__(self, index, reader, codec, offset, end, threads=1):
+        """
+        File like object with the uncompressed range [offset, end) of the tar stream. Frames are read and
+        decompressed in batches, with more threads the next batches are read and decompressed in advance.
+
+        :param index: The ArchiveIndex of the archive
+        :param reader: The RangeReader of the archive
+        :param codec: The Codec object used for compression
+        :param offset: Start of the range in the uncompressed stream
+        :param end: End of the range in the uncompressed stream
+        :param threads: Number of batches that are decompressed at the same time, defaults to 1 (optional)
+        """
+        self.reader = reader
+        self.codec = codec
+        self.offset = offset
+        self.end = end
+        self.threads = max(1, int(threads))
+        # smaller batches with more threads, so every thread has work
+        batch_size = max(1, READ_SIZE // self.threads)
+        self.batches = []
+        for frame in index.frames(offset, end):
+            if self.batches and sum(f[1] for f in self.batches[-1]) + frame[1] <= batch_size:
+                self.batches[-1].append(frame)
+            else:
+                self.batches.append([frame])
+        self.batches.reverse()
+        self.__pending = deque()
+        self.__executor = None
+        if self.threads > 1:
+            self.__executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='decompress')
+        self.__buffer = bytearray()
+
+    def __decode(self, batch):
+        data = self.reader.read_range(batch[0][0], sum(f[1] for f in batch))
+        raw = bytearray()
+        position = 0
+        for offset, size, raw_offset, raw_size in batch:
+            block = self.codec.decompress_block(data[position:position + size])
+            position += size
+            # only the requested range of the first and the last frame is kept
+            raw += block[max(0, self.offset - raw_offset):self.end - raw_offset]
+        return raw
+
+    def __fill(self):
+        if self.__executor is None:
+            self.__buffer += self.__decode(self.batches.pop())
+            return
+        while self.batches and len(self.__pending) < self.threads * 2:
+            self.__pending.append(self.__executor.submit(self.__decode, self.batches.pop()))
+        self.__buffer += self.__pending.popleft().result()
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.__buffer) < size) and (self.batches or self.__pending):
+            self.__fill()
+        if size < 0:
+            size = len(self.__buffer)
+        data = bytes(self.__buffer[:size])
+        del self.__buffer[:size]
+        return data
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+
+
+def read_member(index, reader, path):
+    """
+    It reads the content of one member, i.e. the list of deleted paths
+
+    :param index: The ArchiveIndex of the archive
+    :param reader: The RangeReader of the archive
+    :param path: The path of the member
+    :return: The content of the member, None if it isn't in the archive.
+    """
+    member = index.find(path)
+    if member is None:
+        return None
+    codec = compression_module.parse_codec(index.meta().get('codec'))
+    stream = MemberStream(index, reader, codec, member[1], member[2])
+    with tarfile.open(fileobj=stream, mode='r|') as tar:
+        for tarinfo in tar:
+            return tar.extractfile(tarinfo).read()
+    return None
+
+
+def restore_members(index, reader, members, target_dir):
+    """
+    It reads only the frames between the first and the last member and extracts the members into the target
+    directory, the checksum of every restored file is compared to the one from the index
+
+    :param index: The ArchiveIndex of the archive
+    :param reader: The RangeReader of the archive
+    :param members: A list of (path, offset, end, size, mtime, sha256) of the members
+    :param target_dir: The directory where the members will be extracted
+    :return: True if every member is restored, otherwise False.
+    """
+    codec = compression_module.parse_codec(index.meta().get('codec'))
+    wanted = dict((member[0], member) for member in members)
+    stream = MemberStream(index, reader, codec, min(m[1] for m in members), max(m[2] for m in members))
+    restored = True
+    found = 0
+    with tarfile.open(fileobj=stream, mode='r|') as tar:
+        for tarinfo in tar:
+            if tarinfo.name not in wanted:
+                continue
+            member = wanted[tarinfo.name]
+            found += 1
+            tarinfo.name = tarinfo.name.lstrip('/')
+            if tarinfo.islnk():
+                tarinfo.linkname = tarinfo.linkname.lstrip('/')
+            tar.extract(tarinfo, path=target_dir)
+            if tarinfo.isreg() and member[5] and \
+                    file_sha256(os.path.join(target_dir, tarinfo.name)) != member[5]:
+                logger.error("Checksum of restored file: " + member[0] + " isn't correct")
+                restored = False
+    if found != len(wanted):
+        logger.error("Restored " + str(found) + " of " + str(len(wanted)) + " members")
+        return False
+    return restored
+
+
+def file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for data in iter(lambda: f.read(1048576), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def restore_file(archive_file, path, target_dir='/', enc_pass=None, index_file=None, read=None):
+    """
+    It restores one file, or one directory with its content, from the archive by reading only the frames
+    that contain it, instead of decompressing the whole archive
+
+    :param archive_file: The archive, with the directory if it is local
+    :param path: The path of the file or directory in the archive
+    :param target_dir: The directory where files will be extracted, defaults to / (optional)
+    :param enc_pass: The password to decrypt the archive with
+    :param index_file: The index of the archive, defaults to <archive>.index (optional)
+    :param read: Function (name, offset, length) -> bytes that reads a range of a file, i.e. from OneDrive,
+    defaults to reading from the directory of the archive (optional)
+    :return: True if every member is restored, otherwise False.
+    """
+    if index_file is None:
+        index_file = archive_file + INDEX_SUFFIX
+    if read is None:
+        read = local_reader(os.path.dirname(archive_file) or '.')
+    index = ArchiveIndex(index_file)
+    if not index.exists():
+        logger.error("Index of archive: " + archive_file + " doesn't exist")
+        return False
+    members = []
+    member = index.find(path)
+    if member is not None:
+        members.append(member)
+    members += index.members('/' + path.strip('/') + '/') + index.members(path.strip('/') + '/')
+    if len(members) == 0:
+        logger.error("Path: " + path + " isn't in the archive: " + archive_file)
+        return False
+    logger.info("Restoring: " + path + " from archive: " + archive_file + ", members: " + str(len(members)))
+    try:
+        reader = RangeReader(os.path.basename(archive_file), index, read, enc_pass)
+        return restore_members(index, reader, members, target_dir)
+    except Exception as e:
+        logger.error("Error while restoring: " + path + " from archive: " + archive_file + ", error: " + str(e))
+        return False
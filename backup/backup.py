@@ -18,6 +18,7 @@ config_file_path = '/etc/backup/backup.cnf'
 
 def mysql_module(mysql_conf):
     from mysql import mysql
+    from utils import utils
     if mysql_conf.host is None or \
             mysql_conf.host == '' or mysql_conf.host == '127.0.0.1' or mysql_conf.host == 'localhost':
         if mysql_conf.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -30,7 +31,9 @@ def mysql_module(mysql_conf):
                 enc_password=mysql_conf.enc_pass,
                 no_copies=mysql_conf.no_copies,
                 one_drive=onedrive,
-                one_drive_dir=mysql_conf.drive_dir
+                one_drive_dir=mysql_conf.drive_dir,
+                compression=mysql_conf.compression,
+                split_size=mysql_conf.split_size
             )
         else:
             mysql.mysqldump(
@@ -42,7 +45,9 @@ def mysql_module(mysql_conf):
                 enc_password=mysql_conf.enc_pass,
                 no_copies=mysql_conf.no_copies,
                 one_drive=None,
-                one_drive_dir=None
+                one_drive_dir=None,
+                compression=mysql_conf.compression,
+                split_size=mysql_conf.split_size
             )
     else:
         if mysql_conf.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -56,7 +61,11 @@ def mysql_module(mysql_conf):
                 one_drive=onedrive,
                 one_drive_dir=mysql_conf.drive_dir,
                 destination=mysql_conf.destination,
-                no_copies=mysql_conf.no_copies
+                no_copies=mysql_conf.no_copies,
+                compression=mysql_conf.compression,
+                stream=mysql_conf.stream,
+                split_size=mysql_conf.split_size,
+                io_policy=utils.IoPolicy(mysql_conf.io_rate_limit, mysql_conf.ionice, mysql_conf.nice)
             )
         else:
             mysql.mysqldump_remote(
@@ -69,20 +78,31 @@ def mysql_module(mysql_conf):
                 one_drive=None,
                 one_drive_dir=None,
                 destination=mysql_conf.destination,
-                no_copies=mysql_conf.no_copies
+                no_copies=mysql_conf.no_copies,
+                compression=mysql_conf.compression,
+                stream=mysql_conf.stream,
+                split_size=mysql_conf.split_size,
+                io_policy=utils.IoPolicy(mysql_conf.io_rate_limit, mysql_conf.ionice, mysql_conf.nice)
             )
+        utils.SSH_POOL.log_metrics()
 
 
 def rsync_module(sync):
     from file_management import file_management
+    from utils import utils
     if sync.host is None or sync.host == '' or sync.host == '127.0.0.1' or sync.host == 'localhost':
-        file_management.sync(sync.src, sync.dst)
+        file_management.sync(sync.src, sync.dst, engine=sync.engine, threads=sync.threads,
+                             parallelism=sync.parallelism, full_scan_interval=sync.full_scan_interval,
+                             whole_file=sync.whole_file)
     else:
         file_management.sync_remote(
             host=sync.host,
             source=sync.src,
-            destination=sync.dst
+            destination=sync.dst,
+            io_policy=utils.IoPolicy(sync.io_rate_limit, sync.ionice, sync.nice),
+            parallelism=sync.parallelism
         )
+        utils.SSH_POOL.log_metrics()
 
 
 def elastic_module(elast):
@@ -120,10 +140,18 @@ def elastic_module(elast):
 
 def targz_module(dirs):
     from targz import targz
+    from exclude import exclude as exclude_module
+    from utils import utils
     if type(dirs.path) is str:
         dirs.path = dirs.path.split(';')
     if type(dirs.destination) is str:
         dirs.destination = dirs.destination.split(';')
+    exclude = exclude_module.load(dirs.exclude, dirs.exclude_from)
+    # one policy for the whole section, so paths that are archived at the same time share the rate
+    if dirs.host is not None:
+        io_policy = utils.IoPolicy(dirs.io_rate_limit, dirs.ionice, dirs.nice)
+    else:
+        io_policy = utils.IoPolicy(dirs.io_rate_limit)
     if dirs.host is not None:
         if dirs.backup_type.upper() == "INCREMENTAL":
             if dirs.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -134,7 +162,14 @@ def targz_module(dirs):
                     encrypt=dirs.encrypt,
                     enc_pass=dirs.enc_pass,
                     one_drive=onedrive,
-                    one_drive_dir=dirs.drive_dir
+                    one_drive_dir=dirs.drive_dir,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    stream=dirs.stream,
+                    threads=dirs.threads,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
             else:
                 targz.targz_incremental_remote(
@@ -144,7 +179,14 @@ def targz_module(dirs):
                     encrypt=dirs.encrypt,
                     enc_pass=dirs.enc_pass,
                     one_drive=None,
-                    one_drive_dir=None
+                    one_drive_dir=None,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    stream=dirs.stream,
+                    threads=dirs.threads,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
         elif dirs.backup_type.upper() == "DIFFERENTIAL":
             if dirs.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -155,7 +197,14 @@ def targz_module(dirs):
                     encrypt=dirs.encrypt,
                     enc_pass=dirs.enc_pass,
                     one_drive=onedrive,
-                    one_drive_dir=dirs.drive_dir
+                    one_drive_dir=dirs.drive_dir,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    stream=dirs.stream,
+                    threads=dirs.threads,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
             else:
                 targz.targz_differential_remote(
@@ -165,7 +214,14 @@ def targz_module(dirs):
                     encrypt=dirs.encrypt,
                     enc_pass=dirs.enc_pass,
                     one_drive=None,
-                    one_drive_dir=None
+                    one_drive_dir=None,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    stream=dirs.stream,
+                    threads=dirs.threads,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
         elif dirs.backup_type.upper() == "FULL":
             if dirs.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -176,7 +232,14 @@ def targz_module(dirs):
                     encrypt=dirs.encrypt,
                     enc_pass=dirs.enc_pass,
                     one_drive=onedrive,
-                    one_drive_dir=dirs.drive_dir
+                    one_drive_dir=dirs.drive_dir,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    stream=dirs.stream,
+                    threads=dirs.threads,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
             else:
                 targz.targz_remote(
@@ -186,8 +249,19 @@ def targz_module(dirs):
                     encrypt=dirs.encrypt,
                     enc_pass=dirs.enc_pass,
                     one_drive=None,
-                    one_drive_dir=None
+                    one_drive_dir=None,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    stream=dirs.stream,
+                    threads=dirs.threads,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
+        elif dirs.backup_type.upper() == "DEDUP":
+            logger.warning(
+                "Backup type dedup is supported only for local directories, "
+                "please use full, differential or incremental for remote_backup_dirs!")
         else:
             logger.warning(
                 "Remote_backup_dirs is True, "
@@ -203,6 +277,13 @@ def targz_module(dirs):
                     enc_pass=dirs.enc_pass,
                     one_drive=onedrive,
                     one_drive_dir=dirs.drive_dir,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    split_size=dirs.split_size,
+                    block_threshold=dirs.block_threshold,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
             else:
                 targz.targz_incremental(
@@ -212,6 +293,13 @@ def targz_module(dirs):
                     enc_pass=dirs.enc_pass,
                     one_drive=None,
                     one_drive_dir=None,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    split_size=dirs.split_size,
+                    block_threshold=dirs.block_threshold,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
         elif dirs.backup_type.upper() == "DIFFERENTIAL":
             if dirs.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -222,6 +310,13 @@ def targz_module(dirs):
                     enc_pass=dirs.enc_pass,
                     one_drive=onedrive,
                     one_drive_dir=dirs.drive_dir,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    split_size=dirs.split_size,
+                    block_threshold=dirs.block_threshold,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
             else:
                 targz.targz_differential(
@@ -231,6 +326,13 @@ def targz_module(dirs):
                     enc_pass=dirs.enc_pass,
                     one_drive=None,
                     one_drive_dir=None,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    split_size=dirs.split_size,
+                    block_threshold=dirs.block_threshold,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
         elif dirs.backup_type.upper() == "FULL":
             if dirs.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
@@ -241,6 +343,12 @@ def targz_module(dirs):
                     enc_pass=dirs.enc_pass,
                     one_drive=onedrive,
                     one_drive_dir=dirs.drive_dir,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
                 )
             else:
                 targz.targz(
@@ -250,10 +358,50 @@ def targz_module(dirs):
                     enc_pass=dirs.enc_pass,
                     one_drive=None,
                     one_drive_dir=None,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    split_size=dirs.split_size,
+                    exclude=exclude,
+                    io_policy=io_policy
+                )
+        elif dirs.backup_type.upper() == "DEDUP":
+            from dedup import dedup
+            if dirs.upload_to_onedrive.upper() == 'TRUE' and onedrive is not None:
+                dedup.dedup(
+                    paths=dirs.path,
+                    destinations=dirs.destination,
+                    encrypt=dirs.encrypt,
+                    enc_pass=dirs.enc_pass,
+                    one_drive=onedrive,
+                    one_drive_dir=dirs.drive_dir,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    exclude=exclude,
+                    io_policy=io_policy,
+                    no_copies=dirs.no_copies
+                )
+            else:
+                dedup.dedup(
+                    paths=dirs.path,
+                    destinations=dirs.destination,
+                    encrypt=dirs.encrypt,
+                    enc_pass=dirs.enc_pass,
+                    one_drive=None,
+                    one_drive_dir=None,
+                    threads=dirs.threads,
+                    compression=dirs.compression,
+                    parallel_paths=dirs.parallel_paths,
+                    exclude=exclude,
+                    io_policy=io_policy,
+                    no_copies=dirs.no_copies
                 )
         else:
             logger.warning(
                 "Targz is True, but the specified backup_type isn't proper. Please check configuration file!")
+    if dirs.host is not None:
+        utils.SSH_POOL.log_metrics()
 
 
 def run_modules(conf):
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""
+Benchmark for the block-parallel compressor used by targz.
+
+It compresses the same generated data with 1..N threads and prints throughput and speedup
+compared to a single thread. Usage:
+
+    python3 benchmarks/parallel_compression.py [size in MB] [max threads] [compression]
+"""
+import os
+import io
+import sys
+import random
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import compression  # noqa: E402
+
+
+class NullSink:
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.data = bytearray()
+        self.keep = False
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        if self.keep:
+            self.data += data
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def generate_data(size):
+    """
+    It generates data that compresses roughly like a mix of text files and binaries
+
+    :param size: Size of generated data in bytes
+    :return: The generated data.
+    """
+    rnd = random.Random(42)
+    words = [bytes(rnd.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(2, 10)))
+             for _ in range(2000)]
+    data = bytearray()
+    while len(data) < size:
+        if rnd.random() < 0.1:
+            data += os.urandom(4096)
+        else:
+            data += b' '.join(rnd.choice(words) for _ in range(600)) + b'\n'
+    return bytes(data[:size])
+
+
+def run(data, threads, codec):
+    sink = NullSink()
+    stage = compression.ParallelCompressStage(sink, codec=codec, threads=threads)
+    start = timer()
+    for i in range(0, len(data), 65536):
+        stage.write(data[i:i + 65536])
+    stage.close()
+    return timer() - start, sink.bytes_written
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    codec = compression.parse_codec(sys.argv[3] if len(sys.argv) > 3 else None)
+    data = generate_data(size * 1048576)
+
+    # sanity check, output has to be readable as one stream by the standard decompressor
+    sink = NullSink()
+    sink.keep = True
+    stage = compression.ParallelCompressStage(sink, codec=codec, threads=max_threads)
+    stage.write(data[:8 * 1048576])
+    stage.close()
+    assert codec.open_reader(io.BytesIO(bytes(sink.data))).read() == data[:8 * 1048576]
+
+    print("data: " + str(size) + " MB, cpus: " + str(os.cpu_count()) + ", compression: " + str(codec))
+    print("{0:>8} {1:>10} {2:>12} {3:>8} {4:>8}".format("threads", "seconds", "MB/s", "speedup", "ratio"))
+    base = None
+    threads = 1
+    while threads <= max_threads:
+        elapsed, out = run(data, threads, codec)
+        if base is None:
+            base = elapsed
+        print("{0:>8} {1:>10.2f} {2:>12.1f} {3:>8.2f} {4:>8.3f}".format(
+            threads, elapsed, size / elapsed, base / elapsed, out / len(data)))
+        threads = threads * 2 if threads * 2 <= max_threads or threads == max_threads else max_threads
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
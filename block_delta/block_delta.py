@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+import os
+import json
+import hashlib
+import tarfile
+import tempfile
+import logging
+from utils import utils
+
+logger = logging.getLogger("backup_logger")
+
+# size of the block that is compared between backups, 4MB
+BLOCK_SIZE = 4194304
+
+# size of the digest of one block, in bytes
+DIGEST_SIZE = 16
+
+# suffix of the archive member that contains only changed blocks of the file, i.e. /data/vm.img.backup-delta
+DELTA_SUFFIX = '.backup-delta'
+
+# changed blocks are kept in memory up to this size, and then in a temporary file, 64MB
+SPOOL_SIZE = 67108864
+
+
+def block_digest(block):
+    return hashlib.blake2b(block, digest_size=DIGEST_SIZE).digest()
+
+
+class BlockHashReader:
+
+    def __init__(self, fileobj, block_size=BLOCK_SIZE):
+        """
+        File like object that calculates the digest of every block and sha256 of the data that is read through it
+
+        :param fileobj: Binary file like object
+        :param block_size: Size of the block, defaults to 4MB (optional)
+        """
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.hashes = bytearray()
+        self.sha256 = hashlib.sha256()
+        self.__block = bytearray()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        self.__block += data
+        while len(self.__block) >= self.block_size:
+            self.hashes += block_digest(bytes(self.__block[:self.block_size]))
+            del self.__block[:self.block_size]
+        if not data and self.__block:
+            self.hashes += block_digest(bytes(self.__block))
+            self.__block = bytearray()
+        return data
+
+    def finish(self):
+        """
+        :return: Digests of all blocks, the last block is included even if the file wasn't read to the end.
+        """
+        if self.__block:
+            self.hashes += block_digest(bytes(self.__block))
+            self.__block = bytearray()
+        return bytes(self.hashes)
+
+
+class BytesReader:
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.data) - self.position
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+
+class ConcatReader:
+
+    def __init__(self, readers):
+        """
+        File like object that reads the provided file like objects one after another
+
+        :param readers: A list of binary file like objects
+        """
+        self.readers = list(readers)
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = b''
+        while self.readers and (size < 0 or len(data) < size):
+            chunk = self.readers[0].read(-1 if size < 0 else size - len(data))
+            if not chunk:
+                self.readers.pop(0)
+                continue
+            data += chunk
+        self.sha256.update(data)
+        return data
+
+
+class BlockState:
+
+    def __init__(self, previous, threshold, block_size=BLOCK_SIZE):
+        """
+        Block digests of large files. A file that has digests from the previous backup is archived as a delta
+        member with only changed blocks, every other large file is archived as a whole and its digests are
+        calculated while it is archived, so every file is read only once.
+
+        :param previous: Dictionary path -> (block size, digests) from the previous backup
+        :param threshold: Files of this size or bigger are compared block by block, 0 disables it
+        :param block_size: Size of the block, defaults to 4MB (optional)
+        """
+        self.previous = previous
+        self.threshold = int(threshold)
+        self.block_size = block_size
+        # path -> (block size, digests) of every large file in this backup
+        self.current = {}
+        self.delta_files = 0
+        self.delta_bytes = 0
+
+    def applies(self, size):
+        return 0 < self.threshold <= size
+
+    def is_delta(self, name):
+        """
+        :param name: The path of the file
+        :return: True if the file has digests from the previous backup, so it is archived as a delta.
+        """
+        previous = self.previous.get(name)
+        return previous is not None and previous[0] == self.block_size
+
+    def add(self, tar, name, tarinfo, io_policy=None):
+        """
+        It writes the regular file to the tar, as a delta member if the file has digests from the previous
+        backup with the same block size, otherwise as a whole
+
+        :param tar: The TarFile
+        :param name: The path of the file
+        :param tarinfo: The TarInfo of the file
+        :param io_policy: The IoPolicy, the file is read through it (optional)
+        :return: The name of the member and sha256 of its content.
+        """
+        if not self.is_delta(name):
+            with utils.open_file(name, io_policy) as f:
+                reader = BlockHashReader(f, self.block_size)
+                tar.addfile(tarinfo, reader)
+            self.current[name] = (self.block_size, reader.finish())
+            return name, reader.sha256.hexdigest()
+        return self.__add_delta(tar, name, tarinfo, self.previous[name][1], io_policy)
+
+    def __add_delta(self, tar, name, tarinfo, previous_hashes, io_policy=None):
+        hashes = bytearray()
+        changed = []
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            with utils.open_file(name, io_policy) as f:
+                number = 0
+                while True:
+                    block = f.read(self.block_size)
+                    if not block:
+                        break
+                    size += len(block)
+                    digest = block_digest(block)
+                    hashes += digest
+                    if previous_hashes[number * DIGEST_SIZE:(number + 1) * DIGEST_SIZE] != digest:
+                        changed.append(number)
+                        spool.write(block)
+                    number += 1
+            header = json.dumps({
+                'size': size,
+                'block_size': self.block_size,
+                'blocks': changed,
+                'mode': tarinfo.mode,
+                'mtime': tarinfo.mtime,
+            }).encode('utf-8') + b'\n'
+            delta_info = tarfile.TarInfo(name + DELTA_SUFFIX)
+            delta_info.size = len(header) + spool.tell()
+            delta_info.mtime = tarinfo.mtime
+            delta_info.mode = tarinfo.mode
+            delta_info.uid = tarinfo.uid
+            delta_info.gid = tarinfo.gid
+            delta_info.uname = tarinfo.uname
+            delta_info.gname = tarinfo.gname
+            spool.seek(0)
+            reader = ConcatReader([BytesReader(header), spool])
+            tar.addfile(delta_info, reader)
+        self.current[name] = (self.block_size, bytes(hashes))
+        self.delta_files += 1
+        self.delta_bytes += delta_info.size
+        logger.debug("File: " + name + " archived as delta, changed blocks: " + str(len(changed)))
+        return delta_info.name, reader.sha256.hexdigest()
+
+
+def apply_delta(delta, file_name):
+    """
+    It writes the changed blocks from the delta member into the file restored from the previous archives,
+    and sets the size, mode and modification time of the file
+
+    :param delta: Binary file like object with the content of the delta member
+    :param file_name: The file that is patched
+    """
+    header = json.loads(delta.readline().decode('utf-8'))
+    block_size = header['block_size']
+    with open(file_name, 'r+b') as f:
+        for number in header['blocks']:
+            f.seek(number * block_size)
+            remaining = min(block_size, header['size'] - number * block_size)
+            while remaining > 0:
+                data = delta.read(min(remaining, 1048576))
+                if not data:
+                    raise RuntimeError("Delta of file: " + file_name + " is incomplete")
+                f.write(data)
+                remaining -= len(data)
+        f.truncate(header['size'])
+    os.chmod(file_name, header['mode'])
+    os.utime(file_name, (header['mtime'], header['mtime']))
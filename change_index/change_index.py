@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+import os
+import stat
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger("backup_logger")
+
+# number of threads that read directories at the same time
+SCAN_THREADS = 8
+
+# name of the archive member that contains the list of deleted paths
+DELETED_MEMBER = '.backup-deleted'
+
+# name of the empty archive member that marks the first archive of a chain, created when there was no index
+BASE_MEMBER = '.backup-base'
+
+
+def scan_directory(directory, exclude=None):
+    """
+    It reads one directory and stats every entry in it, symbolic links are not followed
+
+    :param directory: The directory to read
+    :param exclude: The ExcludeMatcher, entries that match it are skipped without stat (optional)
+    :return: A list of (path, state) tuples and a list of subdirectories.
+    """
+    entries = []
+    subdirectories = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if exclude and exclude.excluded(entry.path):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append((entry.path, (st.st_ino, st.st_mtime_ns, st.st_size, st.st_ctime_ns, st.st_mode)))
+                if stat.S_ISDIR(st.st_mode):
+                    subdirectories.append(entry.path)
+    except OSError as e:
+        logger.error("Can't read directory: " + directory + ", error: " + str(e))
+    return entries, subdirectories
+
+
+def scan(paths, threads=SCAN_THREADS, exclude=None):
+    """
+    It walks the provided paths with a pool of threads, every thread reads one directory at a time
+
+    :param paths: A list of files and directories
+    :param threads: Number of threads that read directories, defaults to 8 (optional)
+    :param exclude: The ExcludeMatcher, excluded directories are not read (optional)
+    :return: Dictionary path -> (inode, mtime, size, ctime, mode) for every entry under the paths.
+    """
+    state = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(threads)), thread_name_prefix='scan') as executor:
+        pending = set()
+        for path in paths:
+            try:
+                st = os.lstat(path)
+            except OSError as e:
+                logger.error("Can't stat path: " + path + ", error: " + str(e))
+                continue
+            state[path] = (st.st_ino, st.st_mtime_ns, st.st_size, st.st_ctime_ns, st.st_mode)
+            if stat.S_ISDIR(st.st_mode):
+                pending.add(executor.submit(scan_directory, path, exclude))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subdirectories = future.result()
+                state.update(entries)
+                for directory in subdirectories:
+                    pending.add(executor.submit(scan_directory, directory, exclude))
+    return state
+
+
+class ChangeIndex:
+
+    def __init__(self, index_file):
+        """
+        Index of the files from the previous backup, stored in SQLite and keyed by path.
+        It replaces GNU tar snapshot (.snap) files for incremental and differential backups.
+
+        :param index_file: The SQLite file where the index is stored
+        """
+        self.index_file = index_file
+
+    def exists(self):
+        return os.path.exists(self.index_file)
+
+    def __connect(self):
+        connection = sqlite3.connect(self.index_file)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, inode INTEGER, mtime INTEGER, size INTEGER, ctime INTEGER, mode INTEGER)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS blocks (path TEXT PRIMARY KEY, block_size INTEGER, hashes BLOB)'
+        )
+        return connection
+
+    def load(self):
+        """
+        It loads the index from the file
+
+        :return: Dictionary path -> (inode, mtime, size, ctime, mode), empty if the index doesn't exist.
+        """
+        if not self.exists():
+            return {}
+        connection = self.__connect()
+        try:
+            state = {}
+            for row in connection.execute('SELECT path, inode, mtime, size, ctime, mode FROM files'):
+                state[row[0]] = row[1:]
+            return state
+        finally:
+            connection.close()
+
+    def update(self, changed, deleted, state):
+        """
+        It writes only the changed and deleted paths to the index, in one transaction
+
+        :param changed: A list of changed or new paths
+        :param deleted: A list of deleted paths
+        :param state: Current state of the paths, as returned by scan
+        """
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO files (path, inode, mtime, size, ctime, mode) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((path,) + tuple(state[path]) for path in changed)
+                )
+                connection.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in deleted))
+        finally:
+            connection.close()
+
+    def load_blocks(self):
+        """
+        It loads the block digests of large files from the previous backup
+
+        :return: Dictionary path -> (block size, digests), empty if the index doesn't exist.
+        """
+        if not self.exists():
+            return {}
+        connection = self.__connect()
+        try:
+            blocks = {}
+            for row in connection.execute('SELECT path, block_size, hashes FROM blocks'):
+                blocks[row[0]] = (row[1], bytes(row[2]))
+            return blocks
+        finally:
+            connection.close()
+
+    def update_blocks(self, current, removed):
+        """
+        It writes the block digests of the files that were archived, in one transaction
+
+        :param current: Dictionary path -> (block size, digests) of the archived large files
+        :param removed: A list of paths whose digests are no longer valid, i.e. deleted files or files that
+        were archived without digests
+        """
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO blocks (path, block_size, hashes) VALUES (?, ?, ?)',
+                    ((path, current[path][0], current[path][1]) for path in current)
+                )
+                connection.executemany('DELETE FROM blocks WHERE path = ?', ((path,) for path in removed))
+        finally:
+            connection.close()
+
+
+def changes(previous, current):
+    """
+    It compares two states of the same paths. A path is changed if it is new or if its inode, mtime, size,
+    ctime or mode is different.
+
+    :param previous: Previous state, as returned by scan or ChangeIndex.load
+    :param current: Current state, as returned by scan
+    :return: Sorted list of changed paths and sorted list of deleted paths.
+    """
+    changed = [path for path, state in current.items() if tuple(previous.get(path, ())) != tuple(state)]
+    deleted = [path for path in previous if path not in current]
+    changed.sort()
+    deleted.sort()
+    return changed, deleted
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from archive_index import archive_index
+
+logger = logging.getLogger("backup_logger")
+
+# suffix of the checksums that are written next to the archive, i.e. archive.tar.gz.sums
+CHECKSUM_SUFFIX = '.sums'
+
+# size of the chunk that has its own hash and can be verified alone, 4MB
+CHUNK_SIZE = 4194304
+
+
+def merkle_root(hashes):
+    """
+    It calculates the root of the Merkle tree over the chunk hashes, every node is sha256 of 0x01 and its two
+    children, a node without a pair is moved to the next level as it is. The root of a file with one chunk
+    is sha256 of the whole file.
+
+    :param hashes: A list of digests (bytes) of chunks, in order
+    :return: Hex digest of the root, sha256 of empty data if there are no chunks.
+    """
+    if len(hashes) == 0:
+        return hashlib.sha256(b'').hexdigest()
+    level = list(hashes)
+    while len(level) > 1:
+        level = [hashlib.sha256(b'\x01' + level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+class TreeHash:
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        """
+        It calculates sha256 of every chunk of the data that is passed to update, and the root of the tree
+        when it is finished, so data is hashed only once
+
+        :param chunk_size: Size of the chunk, defaults to 4MB (optional)
+        """
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.chunks = []
+        self.__hash = hashlib.sha256()
+        self.__filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        self.size += len(view)
+        while len(view) > 0:
+            size = min(len(view), self.chunk_size - self.__filled)
+            self.__hash.update(view[:size])
+            self.__filled += size
+            view = view[size:]
+            if self.__filled == self.chunk_size:
+                self.__next_chunk()
+
+    def __next_chunk(self):
+        self.chunks.append(self.__hash.digest())
+        self.__hash = hashlib.sha256()
+        self.__filled = 0
+
+    def result(self, name):
+        """
+        :param name: The name of the file, without the directory
+        :return: Dictionary with name, size, root and hex digests of all chunks of the file.
+        """
+        if self.__filled > 0:
+            self.__next_chunk()
+        return {
+            'name': name,
+            'size': self.size,
+            'root': merkle_root(self.chunks),
+            'chunks': [chunk.hex() for chunk in self.chunks]
+        }
+
+
+def write_checksums(sums_file, files, chunk_size=CHUNK_SIZE):
+    """
+    It writes the checksums of the files of one archive, the root is the root of the tree over roots of
+    all files, so one value identifies the whole archive
+
+    :param sums_file: The file that will be created, i.e. archive.tar.gz.sums
+    :param files: A list of results of TreeHash, one for the archive or for every part if it is split
+    :param chunk_size: Size of the chunk the files are hashed in
+    :return: The root of the archive.
+    """
+    root = merkle_root([bytes.fromhex(f['root']) for f in files])
+    sums = {
+        'algorithm': 'sha256',
+        'chunk_size': chunk_size,
+        'size': sum(f['size'] for f in files),
+        'root': root,
+        'files': files
+    }
+    with open(sums_file + '.tmp', 'w') as f:
+        json.dump(sums, f, separators=(',', ':'))
+    os.replace(sums_file + '.tmp', sums_file)
+    return root
+
+
+def load(sums_file):
+    with open(sums_file) as f:
+        return json.load(f)
+
+
+def verify(sums, read, threads=4, sample=0):
+    """
+    It reads chunks of the files listed in the checksums and compares their sha256. Every chunk is read with its
+    own range, in parallel, so a sample of chunks can be verified without reading whole files, i.e. a copy
+    on another destination or an upload.
+
+    :param sums: The checksums, as returned by load
+    :param read: Function (name, offset, length) -> bytes that reads a range of the file
+    :param threads: Number of chunks that are read at the same time, defaults to 4 (optional)
+    :param sample: Number of random chunks of every file that are verified, the last chunk is always verified,
+    0 verifies all chunks (optional)
+    :return: A list of names of files that are damaged or can't be read, empty if all files are fine.
+    """
+    chunk_size = sums['chunk_size']
+    damaged = []
+    tasks = []
+    for f in sums['files']:
+        # the chunks have to match the root, otherwise the checksums themselves are damaged
+        if merkle_root([bytes.fromhex(chunk) for chunk in f['chunks']]) != f['root']:
+            logger.error("Checksums of file: " + f['name'] + " don't match its root")
+            damaged.append(f['name'])
+            continue
+        numbers = list(range(len(f['chunks'])))
+        if 0 < int(sample) < len(numbers):
+            numbers = sorted(random.sample(numbers[:-1], int(sample) - 1)) + [numbers[-1]]
+        tasks += [(f, number) for number in numbers]
+
+    def check(task):
+        f, number = task
+        offset = number * chunk_size
+        length = min(chunk_size, f['size'] - offset)
+        try:
+            data = read(f['name'], offset, length)
+        except Exception as e:
+            logger.error("Error while reading file: " + f['name'] + ", error: " + str(e))
+            return False
+        if len(data) != length or hashlib.sha256(data).hexdigest() != f['chunks'][number]:
+            logger.error("Chunk " + str(number) + " of file: " + f['name'] + " is damaged")
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, int(threads)), thread_name_prefix='verify') as executor:
+        results = list(executor.map(check, tasks))
+    for i in range(len(tasks)):
+        if not results[i] and tasks[i][0]['name'] not in damaged:
+            damaged.append(tasks[i][0]['name'])
+    logger.debug("Verified chunks: " + str(len(tasks)) + ", damaged files: " + str(len(damaged)))
+    return damaged
+
+
+def verify_local(file_name, threads=4, sample=0):
+    """
+    It verifies the archive, or all its parts if it is split, against <archive>.sums
+
+    :param file_name: The name of the archive
+    :param threads: Number of chunks that are read at the same time, defaults to 4 (optional)
+    :param sample: Number of random chunks of every file that are verified, 0 verifies all chunks (optional)
+    :return: A list of names of files that are missing or damaged, empty if the archive is fine.
+    """
+    sums = load(file_name + CHECKSUM_SUFFIX)
+    directory = os.path.dirname(file_name)
+    missing = []
+    for f in sums['files']:
+        path = os.path.join(directory, f['name'])
+        if not os.path.exists(path) or os.path.getsize(path) != f['size']:
+            logger.error("File: " + path + " is missing or has wrong size")
+            missing.append(f['name'])
+    sums['files'] = [f for f in sums['files'] if f['name'] not in missing]
+    return missing + verify(sums, archive_index.local_reader(directory), threads, sample)
+
+
+def main(args):
+    """
+    Command line interface for verification, i.e.
+    main.py verify --file /data/backup/data-www-full-20240101120000.tar.gz --sample 16
+
+    :param args: Command line arguments after `verify`
+    :return: True if all archives are fine, otherwise False.
+    """
+    parser = argparse.ArgumentParser(prog='main.py verify', description='Verify archives against their checksums')
+    parser.add_argument('--file', required=True, action='append', help='archive to verify, can be repeated')
+    parser.add_argument('--sample', default=0, type=int,
+                        help='number of random chunks of every file to verify, defaults to 0 (all chunks)')
+    parser.add_argument('--threads', default=4, type=int, help='number of threads, defaults to 4')
+    parser.add_argument('--log-level', default='INFO', help='log level, defaults to INFO')
+    options = parser.parse_args(args)
+
+    handler = logging.StreamHandler(stream=sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s  %(levelname)s: %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(options.log_level.upper())
+
+    result = True
+    for file_name in options.file:
+        try:
+            damaged = verify_local(file_name, options.threads, options.sample)
+        except (OSError, ValueError) as e:
+            logger.error("Can't read checksums of archive: " + file_name + ", error: " + str(e))
+            result = False
+            continue
+        if len(damaged) > 0:
+            logger.error("Archive: " + file_name + " is damaged, files: " + ', '.join(damaged))
+            result = False
+        else:
+            logger.info("Archive: " + file_name + " is fine")
+    return result
@@ -0,0 +1,431 @@
+#!/usr/bin/python3
+import os
+import gzip
+import math
+import lzma
+import zlib
+import struct
+import logging
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from utils import utils
+
+logger = logging.getLogger("backup_logger")
+
+# size of the block that is compressed as one independent frame, 1MB
+BLOCK_SIZE = 1048576
+
+DEFAULT_COMPRESSION = 'gzip:6'
+
+# extensions of files that are already compressed, they are stored without compression
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.gz', '.tgz', '.bz2', '.xz', '.txz', '.zst', '.lz4', '.lzma', '.zip', '.7z', '.rar', '.jar', '.war',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif', '.mp3', '.aac', '.ogg', '.opus', '.flac', '.m4a',
+    '.mp4', '.m4v', '.mkv', '.avi', '.mov', '.webm', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.apk', '.deb',
+    '.rpm', '.enc', '.gpg',
+}
+
+# files smaller than this are always compressed, a stored frame of a small file isn't worth the frame overhead
+MIN_STORE_SIZE = 131072
+
+# number of bytes from the start of the file that are used to estimate the entropy, 64KB
+SAMPLE_SIZE = 65536
+
+# files whose sample has bigger entropy, in bits per byte, are stored without compression
+ENTROPY_THRESHOLD = 7.5
+
+# biggest chunk of uncompressed data in one LZMA2 chunk and in one zstd block
+LZMA2_CHUNK_SIZE = 65536
+ZSTD_BLOCK_SIZE = 131072
+
+
+class Codec:
+
+    def __init__(self, name, level, extension, block_size=BLOCK_SIZE):
+        """
+        Description of a compression codec. Every block is compressed as a complete, independent frame
+        (gzip member, zstd frame, lz4 frame, xz stream), and all of those formats allow concatenated frames,
+        so the output can be read by the standard command line tools.
+
+        :param name: Name of the codec: gzip, zstd, lz4, xz or none
+        :param level: Compression level
+        :param extension: Extension that is appended to the archive name, i.e. '.gz'
+        :param block_size: Size of the uncompressed block, defaults to 1MB (optional)
+        """
+        self.name = name
+        self.level = level
+        self.extension = extension
+        self.block_size = block_size
+
+    def __str__(self):
+        if self.name == 'none':
+            return self.name
+        return self.name + ':' + str(self.level)
+
+    def compress_block(self, data):
+        """
+        It compresses the data as one independent frame
+
+        :param data: The data to compress
+        :return: The compressed frame.
+        """
+        if self.name == 'gzip':
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        if self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        if self.name == 'lz4':
+            import lz4.frame
+            return lz4.frame.compress(data, compression_level=self.level)
+        if self.name == 'xz':
+            return lzma.compress(data, format=lzma.FORMAT_XZ, preset=self.level)
+        return data
+
+    def decompress_block(self, data):
+        """
+        It decompresses one frame created by compress_block
+
+        :param data: The compressed frame
+        :return: The uncompressed data.
+        """
+        if self.name == 'gzip':
+            return zlib.decompress(data, 31)
+        if self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        if self.name == 'lz4':
+            import lz4.frame
+            return lz4.frame.decompress(data)
+        if self.name == 'xz':
+            return lzma.decompress(data, format=lzma.FORMAT_XZ)
+        return data
+
+    def store_block(self, data):
+        """
+        It writes the data as one independent frame without compression, the frame is still valid for the
+        format, so the archive is read the same way as every other archive. gzip uses stored deflate blocks,
+        zstd raw blocks and xz uncompressed LZMA2 chunks, lz4 uses its fastest level because lz4 already
+        stores blocks that don't compress.
+
+        :param data: The data to store
+        :return: The frame.
+        """
+        if self.name == 'gzip':
+            compressor = zlib.compressobj(0, zlib.DEFLATED, 31)
+            return compressor.compress(data) + compressor.flush()
+        if self.name == 'zstd':
+            return zstd_raw_frame(data)
+        if self.name == 'lz4':
+            import lz4.frame
+            return lz4.frame.compress(data, compression_level=0)
+        if self.name == 'xz':
+            return xz_raw_stream(data)
+        return data
+
+    def open_reader(self, fileobj):
+        """
+        It wraps a file like object that contains compressed data and returns a file like object that
+        returns decompressed data, all frames are read one after another
+
+        :param fileobj: Binary file like object with compressed data
+        :return: Binary file like object with decompressed data.
+        """
+        if self.name == 'gzip':
+            return gzip.GzipFile(fileobj=fileobj, mode='rb')
+        if self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+        if self.name == 'lz4':
+            import lz4.frame
+            return lz4.frame.LZ4FrameFile(fileobj, mode='rb')
+        if self.name == 'xz':
+            return lzma.LZMAFile(fileobj, mode='rb')
+        return fileobj
+
+    def command(self):
+        """
+        It returns the command line tool that produces the same format, used on remote hosts
+
+        :return: The command as a string, or None if no compression is needed.
+        """
+        if self.name == 'gzip':
+            return 'gzip -' + str(self.level)
+        if self.name == 'zstd':
+            return 'zstd -q -' + str(self.level)
+        if self.name == 'lz4':
+            return 'lz4 -q -' + str(self.level)
+        if self.name == 'xz':
+            return 'xz -' + str(self.level)
+        return None
+
+
+# name: (default level, minimum level, maximum level, extension, block size)
+CODECS = {
+    'gzip': (6, 1, 9, '.gz', BLOCK_SIZE),
+    'zstd': (3, 1, 22, '.zst', 8 * BLOCK_SIZE),
+    'lz4': (1, 1, 12, '.lz4', BLOCK_SIZE),
+    'xz': (6, 0, 9, '.xz', 8 * BLOCK_SIZE),
+    'none': (0, 0, 0, '', BLOCK_SIZE),
+}
+
+
+def parse_codec(compression=None):
+    """
+    It parses the compression option from configuration, i.e. `zstd:3`, `lz4`, `gzip:6`, `xz` or `none`.
+    If the option isn't proper or the python module for the codec isn't installed, gzip is used.
+
+    :param compression: The compression option, defaults to gzip:6 (optional)
+    :return: The Codec object.
+    """
+    if compression is None or str(compression).strip() == '':
+        compression = DEFAULT_COMPRESSION
+    if isinstance(compression, Codec):
+        return compression
+    parts = str(compression).strip().lower().split(':')
+    name = parts[0]
+    if name not in CODECS:
+        logger.warning("Unknown compression: " + str(compression) + ", system will use " + DEFAULT_COMPRESSION)
+        return parse_codec(DEFAULT_COMPRESSION)
+    level, min_level, max_level, extension, block_size = CODECS[name]
+    if len(parts) > 1 and parts[1] != '':
+        try:
+            level = int(parts[1])
+        except ValueError:
+            logger.warning("Wrong compression level: " + parts[1] + ", system will use " + str(level))
+        if level < min_level or level > max_level:
+            logger.warning("Compression level for " + name + " must be between " + str(min_level) + " and " +
+                           str(max_level) + ", system will use " + str(CODECS[name][0]))
+            level = CODECS[name][0]
+    try:
+        if name == 'zstd':
+            import zstandard  # noqa: F401
+        elif name == 'lz4':
+            import lz4.frame  # noqa: F401
+    except ImportError:
+        logger.error("Python module for " + name + " compression isn't installed, system will use " +
+                     DEFAULT_COMPRESSION)
+        return parse_codec(DEFAULT_COMPRESSION)
+    return Codec(name, level, extension, block_size)
+
+
+def zstd_raw_frame(data):
+    """
+    It creates a zstd frame with raw blocks, the content size is written in the frame header
+
+    :param data: The data
+    :return: The frame.
+    """
+    # frame header descriptor: 8 bytes content size, single segment, no checksum, no dictionary
+    frame = bytearray(struct.pack('<IBQ', 0xFD2FB528, 0xE0, len(data)))
+    position = 0
+    while True:
+        block = data[position:position + ZSTD_BLOCK_SIZE]
+        position += len(block)
+        last = 1 if position >= len(data) else 0
+        # block header: last block flag, block type 0 (raw) and block size
+        frame += struct.pack('<I', last | (len(block) << 3))[:3]
+        frame += block
+        if last:
+            return bytes(frame)
+
+
+def xz_raw_stream(data):
+    """
+    It creates an xz stream with one block of uncompressed LZMA2 chunks and without integrity check
+
+    :param data: The data
+    :return: The stream.
+    """
+    stream_flags = b'\x00\x00'
+    stream = bytearray(b'\xfd7zXZ\x00' + stream_flags + struct.pack('<I', zlib.crc32(stream_flags)))
+    # block header: size, flags (one filter), LZMA2 filter with 64KB dictionary, padding and CRC32
+    header = b'\x02\x00\x21\x01\x08\x00\x00\x00'
+    block = bytearray(header + struct.pack('<I', zlib.crc32(header)))
+    for position in range(0, len(data), LZMA2_CHUNK_SIZE):
+        chunk = data[position:position + LZMA2_CHUNK_SIZE]
+        # control byte 1 resets the dictionary in the first chunk, 2 doesn't
+        block += struct.pack('>BH', 1 if position == 0 else 2, len(chunk) - 1) + chunk
+    block += b'\x00'
+    unpadded_size = len(block)
+    block += b'\x00' * (-len(block) % 4)
+    stream += block
+    index = bytearray(b'\x00' + encode_multibyte(1) + encode_multibyte(unpadded_size) + encode_multibyte(len(data)))
+    index += b'\x00' * (-len(index) % 4)
+    index += struct.pack('<I', zlib.crc32(index))
+    stream += index
+    footer = struct.pack('<I', len(index) // 4 - 1) + stream_flags
+    stream += struct.pack('<I', zlib.crc32(footer)) + footer + b'YZ'
+    return bytes(stream)
+
+
+def encode_multibyte(number):
+    encoded = bytearray()
+    while number >= 0x80:
+        encoded.append((number & 0x7F) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+
+def entropy(data):
+    """
+    :param data: The sample
+    :return: Shannon entropy of the bytes of the sample, in bits per byte.
+    """
+    if len(data) == 0:
+        return 0.0
+    result = 0.0
+    for count in Counter(data).values():
+        probability = count / len(data)
+        result -= probability * math.log2(probability)
+    return result
+
+
+def is_incompressible(file_name, size, io_policy=None):
+    """
+    It classifies the file by its extension, and if the extension isn't known, by the entropy of the first
+    bytes of the file. Files that are already compressed or encrypted have entropy close to 8 bits per byte.
+
+    :param file_name: The file
+    :param size: Size of the file
+    :param io_policy: The IoPolicy, the sample is read through it (optional)
+    :return: True if the file should be stored without compression.
+    """
+    if size < MIN_STORE_SIZE:
+        return False
+    if os.path.splitext(file_name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    try:
+        with utils.open_file(file_name, io_policy) as f:
+            sample = f.read(SAMPLE_SIZE)
+    except OSError:
+        return False
+    return entropy(sample) > ENTROPY_THRESHOLD
+
+
+def codec_for_file(file_name):
+    """
+    It finds the codec based on the extension of the file, `.enc` extension is ignored
+
+    :param file_name: The name of the file
+    :return: The Codec object, codec `none` is returned if the extension isn't known.
+    """
+    if file_name.endswith('.enc'):
+        file_name = file_name[:-4]
+    for name in CODECS:
+        extension = CODECS[name][3]
+        if extension != '' and file_name.endswith(extension):
+            return parse_codec(name)
+    return parse_codec('none')
+
+
+class ParallelCompressStage:
+
+    def __init__(self, next_stage, codec=None, threads=1):
+        """
+        It splits the stream into blocks and compresses every block as an independent frame on a pool of
+        worker threads (same approach as pigz). zlib, lzma, zstandard and lz4 release the GIL while compressing,
+        so the blocks are really compressed in parallel. The frames are written to the next stage in the original
+        order, and concatenated frames are valid for every supported format, so the output can be read with the
+        standard command line tools. Ranges of the stream marked with store are written as frames without
+        compression.
+
+        :param next_stage: The stage that receives the compressed data
+        :param codec: The Codec object, defaults to gzip:6 (optional)
+        :param threads: Number of worker threads, defaults to 1 (optional)
+        """
+        self.next_stage = next_stage
+        self.codec = parse_codec(codec)
+        self.threads = max(1, int(threads))
+        self.block_size = self.codec.block_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # uncompressed bytes that were written in frames without compression
+        self.bytes_stored = 0
+        # (uncompressed size, compressed size) of every frame, in the order they are written
+        self.frames = []
+        self.__buffer = bytearray()
+        # offset of the first byte of the buffer in the stream
+        self.__position = 0
+        self.__stored = deque()
+        self.__pending = deque()
+        self.__executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='compress')
+
+    def store(self, start, end):
+        """
+        It marks the range of the stream that is written without compression, i.e. content of a file that is
+        already compressed. Ranges have to be marked in order, before their data is written.
+
+        :param start: Offset of the first byte of the range in the stream
+        :param end: Offset after the last byte of the range
+        """
+        if end > start and self.codec.name != 'none':
+            self.__stored.append((start, end))
+
+    def __submit(self, block, store=False):
+        if store:
+            self.bytes_stored += len(block)
+            future = self.__executor.submit(self.codec.store_block, block)
+        else:
+            future = self.__executor.submit(self.codec.compress_block, block)
+        self.__pending.append((len(block), future))
+        # keep only a bounded number of blocks in memory
+        while len(self.__pending) > self.threads * 2:
+            self.__write_oldest()
+
+    def __write_oldest(self):
+        raw_size, future = self.__pending.popleft()
+        data = future.result()
+        self.frames.append((raw_size, len(data)))
+        self.bytes_out += len(data)
+        self.next_stage.write(data)
+
+    def __cut(self, final=False):
+        # frames never cross the border of a stored range
+        while self.__buffer:
+            while self.__stored and self.__stored[0][1] <= self.__position:
+                self.__stored.popleft()
+            store = len(self.__stored) > 0 and self.__stored[0][0] <= self.__position
+            if store:
+                size = min(self.block_size, self.__stored[0][1] - self.__position)
+            elif self.__stored:
+                size = min(self.block_size, self.__stored[0][0] - self.__position)
+            else:
+                size = self.block_size
+            if len(self.__buffer) < size:
+                if not final:
+                    return
+                size = len(self.__buffer)
+            self.__submit(bytes(self.__buffer[:size]), store)
+            del self.__buffer[:size]
+            self.__position += size
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self.__buffer += data
+        if len(self.__buffer) >= self.block_size or self.__stored:
+            self.__cut()
+        return len(data)
+
+    def close(self):
+        try:
+            if self.bytes_in == 0:
+                self.__submit(b'')
+            self.__cut(final=True)
+            while self.__pending:
+                self.__write_oldest()
+        except BaseException:
+            # the next stages are aborted, so their threads and files are released, and the error is raised
+            self.abort()
+            raise
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        self.next_stage.close()
+
+    def abort(self):
+        """
+        It discards pending blocks and aborts the next stage, the output isn't complete
+        """
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        self.__pending.clear()
+        self.next_stage.abort()
@@ -94,6 +94,18 @@ class ConfigurationData:
                 'mysqldump_remote', 'drive_dir', fallback='')
             mysql_config.exec_time = config_parser.get(
                 'mysqldump_remote', 'exec_time', fallback=self.exec_time)
+            mysql_config.compression = config_parser.get(
+                'mysqldump_remote', 'compression', fallback='none')
+            mysql_config.stream = config_parser.get(
+                'mysqldump_remote', 'stream', fallback='False')
+            mysql_config.split_size = config_parser.get(
+                'mysqldump_remote', 'split_size', fallback='0')
+            mysql_config.io_rate_limit = config_parser.get(
+                'mysqldump_remote', 'io_rate_limit', fallback='0')
+            mysql_config.ionice = config_parser.get(
+                'mysqldump_remote', 'ionice', fallback='')
+            mysql_config.nice = config_parser.get(
+                'mysqldump_remote', 'nice', fallback='')
             self.mysql_config.append(mysql_config)
 
         if config_parser.has_section("mysql"):
@@ -119,6 +131,10 @@ class ConfigurationData:
                 'mysql', 'drive_dir', fallback='')
             mysql_config.exec_time = config_parser.get(
                 'mysql', 'exec_time', fallback=self.exec_time)
+            mysql_config.compression = config_parser.get(
+                'mysql', 'compression', fallback='none')
+            mysql_config.split_size = config_parser.get(
+                'mysql', 'split_size', fallback='0')
             self.mysql_config.append(mysql_config)
 
         if config_parser.has_section('sync_remote'):
@@ -134,6 +150,14 @@ class ConfigurationData:
                 'sync_remote', 'dst', fallback='')
             rsync_config.exec_time = config_parser.get(
                 'sync_remote', 'exec_time', fallback=self.exec_time)
+            rsync_config.io_rate_limit = config_parser.get(
+                'sync_remote', 'io_rate_limit', fallback='0')
+            rsync_config.ionice = config_parser.get(
+                'sync_remote', 'ionice', fallback='')
+            rsync_config.nice = config_parser.get(
+                'sync_remote', 'nice', fallback='')
+            rsync_config.parallelism = config_parser.get(
+                'sync_remote', 'parallelism', fallback='1')
             self.rsync_config.append(rsync_config)
 
         if config_parser.has_section('sync'):
@@ -145,6 +169,16 @@ class ConfigurationData:
                 'sync', 'dst', fallback='')
             rsync_config.exec_time = config_parser.get(
                 'sync', 'exec_time', fallback=self.exec_time)
+            rsync_config.engine = config_parser.get(
+                'sync', 'engine', fallback='rsync')
+            rsync_config.threads = config_parser.get(
+                'sync', 'threads', fallback='4')
+            rsync_config.parallelism = config_parser.get(
+                'sync', 'parallelism', fallback='1')
+            rsync_config.full_scan_interval = config_parser.get(
+                'sync', 'full_scan_interval', fallback='24')
+            rsync_config.whole_file = config_parser.get(
+                'sync', 'whole_file', fallback='True')
             self.rsync_config.append(rsync_config)
 
         if config_parser.has_section('dirs2backup_remote'):
@@ -172,6 +206,26 @@ class ConfigurationData:
                 'dirs2backup_remote', 'drive_dir', fallback='')
             dirs_config.exec_time = config_parser.get(
                 'dirs2backup_remote', 'exec_time', fallback=self.exec_time)
+            dirs_config.compression = config_parser.get(
+                'dirs2backup_remote', 'compression', fallback='gzip:6')
+            dirs_config.parallel_paths = config_parser.get(
+                'dirs2backup_remote', 'parallel_paths', fallback='1')
+            dirs_config.stream = config_parser.get(
+                'dirs2backup_remote', 'stream', fallback='False')
+            dirs_config.threads = config_parser.get(
+                'dirs2backup_remote', 'threads', fallback='1')
+            dirs_config.split_size = config_parser.get(
+                'dirs2backup_remote', 'split_size', fallback='0')
+            dirs_config.io_rate_limit = config_parser.get(
+                'dirs2backup_remote', 'io_rate_limit', fallback='0')
+            dirs_config.ionice = config_parser.get(
+                'dirs2backup_remote', 'ionice', fallback='')
+            dirs_config.nice = config_parser.get(
+                'dirs2backup_remote', 'nice', fallback='')
+            dirs_config.exclude = config_parser.get(
+                'dirs2backup_remote', 'exclude', fallback='')
+            dirs_config.exclude_from = config_parser.get(
+                'dirs2backup_remote', 'exclude_from', fallback='')
             self.dirs_config.append(dirs_config)
 
         if config_parser.has_section('dirs2backup'):
@@ -193,8 +247,24 @@ class ConfigurationData:
                 'dirs2backup', 'upload_to_onedrive', fallback='False')
             dirs_config.drive_dir = config_parser.get(
                 'dirs2backup', 'drive_dir', fallback='')
+            dirs_config.threads = config_parser.get(
+                'dirs2backup', 'threads', fallback='1')
             dirs_config.exec_time = config_parser.get(
                 'dirs2backup', 'exec_time', fallback=self.exec_time)
+            dirs_config.compression = config_parser.get(
+                'dirs2backup', 'compression', fallback='gzip:6')
+            dirs_config.parallel_paths = config_parser.get(
+                'dirs2backup', 'parallel_paths', fallback='1')
+            dirs_config.split_size = config_parser.get(
+                'dirs2backup', 'split_size', fallback='0')
+            dirs_config.io_rate_limit = config_parser.get(
+                'dirs2backup', 'io_rate_limit', fallback='0')
+            dirs_config.exclude = config_parser.get(
+                'dirs2backup', 'exclude', fallback='')
+            dirs_config.exclude_from = config_parser.get(
+                'dirs2backup', 'exclude_from', fallback='')
+            dirs_config.block_threshold = config_parser.get(
+                'dirs2backup', 'block_threshold', fallback='0')
             self.dirs_config.append(dirs_config)
 
         if config_parser.has_section("elasticsearch"):
@@ -269,7 +339,13 @@ class MysqlConfig:
             upload_to_onedrive='False',
             drive_dir=None,
             exec_time='* * * *',
-            onedrive=None
+            onedrive=None,
+            compression='none',
+            stream='False',
+            split_size='0',
+            io_rate_limit='0',
+            ionice='',
+            nice=''
     ):
         self.no_copies = no_copies
         self.host = host
@@ -283,6 +359,12 @@ class MysqlConfig:
         self.drive_dir = drive_dir
         self.exec_time = exec_time
         self.onedrive = onedrive
+        self.compression = compression
+        self.stream = stream
+        self.split_size = split_size
+        self.io_rate_limit = io_rate_limit
+        self.ionice = ionice
+        self.nice = nice
 
     def formatted(self):
         if self.host is not None:
@@ -299,6 +381,12 @@ class MysqlConfig:
         upload_to_onedrive  = {6}
         drive_dir           = {7}
         exec_time           = {8}
+        compression         = {9}
+        stream              = {10}
+        split_size          = {11}
+        io_rate_limit       = {12}
+        ionice              = {13}
+        nice                = {14}
             """.format(
                 self.no_copies,
                 self.host,
@@ -308,7 +396,13 @@ class MysqlConfig:
                 self.encrypt,
                 self.upload_to_onedrive,
                 self.drive_dir,
-                self.exec_time
+                self.exec_time,
+                self.compression,
+                self.stream,
+                self.split_size,
+                self.io_rate_limit,
+                self.ionice,
+                self.nice
             )
         else:
             formatted = """
@@ -323,6 +417,8 @@ class MysqlConfig:
         upload_to_onedrive  = {5}
         drive_dir           = {6}
         exec_time           = {7}
+        compression         = {8}
+        split_size          = {9}
             """.format(
                 self.no_copies,
                 self.user,
@@ -331,7 +427,9 @@ class MysqlConfig:
                 self.encrypt,
                 self.upload_to_onedrive,
                 self.drive_dir,
-                self.exec_time
+                self.exec_time,
+                self.compression,
+                self.split_size
             )
         return formatted
 
@@ -350,7 +448,18 @@ class DirConfig:
             upload_to_onedrive='False',
             drive_dir=None,
             exec_time='* * * *',
-            onedrive=None
+            onedrive=None,
+            threads='1',
+            compression='gzip:6',
+            parallel_paths='1',
+            stream='False',
+            split_size='0',
+            block_threshold='0',
+            exclude='',
+            exclude_from='',
+            io_rate_limit='0',
+            ionice='',
+            nice=''
     ):
         self.no_copies = no_copies
         self.path = path
@@ -363,6 +472,17 @@ class DirConfig:
         self.drive_dir = drive_dir
         self.exec_time = exec_time
         self.onedrive = onedrive
+        self.threads = threads
+        self.compression = compression
+        self.parallel_paths = parallel_paths
+        self.stream = stream
+        self.split_size = split_size
+        self.block_threshold = block_threshold
+        self.exclude = exclude
+        self.exclude_from = exclude_from
+        self.io_rate_limit = io_rate_limit
+        self.ionice = ionice
+        self.nice = nice
 
     def formatted(self):
         if self.host is not None:
@@ -378,6 +498,16 @@ class DirConfig:
         upload_to_onedrive  = {6}
         drive_dir           = {7}
         exec_time           = {8}
+        compression         = {9}
+        parallel_paths      = {10}
+        stream              = {11}
+        threads             = {12}
+        split_size          = {13}
+        exclude             = {14}
+        exclude_from        = {15}
+        io_rate_limit       = {16}
+        ionice              = {17}
+        nice                = {18}
             """.format(
                 self.no_copies,
                 self.host,
@@ -387,7 +517,17 @@ class DirConfig:
                 self.backup_type,
                 self.upload_to_onedrive,
                 self.drive_dir,
-                self.exec_time
+                self.exec_time,
+                self.compression,
+                self.parallel_paths,
+                self.stream,
+                self.threads,
+                self.split_size,
+                self.exclude,
+                self.exclude_from,
+                self.io_rate_limit,
+                self.ionice,
+                self.nice
             )
         else:
             formatted = """
@@ -401,6 +541,14 @@ class DirConfig:
         upload_to_onedrive  = {5}
         drive_dir           = {6}
         exec_time           = {7}
+        threads             = {8}
+        compression         = {9}
+        parallel_paths      = {10}
+        split_size          = {11}
+        block_threshold     = {12}
+        exclude             = {13}
+        exclude_from        = {14}
+        io_rate_limit       = {15}
             """.format(
                 self.no_copies,
                 self.path,
@@ -409,7 +557,15 @@ class DirConfig:
                 self.backup_type,
                 self.upload_to_onedrive,
                 self.drive_dir,
-                self.exec_time
+                self.exec_time,
+                self.threads,
+                self.compression,
+                self.parallel_paths,
+                self.split_size,
+                self.block_threshold,
+                self.exclude,
+                self.exclude_from,
+                self.io_rate_limit
             )
 
         return formatted
@@ -422,12 +578,28 @@ class RsyncConfig:
             host=None,
             src=None,
             dst=None,
-            exec_time='* * * *'
+            exec_time='* * * *',
+            io_rate_limit='0',
+            ionice='',
+            nice='',
+            engine='rsync',
+            threads='4',
+            parallelism='1',
+            full_scan_interval='24',
+            whole_file='True'
     ):
         self.host = host
         self.src = src
         self.dst = dst
         self.exec_time = exec_time
+        self.io_rate_limit = io_rate_limit
+        self.ionice = ionice
+        self.nice = nice
+        self.engine = engine
+        self.threads = threads
+        self.parallelism = parallelism
+        self.full_scan_interval = full_scan_interval
+        self.whole_file = whole_file
 
     def formatted(self):
         if self.host is not None:
@@ -437,11 +609,19 @@ class RsyncConfig:
         src                 = {1}
         dst                 = {2}
         exec_time           = {3}
+        io_rate_limit       = {4}
+        ionice              = {5}
+        nice                = {6}
+        parallelism         = {7}
             """.format(
                 self.host,
                 self.src,
                 self.dst,
-                self.exec_time
+                self.exec_time,
+                self.io_rate_limit,
+                self.ionice,
+                self.nice,
+                self.parallelism
             )
         else:
             formatted = """
@@ -449,10 +629,20 @@ class RsyncConfig:
         src                 = {0}
         dst                 = {1}
         exec_time           = {2}
+        engine              = {3}
+        threads             = {4}
+        parallelism         = {5}
+        full_scan_interval  = {6}
+        whole_file          = {7}
             """.format(
                 self.src,
                 self.dst,
-                self.exec_time
+                self.exec_time,
+                self.engine,
+                self.threads,
+                self.parallelism,
+                self.full_scan_interval,
+                self.whole_file
             )
         return formatted
 
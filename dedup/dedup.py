@@ -0,0 +1,638 @@
+#!/usr/bin/python3
+import io
+import os
+import json
+import stat
+import random
+import sqlite3
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from timeit import default_timer as timer
+from archive import archive
+from checksum import checksum
+from compression import compression as compression_module
+from encryption import encryption
+from exclude import exclude as exclude_module
+from file_management import file_management
+from targz import targz
+from utils import utils
+
+logger = logging.getLogger("backup_logger")
+
+# minimum, average and maximum size of a chunk
+MIN_CHUNK = 262144
+AVG_CHUNK = 1048576
+MAX_CHUNK = 4194304
+
+# size after which the pack is closed and a new one is started, 64MB
+PACK_SIZE = 67108864
+
+# normalized chunking, a boundary is harder to find before the average size and easier after it
+MASK_SMALL = ((1 << 22) - 1) << 42
+MASK_LARGE = ((1 << 18) - 1) << 46
+MASK_64 = (1 << 64) - 1
+
+
+def gear_table(seed):
+    rnd = random.Random(seed)
+    return tuple(rnd.getrandbits(64) for _ in range(256))
+
+
+# random value for every byte, the seed is fixed so boundaries are the same on every run
+GEAR = gear_table(1952)
+
+
+def gear_array():
+    """
+    :return: GEAR as numpy array, None if numpy isn't installed.
+    """
+    try:
+        import numpy
+    except ImportError:
+        logger.warning("Python module numpy isn't installed, chunking of files for dedup will be slow")
+        return None
+    return numpy.array(GEAR, dtype=numpy.uint64)
+
+
+GEAR_ARRAY = gear_array()
+
+# number of hashes that are calculated at once, small enough for the arrays to stay in the CPU cache
+SCAN_BLOCK = 32768
+
+
+def gear_hashes(data, start, end):
+    """
+    It calculates the gear hash of every position between start and end at once. The hash of position i is
+    the sum of gear[data[j]] << (i - j) over j from start to i, so only the last 64 bytes matter and the
+    hashes are built by doubling the window, 6 vector operations instead of one loop iteration per byte.
+
+    :param data: The data, bytes or bytearray
+    :param start: The position where the hash starts from 0
+    :param end: The position after the last hash
+    :return: numpy array of hashes, the first item is the hash of position start.
+    """
+    import numpy
+    hashes = GEAR_ARRAY[numpy.frombuffer(data, dtype=numpy.uint8, count=end - start, offset=start)]
+    shifted = numpy.empty_like(hashes)
+    window = 1
+    while window < 64 and window < len(hashes):
+        numpy.left_shift(hashes[:-window], numpy.uint64(window), out=shifted[window:])
+        hashes[window:] += shifted[window:]
+        window *= 2
+    return hashes
+
+
+def cut_point(data, length):
+    """
+    It finds the end of the first chunk in the data with the gear rolling hash (FastCDC). Bytes before
+    the minimum chunk size are not hashed at all. Hashes are calculated with numpy in blocks of SCAN_BLOCK,
+    the loop in python is used only if numpy isn't installed.
+
+    :param data: The data, bytes or bytearray
+    :param length: Number of bytes from the beginning of the data that can be used
+    :return: Size of the first chunk.
+    """
+    if length <= MIN_CHUNK:
+        return length
+    if length > MAX_CHUNK:
+        length = MAX_CHUNK
+    normal = min(AVG_CHUNK, length)
+    if GEAR_ARRAY is not None:
+        import numpy
+        for first, last, mask in [(MIN_CHUNK, normal, MASK_SMALL), (normal, length, MASK_LARGE)]:
+            for block in range(first, last, SCAN_BLOCK):
+                # 63 bytes before the block are hashed again, so the hash of its first byte is complete
+                context = max(MIN_CHUNK, block - 63)
+                hashes = gear_hashes(data, context, min(block + SCAN_BLOCK, last))[block - context:]
+                found = numpy.flatnonzero((hashes & numpy.uint64(mask)) == 0)
+                if len(found) > 0:
+                    return block + int(found[0]) + 1
+        return length
+    gear = GEAR
+    h = 0
+    i = MIN_CHUNK
+    while i < normal:
+        h = ((h << 1) + gear[data[i]]) & MASK_64
+        if not h & MASK_SMALL:
+            return i + 1
+        i += 1
+    while i < length:
+        h = ((h << 1) + gear[data[i]]) & MASK_64
+        if not h & MASK_LARGE:
+            return i + 1
+        i += 1
+    return length
+
+
+def chunk_file(f):
+    """
+    It splits the content of the file into content defined chunks, so an insert or delete in the middle
+    of the file changes only the chunks around it
+
+    :param f: Binary file like object
+    """
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK:
+            data = f.read(MAX_CHUNK)
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+        cut = cut_point(buffer, len(buffer))
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class Repository:
+
+    def __init__(self, directory, encrypt='False', enc_pass=None, codec=None, threads=1):
+        """
+        Deduplicating repository. Unique chunks are compressed and appended to pack files in `packs/`,
+        index.db (SQLite) maps the hash of every chunk to its pack, offset and length, and every backup
+        is one snapshot in `snapshots/` with the list of chunks for every file.
+        If encrypt is True, packs and snapshots are encrypted, index.db contains only hashes and offsets.
+
+        :param directory: The directory of the repository
+        :param encrypt: True/False
+        :param enc_pass: The password to encrypt packs and snapshots with
+        :param codec: The compression option or Codec object, defaults to gzip:6 (optional)
+        :param threads: Number of threads used for compression, defaults to 1 (optional)
+        """
+        self.directory = directory
+        self.encrypt = encrypt
+        self.enc_pass = enc_pass
+        self.codec = compression_module.parse_codec(codec)
+        self.threads = max(1, int(threads))
+        self.new_files = []
+        self.removed_files = []
+        self.index_changed = False
+        self.chunks_new = 0
+        self.chunks_reused = 0
+        self.bytes_new = 0
+        self.bytes_stored = 0
+        self.__connection = None
+        self.__known = set()
+        self.__pending = deque()
+        self.__pending_hashes = set()
+        self.__executor = None
+        self.__pack = None
+        self.__pack_name = None
+        self.__pack_offset = 0
+        self.__pack_rows = []
+
+    def open(self):
+        for directory in [self.directory, self.directory + '/packs', self.directory + '/snapshots']:
+            if not os.path.exists(directory):
+                os.mkdir(directory)
+        self.index_changed = not os.path.exists(self.directory + '/index.db')
+        self.__connection = sqlite3.connect(self.directory + '/index.db')
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'hash TEXT PRIMARY KEY, pack TEXT, offset INTEGER, length INTEGER, size INTEGER, codec TEXT)'
+        )
+        self.__known = set(row[0] for row in self.__connection.execute('SELECT hash FROM chunks'))
+        self.__executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='dedup')
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+            self.__executor = None
+        if self.__pack is not None:
+            # pack that isn't sealed has no rows in the index, so it is useless
+            try:
+                self.__pack.abort()
+            except Exception as e:
+                logger.debug("Error while removing pack: " + str(e))
+            self.__pack = None
+        if self.__connection is not None:
+            self.__connection.close()
+            self.__connection = None
+
+    def add(self, data):
+        """
+        It stores the chunk if it isn't already in the repository, compression runs on the thread pool
+
+        :param data: The chunk
+        :return: The hash of the chunk.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self.__known or digest in self.__pending_hashes:
+            self.chunks_reused += 1
+            return digest
+        self.chunks_new += 1
+        self.bytes_new += len(data)
+        self.__pending_hashes.add(digest)
+        self.__pending.append((digest, len(data), self.__executor.submit(self.codec.compress_block, data)))
+        while len(self.__pending) > self.threads * 2:
+            self.__write_oldest()
+        return digest
+
+    def __write_oldest(self):
+        digest, size, future = self.__pending.popleft()
+        frame = future.result()
+        if self.__pack is None:
+            self.__pack_name = utils.get_curr_date_time() + '-' + os.urandom(4).hex() + '.pack'
+            if str(self.encrypt).upper() == 'TRUE':
+                self.__pack_name = self.__pack_name + '.enc'
+            self.__pack = archive.FileSink(self.directory + '/packs/' + self.__pack_name)
+            if str(self.encrypt).upper() == 'TRUE':
+                self.__pack = encryption.EncryptStage(self.__pack, self.enc_pass, self.threads)
+            self.__pack_offset = 0
+        self.__pack.write(frame)
+        self.__pack_rows.append((digest, self.__pack_name, self.__pack_offset, len(frame), size, str(self.codec)))
+        self.__pack_offset += len(frame)
+        self.bytes_stored += len(frame)
+        if self.__pack_offset >= PACK_SIZE:
+            self.__seal_pack()
+
+    def __seal_pack(self):
+        self.__pack.close()
+        self.__pack = None
+        with self.__connection:
+            self.__connection.executemany(
+                'INSERT OR REPLACE INTO chunks (hash, pack, offset, length, size, codec) VALUES (?, ?, ?, ?, ?, ?)',
+                self.__pack_rows
+            )
+        for row in self.__pack_rows:
+            self.__known.add(row[0])
+            self.__pending_hashes.discard(row[0])
+        self.__pack_rows = []
+        self.index_changed = True
+        self.new_files.append('packs/' + self.__pack_name)
+
+    def flush(self):
+        """
+        It writes all pending chunks and seals the current pack
+        """
+        while self.__pending:
+            self.__write_oldest()
+        if self.__pack is not None:
+            self.__seal_pack()
+
+    def locations(self, hashes):
+        """
+        It finds where the chunks are stored
+
+        :param hashes: A list of chunk hashes
+        :return: Dictionary hash -> (pack, offset, length, size, codec).
+        """
+        locations = {}
+        hashes = list(hashes)
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            rows = self.__connection.execute(
+                'SELECT hash, pack, offset, length, size, codec FROM chunks WHERE hash IN (' +
+                ','.join('?' * len(part)) + ')', part)
+            for row in rows:
+                locations[row[0]] = row[1:]
+        return locations
+
+    def prune(self, no_copies):
+        """
+        It removes the oldest snapshots, so only no_copies newest snapshots are kept, and packs that none of
+        the kept snapshots uses, with their rows in the index. A pack is removed only as a whole, so it is
+        kept while any of its chunks is used. Packs that aren't in the index, i.e. left by a killed run,
+        are removed too. Nothing is removed if any of the kept snapshots can't be read.
+
+        :param no_copies: The number of snapshots to keep, at least the newest one is always kept
+        :return: A list of removed files, relative to the repository directory.
+        """
+        snapshots = self.snapshots()
+        keep = snapshots[len(snapshots) - max(1, int(no_copies)):]
+        used = set()
+        for name in keep:
+            try:
+                for entry in self.load_snapshot(name)['entries']:
+                    used.update(entry.get('chunks', []))
+            except Exception as e:
+                logger.error("Can't read snapshot: " + name + ", repository: " + self.directory +
+                             " isn't pruned, error: " + str(e))
+                return []
+
+        packs = set()
+        used_packs = set()
+        for digest, pack in self.__connection.execute('SELECT hash, pack FROM chunks'):
+            packs.add(pack)
+            if digest in used:
+                used_packs.add(pack)
+        unused = packs - used_packs
+        unused.update(name for name in os.listdir(self.directory + '/packs') if name not in packs)
+
+        removed = []
+        for name in snapshots[:len(snapshots) - len(keep)]:
+            removed += ['snapshots/' + name, 'snapshots/' + name + checksum.CHECKSUM_SUFFIX]
+        removed += ['packs/' + name for name in sorted(unused)]
+        if len(unused & packs) > 0:
+            # rows are removed before packs, so the index never points to a pack that doesn't exist
+            with self.__connection:
+                self.__connection.executemany('DELETE FROM chunks WHERE pack = ?', [(pack,) for pack in unused])
+            self.__connection.execute('VACUUM')
+            self.__known = set(row[0] for row in self.__connection.execute('SELECT hash FROM chunks'))
+            self.index_changed = True
+        size = 0
+        for f in removed:
+            try:
+                size += os.path.getsize(self.directory + '/' + f)
+                os.remove(self.directory + '/' + f)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error("Error while removing: " + f + " from repository: " + self.directory +
+                             ", error: " + str(e))
+        self.removed_files += removed
+        logger.info("Repository: " + self.directory + " pruned, removed snapshots: " +
+                    str(len(snapshots) - len(keep)) + ", removed packs: " + str(len(unused)) +
+                    ", freed: " + str(size))
+        return removed
+
+    def snapshots(self):
+        """
+        :return: Sorted list of snapshot names, the newest is the last one.
+        """
+        return sorted(name for name in os.listdir(self.directory + '/snapshots')
+                      if name.endswith('.json.gz') or name.endswith('.json.gz.enc'))
+
+    def load_snapshot(self, name):
+        reader, processes = archive.open_reader(self.directory + '/snapshots/' + name, self.enc_pass)
+        try:
+            snapshot = json.load(reader)
+        finally:
+            reader.close()
+            for proc in processes:
+                proc.wait()
+        return snapshot
+
+    def save_snapshot(self, name, snapshot):
+        """
+        It writes the snapshot as gzip compressed JSON, encrypted if the repository is encrypted
+
+        :param name: The name of the snapshot, without extension
+        :param snapshot: Dictionary with the snapshot
+        :return: The name of the snapshot file.
+        """
+        name = name + '.json.gz'
+        if str(self.encrypt).upper() == 'TRUE':
+            name = name + '.enc'
+        stream = archive.open_pipeline(self.directory + '/snapshots/' + name, self.encrypt, self.enc_pass,
+                                       compression='gzip:6')
+        stream.write(json.dumps(snapshot).encode())
+        stream.close()
+        self.new_files.append('snapshots/' + name)
+        self.new_files.append('snapshots/' + name + checksum.CHECKSUM_SUFFIX)
+        return name
+
+
+def backup_tree(repository, path, previous=None, exclude=None, io_policy=None):
+    """
+    It stores every file under the path in the repository. Files whose size, mtime, ctime and inode are
+    the same as in the previous snapshot are not read again, their chunks are taken from the snapshot.
+
+    :param repository: The opened Repository object
+    :param path: The directory to back up
+    :param previous: The previous snapshot (optional)
+    :param exclude: The ExcludeMatcher, entries that match it are not stored (optional)
+    :param io_policy: The IoPolicy, files are read through it (optional)
+    :return: A list of entries for the snapshot.
+    """
+    old_entries = {}
+    if previous is not None:
+        for entry in previous['entries']:
+            old_entries[entry['name']] = entry
+    entries = []
+    for name in archive.walk(path, exclude):
+        try:
+            st = os.lstat(name)
+            entry = {
+                'name': name,
+                'mode': st.st_mode,
+                'uid': st.st_uid,
+                'gid': st.st_gid,
+                'mtime': st.st_mtime_ns,
+                'ctime': st.st_ctime_ns,
+                'inode': st.st_ino,
+                'size': st.st_size
+            }
+            if stat.S_ISLNK(st.st_mode):
+                entry['link'] = os.readlink(name)
+            elif stat.S_ISREG(st.st_mode):
+                old = old_entries.get(name)
+                if old is not None and 'chunks' in old and \
+                        [old['size'], old['mtime'], old['ctime'], old['inode']] == \
+                        [st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino]:
+                    entry['chunks'] = old['chunks']
+                    repository.chunks_reused += len(old['chunks'])
+                else:
+                    with utils.open_file(name, io_policy) as f:
+                        entry['chunks'] = [repository.add(data) for data in chunk_file(f)]
+            elif not stat.S_ISDIR(st.st_mode):
+                logger.debug("Skipping special file: " + name)
+                continue
+            entries.append(entry)
+        except (FileNotFoundError, PermissionError) as e:
+            logger.error("Skipping file: " + name + ", error: " + str(e))
+    return entries
+
+
+def restore(repository_dir, snapshot_name, target_dir='/', enc_pass=None):
+    """
+    It restores the snapshot into the target directory. Every pack is read only once, from the beginning
+    to the end, and its chunks are written directly to their places in the restored files.
+
+    :param repository_dir: The directory of the repository
+    :param snapshot_name: The name of the snapshot file
+    :param target_dir: The directory where files will be restored, defaults to / (optional)
+    :param enc_pass: The password to decrypt packs and snapshots with
+    :return: True if the snapshot is restored, otherwise False.
+    """
+    logger.info("Restoring snapshot: " + snapshot_name + " from: " + repository_dir + " to: " + target_dir)
+    repository = Repository(repository_dir, enc_pass=enc_pass)
+    try:
+        if not os.path.exists(repository_dir + '/index.db'):
+            raise RuntimeError("Repository doesn't exist")
+        repository.open()
+        snapshot = repository.load_snapshot(snapshot_name)
+        hashes = set()
+        for entry in snapshot['entries']:
+            hashes.update(entry.get('chunks', []))
+        locations = repository.locations(hashes)
+        missing = hashes - set(locations)
+        if missing:
+            raise RuntimeError(str(len(missing)) + " chunks are missing in the repository")
+
+        # hash -> list of (file, offset) where the chunk has to be written
+        targets = {}
+        for entry in snapshot['entries']:
+            target = os.path.join(target_dir, entry['name'].lstrip('/'))
+            if stat.S_ISDIR(entry['mode']):
+                os.makedirs(target, exist_ok=True)
+            elif stat.S_ISLNK(entry['mode']):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(entry['link'], target)
+            else:
+                offset = 0
+                with open(target, 'wb') as f:
+                    f.truncate(entry['size'])
+                for digest in entry['chunks']:
+                    targets.setdefault(digest, []).append((target, offset))
+                    offset += locations[digest][3]
+
+        packs = {}
+        for digest in locations:
+            pack, offset, length, size, codec = locations[digest]
+            packs.setdefault(pack, []).append((offset, length, digest, codec))
+        for pack in sorted(packs):
+            reader, processes = archive.open_reader(repository_dir + '/packs/' + pack, enc_pass)
+            try:
+                position = 0
+                for offset, length, digest, codec in sorted(packs[pack]):
+                    while position < offset:
+                        position += len(reader.read(min(offset - position, archive.CHUNK_SIZE)))
+                    frame = reader.read(length)
+                    position += len(frame)
+                    data = compression_module.parse_codec(codec).open_reader(io.BytesIO(frame)).read()
+                    for target, file_offset in targets[digest]:
+                        fd = os.open(target, os.O_WRONLY)
+                        try:
+                            os.pwrite(fd, data, file_offset)
+                        finally:
+                            os.close(fd)
+            finally:
+                reader.close()
+                for proc in processes:
+                    proc.wait()
+
+        # directories are restored after their content, otherwise their mtime would change
+        for entry in reversed(snapshot['entries']):
+            target = os.path.join(target_dir, entry['name'].lstrip('/'))
+            try:
+                os.chown(target, entry['uid'], entry['gid'], follow_symlinks=False)
+            except OSError:
+                pass
+            if not stat.S_ISLNK(entry['mode']):
+                os.chmod(target, stat.S_IMODE(entry['mode']))
+                os.utime(target, ns=(entry['mtime'], entry['mtime']))
+        return True
+    except Exception as e:
+        logger.error("Error while restoring snapshot: " + snapshot_name + ", error: " + str(e))
+        return False
+    finally:
+        repository.close()
+
+
+def dedup(paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None, threads=1,
+          compression=None, parallel_paths=1, exclude=None, io_policy=None, no_copies=None):
+    """
+    It backs up the provided directories into deduplicating repositories, one repository for every
+    directory, only chunks that aren't already in the repository are stored and uploaded to OneDrive.
+    Without no_copies snapshots and packs are never removed, so the repository only grows.
+
+    :param paths: A list of directories to back up
+    :param destinations: a list of directories to copy the backup to
+    :param encrypt: True/False
+    :param enc_pass: The password to encrypt packs and snapshots with
+    :param one_drive: the OneDrive object
+    :param one_drive_dir: The directory on OneDrive where you want to store the backup
+    :param threads: Number of threads used for compression, defaults to 1 (optional)
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy that limits reads of the files (optional)
+    :param no_copies: The number of snapshots to keep in every repository, packs that no kept snapshot uses
+    are removed from the repository, its copies and OneDrive (optional)
+    :return: Dictionary with the result, True or False, for every path.
+    """
+
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    targz.check_destination_directories(destinations)
+
+    def backup_path(dir2backup):
+        logger.info("---------------------------------------")
+        logger.info("start dedup")
+        logger.info("---------------------------------------")
+        logger.info("Dedup provided directory :" +
+                    dir2backup)
+        file_prefix = dir2backup.replace(
+            '/',
+            '-',
+        )
+        if not file_management.path_exists(dir2backup):
+            logger.error("Path: " + dir2backup + " , doesn't exists!")
+            return False
+        if file_prefix[0] == '-':
+            file_prefix = file_prefix[1:len(file_prefix)]
+        if file_prefix[len(file_prefix)-1] == '-':
+            file_prefix = file_prefix[:len(file_prefix)-1]
+        file_prefix = file_prefix + "-dedup"
+        repository_dir = destinations[0] + '/' + file_prefix
+
+        start = timer()
+        repository = Repository(repository_dir, encrypt, enc_pass, codec, threads)
+        try:
+            repository.open()
+            previous = None
+            snapshots = repository.snapshots()
+            if len(snapshots) > 0:
+                try:
+                    previous = repository.load_snapshot(snapshots[-1])
+                except Exception as e:
+                    logger.warning("Can't read previous snapshot: " + snapshots[-1] +
+                                   ", every file will be read, error: " + str(e))
+            entries = backup_tree(repository, dir2backup, previous, exclude, io_policy)
+            repository.flush()
+            snapshot_name = repository.save_snapshot(
+                file_prefix + '-' + utils.get_curr_date_time(),
+                {'path': dir2backup, 'created': utils.get_curr_date_time(), 'entries': entries}
+            )
+            if no_copies is not None:
+                repository.prune(no_copies)
+        except Exception as e:
+            logger.error("Error while creating dedup backup of: " + dir2backup + ", error: " + str(e))
+            return False
+        finally:
+            repository.close()
+        end = timer()
+        logger.info("Snapshot: " + snapshot_name + " successfully created in repository: " + repository_dir)
+        logger.info("Entries: " + str(len(entries)) + ", new chunks: " + str(repository.chunks_new) +
+                    ", reused chunks: " + str(repository.chunks_reused) + ", new data: " +
+                    str(repository.bytes_new) + ", stored: " + str(repository.bytes_stored))
+        logger.info("Time took for dedup :" +
+                    str(timedelta(seconds=end - start)))
+
+        # packs and snapshots are never changed once written, index.db only when packs are added or removed
+        removed_files = repository.removed_files
+        new_files = [f for f in repository.new_files if f not in removed_files]
+        if repository.index_changed:
+            new_files.append('index.db')
+        if one_drive is not None:
+            for f in new_files:
+                directory = os.path.dirname(f)
+                one_drive.upload_file(one_drive_dir=os.path.join(one_drive_dir, file_prefix, directory),
+                                      local_dir=os.path.join(repository_dir, directory),
+                                      file_name=os.path.basename(f))
+            for directory in ['packs', 'snapshots']:
+                names = [os.path.basename(f) for f in removed_files if os.path.dirname(f) == directory]
+                if len(names) > 0:
+                    one_drive.remove_files(os.path.join(one_drive_dir, file_prefix, directory), names)
+        copies = [os.path.join(destination, file_prefix)
+                  for destination in targz.existing_destinations(destinations[1:])]
+        for copy_dir in copies:
+            for directory in ['', 'packs', 'snapshots']:
+                if not os.path.isdir(os.path.join(copy_dir, directory)):
+                    os.mkdir(os.path.join(copy_dir, directory))
+        file_management.copy_files([os.path.join(repository_dir, f) for f in new_files], copies, new_files)
+        for copy_dir in copies:
+            for f in removed_files:
+                if os.path.isfile(os.path.join(copy_dir, f)):
+                    os.remove(os.path.join(copy_dir, f))
+        return True
+
+    return targz.run_paths(paths, backup_path, parallel_paths)
+
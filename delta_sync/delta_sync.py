@@ -0,0 +1,631 @@
+#!/usr/bin/python3
+import os
+import re
+import mmap
+import stat
+import time
+import zlib
+import shutil
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from block_delta import block_delta
+
+logger = logging.getLogger("backup_logger")
+
+# modulus of the weak checksum, the same as in Adler-32, so zlib.adler32 calculates the checksum of a whole block
+ADLER_MOD = 65521
+
+# smaller files are always copied as a whole, 64KB
+DELTA_THRESHOLD = 65536
+
+# limits of the block size, the block size grows with the square root of the file size, 8KB and 1MB
+MIN_BLOCK_SIZE = 8192
+MAX_BLOCK_SIZE = 1048576
+
+# a block that doesn't match is searched byte by byte only this far, a fraction of the block, so files that are
+# rewritten as a whole aren't compared at every offset
+SEARCH_FRACTION = 8
+
+# ranges are copied by parts of this size, 16MB
+COPY_SIZE = 16777216
+
+# suffix of the files that are written next to the destination file and renamed when they are complete
+TMP_SUFFIX = '.sync.tmp'
+
+# counters of the sync, returned by sync_tree and parsed from the output of `rsync --stats`
+STATS_KEYS = ['files', 'changed', 'deleted', 'size', 'literal', 'matched', 'errors']
+
+
+def new_stats():
+    return {key: 0 for key in STATS_KEYS}
+
+
+def block_size_for(size):
+    """
+    :param size: Size of the file
+    :return: Size of the block, the square root of the size rounded to 1KB, between 8KB and 1MB.
+    """
+    block_size = int(size ** 0.5) // 1024 * 1024
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+def signature(file_name, block_size):
+    """
+    It calculates the weak (Adler-32) and the strong checksum of every block of the old copy of the file
+
+    :param file_name: The old copy of the file
+    :param block_size: Size of the block
+    :return: Tuple (dictionary weak checksum -> list of numbers of blocks, list of strong checksums, size of the
+    last block).
+    """
+    weak = {}
+    strong = []
+    last = 0
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            weak.setdefault(zlib.adler32(block), []).append(len(strong))
+            strong.append(block_delta.block_digest(block))
+            last = len(block)
+    return weak, strong, last
+
+
+def find_block(weak, strong, checksum, data, last, block_size):
+    """
+    :return: Number of the block of the old copy that has the same content as data, or None.
+    """
+    numbers = weak.get(checksum)
+    if numbers is None:
+        return None
+    digest = None
+    for number in numbers:
+        # only the last block of the old copy can be shorter than the block size
+        if len(data) != block_size and (number != len(strong) - 1 or len(data) != last):
+            continue
+        if digest is None:
+            digest = block_delta.block_digest(data)
+        if strong[number] == digest:
+            return number
+    return None
+
+
+def add_range(ranges, source, offset, length):
+    if length <= 0:
+        return
+    if ranges and ranges[-1][0] == source and ranges[-1][1] + ranges[-1][2] == offset:
+        ranges[-1] = (source, ranges[-1][1], ranges[-1][2] + length)
+    else:
+        ranges.append((source, offset, length))
+
+
+def file_delta(file_name, sig, block_size):
+    """
+    It compares the new file with the signature of the old copy with the rsync algorithm: every block of the
+    new file is looked up by its weak checksum and confirmed by the strong one. If a block doesn't match, the
+    weak checksum is rolled byte by byte to find data that moved, i.e. after an insert. The search is limited
+    to a fraction of the block, and the rest of the block is literal data.
+
+    :param file_name: The new file
+    :param sig: The signature of the old copy
+    :param block_size: Size of the block of the signature
+    :return: A list of ranges (source, offset, length), source is 'old' for data that is copied from the old
+    copy and 'new' for literal data from the new file.
+    """
+    weak, strong, last = sig
+    ranges = []
+    size = os.path.getsize(file_name)
+    if size == 0:
+        return ranges
+    search = max(1, block_size // SEARCH_FRACTION)
+    with open(file_name, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        position = 0
+        literal = 0
+        while position < size:
+            block = data[position:position + block_size]
+            number = find_block(weak, strong, zlib.adler32(block), block, last, block_size)
+            if number is None and len(block) == block_size:
+                position, number = roll(data, position, size, block_size, search, weak, strong, last)
+            if number is None:
+                position = min(size, position + block_size)
+                continue
+            add_range(ranges, 'new', literal, position - literal)
+            length = block_size if number < len(strong) - 1 else last
+            add_range(ranges, 'old', number * block_size, length)
+            position += length
+            literal = position
+        add_range(ranges, 'new', literal, size - literal)
+    return ranges
+
+
+def roll(data, position, size, block_size, search, weak, strong, last):
+    """
+    It rolls the weak checksum from position up to search bytes forward
+
+    :return: Tuple (position of the match, number of the block), or (position, None) if nothing matches.
+    """
+    checksum = zlib.adler32(data[position:position + block_size])
+    a = checksum & 0xffff
+    b = checksum >> 16
+    end = min(position + search, size - block_size)
+    for start in range(position + 1, end + 1):
+        out_byte = data[start - 1]
+        a = (a - out_byte + data[start + block_size - 1]) % ADLER_MOD
+        b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+        if (b << 16 | a) in weak:
+            block = data[start:start + block_size]
+            number = find_block(weak, strong, b << 16 | a, block, last, block_size)
+            if number is not None:
+                return start, number
+    return position, None
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+    """
+    It appends the range of the source file to the destination, in the kernel if it is possible
+    """
+    while length > 0:
+        try:
+            count = os.copy_file_range(src_fd, dst_fd, min(length, COPY_SIZE), offset)
+        except (OSError, AttributeError):
+            count = 0
+        if count == 0:
+            data = os.pread(src_fd, min(length, COPY_SIZE), offset)
+            if not data:
+                raise OSError("File is shorter than expected")
+            os.write(dst_fd, data)
+            count = len(data)
+        offset += count
+        length -= count
+
+
+def set_attributes(path, entry):
+    """
+    It sets the mode, the owner if this process is root, and the modification time of the file
+    """
+    kind, size, mtime, mode, uid, gid, extra = entry[:7]
+    if os.geteuid() == 0:
+        os.lchown(path, uid, gid)
+    if kind != 'link':
+        os.chmod(path, stat.S_IMODE(mode))
+    os.utime(path, ns=(mtime, mtime), follow_symlinks=kind != 'link')
+
+
+def sync_file(source, target, entry, old_entry, whole_file=True):
+    """
+    It updates the target from the source. The source is copied as a whole, in the kernel, or with whole_file
+    False as a delta against the old target if it exists and is large enough. The new content is written next
+    to the target and renamed.
+
+    :param source: The source file
+    :param target: The target file
+    :param entry: The entry of the source, as returned by scan_tree
+    :param old_entry: The entry of the target, or None if it doesn't exist
+    :param whole_file: True/False, defaults to True (optional)
+    :return: Tuple (literal bytes, matched bytes).
+    """
+    size = entry[1]
+    if not whole_file and old_entry is not None and old_entry[0] == 'file' and \
+            min(size, old_entry[1]) >= DELTA_THRESHOLD:
+        block_size = block_size_for(old_entry[1])
+        ranges = file_delta(source, signature(target, block_size), block_size)
+    else:
+        ranges = [('new', 0, size)] if size > 0 else []
+    tmp = os.path.join(os.path.dirname(target), '.' + os.path.basename(target) + TMP_SUFFIX)
+    literal = 0
+    matched = 0
+    try:
+        with open(source, 'rb') as new, open(tmp, 'wb') as dst:
+            old = open(target, 'rb') if any(r[0] == 'old' for r in ranges) else None
+            try:
+                for name, offset, length in ranges:
+                    copy_range(old.fileno() if name == 'old' else new.fileno(), dst.fileno(), offset, length)
+                    if name == 'old':
+                        matched += length
+                    else:
+                        literal += length
+            finally:
+                if old is not None:
+                    old.close()
+        if os.path.getsize(tmp) != size:
+            raise OSError("File: " + source + " changed while it was synchronized")
+        set_attributes(tmp, entry)
+        os.replace(tmp, target)
+    except Exception:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return literal, matched
+
+
+def make_entry(path, st):
+    """
+    :param path: The path, used to read the target of a symbolic link
+    :param st: The result of lstat of the path
+    :return: The entry (kind, size, mtime in ns, mode, uid, gid, link target or device, inode), or None if the
+    path is a socket or another kind that isn't synchronized.
+    """
+    extra = None
+    if stat.S_ISDIR(st.st_mode):
+        kind = 'dir'
+    elif stat.S_ISREG(st.st_mode):
+        kind = 'file'
+    elif stat.S_ISLNK(st.st_mode):
+        kind = 'link'
+        extra = os.readlink(path)
+    elif stat.S_ISFIFO(st.st_mode) or stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+        kind = 'special'
+        extra = st.st_rdev
+    else:
+        return None
+    return (kind, st.st_size if kind == 'file' else 0, st.st_mtime_ns, st.st_mode, st.st_uid, st.st_gid, extra,
+            st.st_ino)
+
+
+def scan_directory(root, relative, names=None):
+    """
+    It reads one directory, or only stats the provided names if the directory didn't change since the cached scan
+
+    :param root: The root of the tree
+    :param relative: The directory, relative to the root
+    :param names: Names of entries of the directory from the cache, the directory is listed if it is None
+    (optional)
+    :return: Tuple (dictionary relative path -> entry, list of relative paths of subdirectories).
+    """
+    entries = {}
+    directories = []
+    if names is None:
+        with os.scandir(os.path.join(root, relative)) as it:
+            found = [(e.name, e.path, e.stat(follow_symlinks=False)) for e in it]
+    else:
+        found = []
+        for name in names:
+            try:
+                found.append((name, os.path.join(root, relative, name),
+                              os.lstat(os.path.join(root, relative, name))))
+            except FileNotFoundError:
+                continue
+    for name, full_path, st in found:
+        path = os.path.join(relative, name)
+        entry = make_entry(full_path, st)
+        if entry is None:
+            continue
+        entries[path] = entry
+        if entry[0] == 'dir':
+            directories.append(path)
+    return entries, directories
+
+
+def scan_tree(root, threads=4, cached=None):
+    """
+    It walks the directory tree, directories are listed by a pool of worker threads. With the cached entries
+    from the previous run, a directory whose mtime and inode didn't change isn't listed again, because adding,
+    removing or renaming of an entry changes the mtime of its directory, only its entries are stat'ed.
+
+    :param root: The root of the tree
+    :param threads: Number of directories that are listed at the same time, defaults to 4 (optional)
+    :param cached: Dictionary relative path -> entry from the previous run, the root is under '' (optional)
+    :return: Tuple (dictionary relative path -> (kind, size, mtime in ns, mode, uid, gid, link target or device,
+    inode), number of directories that couldn't be listed, number of directories that were listed).
+    """
+    entries = {}
+    errors = 0
+    listed = 0
+    if not os.path.isdir(root):
+        return entries, errors, listed
+    children = {}
+    if cached:
+        for path in cached:
+            if path != '':
+                children.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+
+    def names_of(relative, entry):
+        old = cached.get(relative) if cached else None
+        if old is None or old[0] != 'dir' or old[2] != entry[2] or old[7] != entry[7]:
+            return None
+        return children.get(relative, [])
+
+    root_entry = make_entry(root, os.lstat(root))
+    with ThreadPoolExecutor(max_workers=max(1, int(threads)), thread_name_prefix='scan') as executor:
+        names = names_of('', root_entry)
+        pending = {executor.submit(scan_directory, root, '', names): ('', names is None)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative, listing = pending.pop(future)
+                listed += 1 if listing else 0
+                try:
+                    found, directories = future.result()
+                except OSError as e:
+                    logger.error("Error while listing directory: " + os.path.join(root, relative) +
+                                 ", error: " + str(e))
+                    errors += 1
+                    continue
+                entries.update(found)
+                for directory in directories:
+                    names = names_of(directory, found[directory])
+                    pending[executor.submit(scan_directory, root, directory, names)] = (directory, names is None)
+    entries[''] = root_entry
+    return entries, errors, listed
+
+
+class FileListCache:
+
+    def __init__(self, cache_file):
+        """
+        Entries of the source tree from the last successful synchronization, stored in SQLite. The destination
+        is the copy of these entries, so it isn't scanned at all until the next full scan.
+
+        :param cache_file: The SQLite file where the cache is stored
+        """
+        self.cache_file = cache_file
+
+    def __connect(self):
+        connection = sqlite3.connect(self.cache_file)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, kind TEXT, size INTEGER, mtime INTEGER, '
+            'mode INTEGER, uid INTEGER, gid INTEGER, extra, inode INTEGER)'
+        )
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        return connection
+
+    def load(self):
+        """
+        :return: Tuple (dictionary relative path -> entry, time of the last full scan), empty dictionary and 0
+        if there is no cache.
+        """
+        if not os.path.exists(self.cache_file):
+            return {}, 0
+        connection = self.__connect()
+        try:
+            entries = {}
+            for row in connection.execute('SELECT path, kind, size, mtime, mode, uid, gid, extra, inode FROM entries'):
+                entries[row[0]] = tuple(row[1:])
+            row = connection.execute("SELECT value FROM meta WHERE key = 'full_scan'").fetchone()
+            return entries, float(row[0]) if row else 0
+        finally:
+            connection.close()
+
+    def save(self, previous, entries, full_scan=None):
+        """
+        It writes only entries that changed since the previous run, in one transaction
+
+        :param previous: Entries that are in the cache, as returned by load
+        :param entries: Entries of the source tree after the synchronization
+        :param full_scan: Time of the full scan, if the tree was scanned as a whole (optional)
+        """
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO entries (path, kind, size, mtime, mode, uid, gid, extra, inode) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    ((path,) + tuple(entry) for path, entry in entries.items() if previous.get(path) != entry)
+                )
+                connection.executemany('DELETE FROM entries WHERE path = ?',
+                                       ((path,) for path in previous if path not in entries))
+                if full_scan is not None:
+                    connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('full_scan', ?)",
+                                       (full_scan,))
+        finally:
+            connection.close()
+
+    def clear(self):
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+
+
+def remove_entries(root, paths, entries):
+    """
+    It removes the paths from the tree in one pass, a directory is removed with everything below it, so
+    paths inside of removed directories are skipped
+
+    :return: Tuple (number of removed paths, number of errors).
+    """
+    removed = 0
+    errors = 0
+    directories = set()
+    for path in sorted(paths):
+        if any(path.startswith(directory + os.sep) for directory in directories):
+            removed += 1
+            continue
+        target = os.path.join(root, path)
+        try:
+            if entries[path][0] == 'dir':
+                shutil.rmtree(target)
+                directories.add(path)
+            else:
+                os.remove(target)
+            removed += 1
+        except FileNotFoundError:
+            removed += 1
+        except OSError as e:
+            logger.error("Error while removing: " + target + ", error: " + str(e))
+            errors += 1
+    return removed, errors
+
+
+def create_entry(source, target, entry):
+    """
+    It creates the directory, the symbolic link or the special file on the destination
+    """
+    kind, size, mtime, mode, uid, gid, extra = entry[:7]
+    if kind == 'dir':
+        os.makedirs(target, exist_ok=True)
+        return
+    if os.path.lexists(target):
+        os.remove(target)
+    if kind == 'link':
+        os.symlink(extra, target)
+    elif stat.S_ISFIFO(mode):
+        os.mkfifo(target, stat.S_IMODE(mode))
+    else:
+        os.mknod(target, mode, extra)
+    set_attributes(target, entry)
+
+
+def sync_tree(src, dst, threads=4, cache=None, full_scan_interval=0, whole_file=True):
+    """
+    It synchronizes the destination with the source like `rsync -a --delete src/ dst`, without rsync. Both trees
+    are scanned at the same time by pools of threads, files with different size or modification time are
+    transferred by several threads at once, and paths that aren't in the source are deleted in one pass. Nothing
+    is deleted if a part of the source can't be listed.
+
+    Like rsync between local directories, changed files are copied as a whole, reading the old copy to find
+    matching blocks costs more than writing the file again. With whole_file False they are transferred as a
+    delta against the old copy when it exists, for destinations where writes are slow, i.e. network mounts.
+
+    With the cache, only directories of the source that changed since the last successful run are listed, and
+    the destination isn't scanned, its entries are taken from the cache. Both trees are scanned as a whole when
+    there is no cache, after a failed run and once per full_scan_interval.
+
+    :param src: The source directory
+    :param dst: The destination directory
+    :param threads: Number of threads that scan directories and transfer files, defaults to 4 (optional)
+    :param cache: The FileListCache of this source and destination (optional)
+    :param full_scan_interval: Seconds between full scans of both trees, 0 scans them as a whole every time
+    (optional)
+    :param whole_file: True/False, False transfers changed files as deltas, defaults to True (optional)
+    :return: Dictionary with counters: files (entries in the source), changed, deleted, size (of changed files),
+    literal (bytes read from the source), matched (bytes reused from old copies) and errors.
+    """
+    threads = max(1, int(threads))
+    stats = new_stats()
+    lock = threading.Lock()
+    cached, full_scan = cache.load() if cache is not None else ({}, 0)
+    full = not cached or float(full_scan_interval) <= 0 or time.time() - full_scan >= float(full_scan_interval)
+    scan_start = time.time()
+    if full:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='scan-tree') as executor:
+            src_scan = executor.submit(scan_tree, src, threads)
+            dst_scan = executor.submit(scan_tree, dst, threads)
+            source, src_errors, listed = src_scan.result()
+            destination, dst_errors, dst_listed = dst_scan.result()
+    else:
+        source, src_errors, listed = scan_tree(src, threads, cached)
+        destination = dict(cached)
+        dst_errors = 0
+    root_entry = source.pop('', None)
+    destination.pop('', None)
+    logger.debug("Scan of: " + src + ", full: " + str(full) + ", entries: " + str(len(source)) +
+                 ", listed directories: " + str(listed))
+    stats['files'] = len(source)
+    stats['errors'] = src_errors + dst_errors
+    if not os.path.isdir(src):
+        logger.error("Source directory: " + src + " doesn't exist")
+        stats['errors'] += 1
+        return stats
+    os.makedirs(dst, exist_ok=True)
+
+    extra = [path for path in destination
+             if path not in source or source[path][0] != destination[path][0]]
+    # directories whose entries are added, removed or replaced, their mtime is set again at the end
+    touched = set(os.path.dirname(path) for path in extra)
+    if src_errors > 0:
+        logger.error("Some directories of: " + src + " couldn't be listed, files aren't deleted")
+    elif extra:
+        stats['deleted'], errors = remove_entries(dst, extra, destination)
+        stats['errors'] += errors
+        for path in extra:
+            destination.pop(path, None)
+
+    files = []
+    for path in sorted(source):
+        entry = source[path]
+        old = destination.get(path)
+        target = os.path.join(dst, path)
+        try:
+            if entry[0] == 'file':
+                if old is None or old[1] != entry[1] or old[2] != entry[2]:
+                    files.append(path)
+                    touched.add(os.path.dirname(path))
+                elif stat.S_IMODE(old[3]) != stat.S_IMODE(entry[3]):
+                    os.chmod(target, stat.S_IMODE(entry[3]))
+            elif entry[0] == 'dir':
+                if old is None:
+                    create_entry(os.path.join(src, path), target, entry)
+                    touched.add(os.path.dirname(path))
+            elif old is None or old[2] != entry[2] or old[6] != entry[6]:
+                create_entry(os.path.join(src, path), target, entry)
+                touched.add(os.path.dirname(path))
+                stats['changed'] += 1
+        except OSError as e:
+            logger.error("Error while synchronizing: " + target + ", error: " + str(e))
+            stats['errors'] += 1
+
+    def transfer(path):
+        try:
+            literal, matched = sync_file(os.path.join(src, path), os.path.join(dst, path), source[path],
+                                         destination.get(path), whole_file)
+        except OSError as e:
+            logger.error("Error while synchronizing file: " + os.path.join(src, path) + ", error: " + str(e))
+            with lock:
+                stats['errors'] += 1
+            return
+        logger.debug("File: " + path + " synchronized, literal bytes: " + str(literal) + ", matched bytes: " +
+                     str(matched))
+        with lock:
+            stats['changed'] += 1
+            stats['size'] += source[path][1]
+            stats['literal'] += literal
+            stats['matched'] += matched
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='sync') as executor:
+        list(executor.map(transfer, files))
+
+    # modification times of directories change while their files are written, so they are set at the end
+    for path in sorted((p for p in source if source[p][0] == 'dir'), reverse=True):
+        old = destination.get(path)
+        if path not in touched and old is not None and old[2:6] == source[path][2:6]:
+            continue
+        try:
+            set_attributes(os.path.join(dst, path), source[path])
+        except OSError as e:
+            logger.error("Error while setting attributes of: " + os.path.join(dst, path) + ", error: " + str(e))
+            stats['errors'] += 1
+    if root_entry is not None:
+        try:
+            set_attributes(dst, root_entry)
+        except OSError as e:
+            logger.error("Error while setting attributes of: " + dst + ", error: " + str(e))
+            stats['errors'] += 1
+
+    if cache is not None:
+        try:
+            if stats['errors'] > 0:
+                # the destination isn't a copy of the source, the next run scans both trees
+                cache.clear()
+            else:
+                source[''] = root_entry
+                cache.save(cached, source, scan_start if full else None)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Can't write the cache: " + cache.cache_file + ", error: " + str(e))
+    return stats
+
+
+def parse_rsync_stats(output):
+    """
+    It parses the output of `rsync --stats` into the same counters as sync_tree returns
+
+    :param output: Standard output of rsync
+    :return: Dictionary with counters, a counter that isn't in the output is 0.
+    """
+    patterns = {
+        'files': r'Number of files: ([0-9,.]+)',
+        'changed': r'Number of regular files transferred: ([0-9,.]+)',
+        'deleted': r'Number of deleted files: ([0-9,.]+)',
+        'size': r'Total transferred file size: ([0-9,.]+)',
+        'literal': r'Literal data: ([0-9,.]+)',
+        'matched': r'Matched data: ([0-9,.]+)',
+    }
+    stats = new_stats()
+    for key, pattern in patterns.items():
+        match = re.search(pattern, output)
+        if match is not None:
+            stats[key] = int(re.sub(r'[^0-9]', '', match.group(1)))
+    return stats
+
+
+def format_stats(stats):
+    return ', '.join(key + ': ' + str(stats[key]) for key in STATS_KEYS)
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+import io
+import os
+import struct
+import hashlib
+import logging
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("backup_logger")
+
+# encrypted files start with MAGIC, 16 bytes of salt, number of PBKDF2 iterations and size of the chunk
+MAGIC = b'BKPGCM01'
+SALT_SIZE = 16
+HEADER_SIZE = 32
+
+# files encrypted with `openssl enc` start with 'Salted__'
+OPENSSL_MAGIC = b'Salted__'
+
+KDF_ITERATIONS = 600000
+KEY_SIZE = 32
+TAG_SIZE = 16
+
+# size of the plaintext of one chunk, every chunk is encrypted on its own, 1MB
+CHUNK_SIZE = 1048576
+
+
+@functools.lru_cache(maxsize=32)
+def derive_key(password, salt, iterations):
+    """
+    It derives the key of the file from the password with PBKDF2-HMAC-SHA256, once per file
+
+    :param password: The password
+    :param salt: The salt from the header of the file
+    :param iterations: Number of iterations from the header of the file
+    :return: The key.
+    """
+    return hashlib.pbkdf2_hmac('sha256', str(password).encode('utf-8'), salt, iterations, KEY_SIZE)
+
+
+def chunk_nonce(number, final):
+    """
+    :param number: The number of the chunk in the file
+    :param final: True for the last chunk, so a file that is cut at the border of a chunk doesn't decrypt
+    :return: The 12 bytes nonce of the chunk.
+    """
+    return number.to_bytes(11, 'big') + (b'\x01' if final else b'\x00')
+
+
+def create_header(salt, iterations=KDF_ITERATIONS, chunk_size=CHUNK_SIZE):
+    return MAGIC + salt + struct.pack('>II', iterations, chunk_size)
+
+
+def parse_header(header):
+    """
+    :param header: The first HEADER_SIZE bytes of the file
+    :return: Tuple (salt, iterations, chunk size).
+    """
+    if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+        raise RuntimeError("File isn't encrypted in chunks")
+    iterations, chunk_size = struct.unpack('>II', header[len(MAGIC) + SALT_SIZE:HEADER_SIZE])
+    return header[len(MAGIC):len(MAGIC) + SALT_SIZE], iterations, chunk_size
+
+
+def is_chunked(file_name):
+    """
+    :param file_name: The encrypted file
+    :return: True if the file is encrypted in chunks, False if it is encrypted with `openssl enc`.
+    """
+    with open(file_name, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_exact(fileobj, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+class ChunkCipher:
+
+    def __init__(self, header, password):
+        """
+        AES-256-GCM of one file, every chunk has its own nonce and tag, the header is authenticated with
+        every chunk
+
+        :param header: The header of the file
+        :param password: The password
+        """
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self.header = header
+        salt, iterations, self.chunk_size = parse_header(header)
+        self.__aead = AESGCM(derive_key(password, salt, iterations))
+
+    def encrypt(self, number, data, final=False):
+        return self.__aead.encrypt(chunk_nonce(number, final), data, self.header)
+
+    def decrypt(self, number, data, final=False):
+        from cryptography.exceptions import InvalidTag
+        try:
+            return self.__aead.decrypt(chunk_nonce(number, final), data, self.header)
+        except InvalidTag:
+            raise RuntimeError("Chunk " + str(number) + " can't be decrypted, the password is wrong or data "
+                               "is damaged")
+
+    def decrypt_chunks(self, data, first):
+        """
+        It decrypts consecutive chunks, a chunk shorter than the full size is the last chunk of the file
+
+        :param data: The encrypted chunks
+        :param first: The number of the first chunk
+        :return: The plaintext.
+        """
+        size = self.chunk_size + TAG_SIZE
+        plain = bytearray()
+        for i in range(0, len(data), size):
+            chunk = data[i:i + size]
+            plain += self.decrypt(first + i // size, chunk, len(chunk) < size)
+        return bytes(plain)
+
+
+class EncryptStage:
+
+    def __init__(self, next_stage, password, threads=1, chunk_size=CHUNK_SIZE):
+        """
+        It encrypts the stream with AES-256-GCM in chunks of chunk_size, the key is derived once per file from
+        the password and a random salt. Chunks are encrypted on a pool of worker threads and written to the next
+        stage in order, and every chunk can be decrypted on its own, so encrypted archives can be read by ranges.
+
+        :param next_stage: The stage that receives the encrypted data
+        :param password: The password used to encrypt the stream
+        :param threads: Number of worker threads, defaults to 1 (optional)
+        :param chunk_size: Size of the plaintext of one chunk, defaults to 1MB (optional)
+        """
+        self.next_stage = next_stage
+        self.threads = max(1, int(threads))
+        self.chunk_size = chunk_size
+        self.__cipher = ChunkCipher(create_header(os.urandom(SALT_SIZE), KDF_ITERATIONS, chunk_size), password)
+        self.__buffer = bytearray()
+        self.__number = 0
+        self.__pending = deque()
+        self.__executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='encrypt')
+        self.next_stage.write(self.__cipher.header)
+
+    def __submit(self, data, final=False):
+        self.__pending.append(self.__executor.submit(self.__cipher.encrypt, self.__number, data, final))
+        self.__number += 1
+        while len(self.__pending) > self.threads * 2:
+            self.next_stage.write(self.__pending.popleft().result())
+
+    def write(self, data):
+        self.__buffer += data
+        # the last chunk is shorter than chunk_size, so full chunks are written only when more data follows
+        while len(self.__buffer) > self.chunk_size:
+            self.__submit(bytes(self.__buffer[:self.chunk_size]))
+            del self.__buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        try:
+            if len(self.__buffer) == self.chunk_size:
+                self.__submit(bytes(self.__buffer))
+                self.__buffer = bytearray()
+            self.__submit(bytes(self.__buffer), final=True)
+            while self.__pending:
+                self.next_stage.write(self.__pending.popleft().result())
+        except BaseException:
+            self.abort()
+            raise
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        self.next_stage.close()
+
+    def abort(self):
+        """
+        It discards pending chunks and aborts the next stage, the output isn't complete
+        """
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        self.__pending.clear()
+        self.next_stage.abort()
+
+
+class DecryptReader(io.RawIOBase):
+
+    def __init__(self, fileobj, password, threads=1):
+        """
+        It decrypts the stream encrypted by EncryptStage, chunks are decrypted ahead on a pool of worker threads.
+        A stream that ends without its last chunk raises an error.
+
+        :param fileobj: Binary file like object with the encrypted data
+        :param password: The password to decrypt the stream with
+        :param threads: Number of worker threads, defaults to 1 (optional)
+        """
+        self.fileobj = fileobj
+        self.threads = max(1, int(threads))
+        self.__executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='decrypt')
+        self.__number = 0
+        self.__finished = False
+        self.__pending = deque()
+        self.__data = b''
+        self.__position = 0
+        self.__cipher = ChunkCipher(read_exact(fileobj, HEADER_SIZE), password)
+
+    def readable(self):
+        return True
+
+    def __fill(self):
+        size = self.__cipher.chunk_size + TAG_SIZE
+        while not self.__finished and len(self.__pending) < self.threads * 2:
+            data = read_exact(self.fileobj, size)
+            if len(data) < TAG_SIZE:
+                raise RuntimeError("Encrypted stream is incomplete")
+            final = len(data) < size
+            self.__pending.append(self.__executor.submit(self.__cipher.decrypt, self.__number, data, final))
+            self.__number += 1
+            self.__finished = final
+
+    def readinto(self, buffer):
+        while self.__position == len(self.__data):
+            self.__fill()
+            if not self.__pending:
+                return 0
+            self.__data = self.__pending.popleft().result()
+            self.__position = 0
+        size = min(len(buffer), len(self.__data) - self.__position)
+        buffer[:size] = self.__data[self.__position:self.__position + size]
+        self.__position += size
+        return size
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+        self.fileobj.close()
+        super().close()
+
+
+def encrypt_file(file_name, next_stage, password, threads=1):
+    """
+    It encrypts the file with EncryptStage
+
+    :param file_name: The file to encrypt
+    :param next_stage: The stage that receives the encrypted data, i.e. an open file
+    :param password: The password used to encrypt the file
+    :param threads: Number of worker threads, defaults to 1 (optional)
+    """
+    stage = EncryptStage(next_stage, password, threads)
+    try:
+        with open(file_name, 'rb') as f:
+            for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                stage.write(data)
+    except BaseException:
+        stage.abort()
+        raise
+    stage.close()
+
+
+def decrypt_file(encrypted_file, file_name, password, threads=1):
+    """
+    It decrypts the file encrypted by EncryptStage
+
+    :param encrypted_file: The encrypted file
+    :param file_name: The file that will be created
+    :param password: The password to decrypt the file with
+    :param threads: Number of worker threads, defaults to 1 (optional)
+    """
+    with DecryptReader(open(encrypted_file, 'rb'), password, threads) as reader, open(file_name, 'wb') as f:
+        for data in iter(lambda: reader.read(CHUNK_SIZE), b''):
+            f.write(data)
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+import os
+import re
+import fnmatch
+import logging
+
+logger = logging.getLogger("backup_logger")
+
+# key in the prefix trie that marks the end of an excluded path
+END = ''
+
+
+def has_magic(pattern):
+    return re.search('[*?[]', pattern) is not None
+
+
+class ExcludeMatcher:
+
+    def __init__(self, patterns=None):
+        """
+        Patterns of paths that aren't backed up, compiled once and checked for every entry while the tree is
+        walked, so excluded directories are never read. Patterns follow `tar --exclude`:
+        - an absolute path without wildcards, i.e. /data/www/cache, excludes that path and everything under it,
+        the paths are kept in a prefix trie
+        - a pattern without `/`, i.e. node_modules or *.tmp, is matched against the name of every entry
+        - any other pattern, i.e. /home/*/.cache, is matched against the whole path
+        Name patterns and path patterns are combined into one regular expression each.
+
+        :param patterns: A list of patterns, empty lines and lines starting with # are ignored (optional)
+        """
+        self.patterns = []
+        self.__trie = {}
+        self.__names = set()
+        name_patterns = []
+        path_patterns = []
+        for pattern in patterns or []:
+            pattern = pattern.strip()
+            if pattern == '' or pattern.startswith('#'):
+                continue
+            self.patterns.append(pattern)
+            if len(pattern) > 1:
+                pattern = pattern.rstrip('/')
+            if '/' not in pattern:
+                if has_magic(pattern):
+                    name_patterns.append(pattern)
+                else:
+                    self.__names.add(pattern)
+            elif pattern.startswith('/') and not has_magic(pattern):
+                node = self.__trie
+                for part in pattern.strip('/').split('/'):
+                    node = node.setdefault(part, {})
+                node[END] = True
+            else:
+                if not pattern.startswith('/'):
+                    pattern = '*/' + pattern
+                path_patterns.append(pattern)
+        self.__name_regex = self.__compile(name_patterns)
+        self.__path_regex = self.__compile(path_patterns)
+
+    @staticmethod
+    def __compile(patterns):
+        if len(patterns) == 0:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+
+    def __bool__(self):
+        return len(self.patterns) > 0
+
+    def excluded(self, path):
+        """
+        :param path: The absolute path of the entry
+        :return: True if the entry, and everything under it, shouldn't be backed up.
+        """
+        name = os.path.basename(path)
+        if name in self.__names:
+            return True
+        if self.__name_regex is not None and self.__name_regex.match(name):
+            return True
+        if self.__trie:
+            node = self.__trie
+            for part in path.strip('/').split('/'):
+                node = node.get(part)
+                if node is None:
+                    break
+                if END in node:
+                    return True
+        return self.__path_regex is not None and self.__path_regex.match(path) is not None
+
+
+def read_patterns(exclude_from):
+    """
+    It reads patterns from the file, one pattern per line
+
+    :param exclude_from: The file with patterns
+    :return: A list of patterns, empty if the file can't be read.
+    """
+    try:
+        with open(exclude_from, 'r') as f:
+            return f.read().splitlines()
+    except OSError as e:
+        logger.error("Can't read exclude file: " + exclude_from + ", error: " + str(e))
+        return []
+
+
+def load(exclude=None, exclude_from=None):
+    """
+    It creates the matcher from the options in configuration
+
+    :param exclude: Patterns separated by ;, i.e. `*.tmp;node_modules;/data/www/cache` (optional)
+    :param exclude_from: The file with one pattern per line (optional)
+    :return: The ExcludeMatcher object.
+    """
+    if isinstance(exclude, ExcludeMatcher):
+        return exclude
+    patterns = []
+    if isinstance(exclude, (list, tuple)):
+        patterns += list(exclude)
+    elif exclude is not None and str(exclude).strip() != '':
+        patterns += str(exclude).split(';')
+    if exclude_from is not None and str(exclude_from).strip() != '':
+        patterns += read_patterns(str(exclude_from).strip())
+    matcher = ExcludeMatcher(patterns)
+    if matcher:
+        logger.debug("Exclude patterns: " + ', '.join(matcher.patterns))
+    return matcher
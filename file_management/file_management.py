@@ -1,69 +1,116 @@
+import os
+import re
+import json
+import heapq
+import fcntl
+import shlex
+import shutil
+import hashlib
+import sqlite3
 import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from timeit import default_timer as timer
+from archive import archive
+from archive_index import archive_index
+from checksum import checksum
+from compression import compression
+from delta_sync import delta_sync
+from encryption import encryption
 from utils import utils
 
 logger = logging.getLogger("backup_logger")
 
+# ioctl that makes the copy share blocks with the source, on btrfs, xfs and other filesystems with reflinks
+FICLONE = 0x40049409
 
-def decrypt_data(file_name, password):
+# maximum number of bytes that are copied by one call, 64MB
+COPY_SIZE = 67108864
+
+# name of a backup is <job prefix>-<YYYYMMDDHHMMSS>.tar or <job prefix>_<YYYYMMDDHHMMSS>.sql, with the extension
+# of the codec and .enc, parts, the manifest, the index and checksums of the archive follow the name of the archive
+BACKUP_NAME = re.compile(
+    r'^(?P<prefix>.+)[-_](?P<time>[0-9]{14})(?P<ext>\.(tar|sql)(' +
+    '|'.join(re.escape(codec[3]) for codec in compression.CODECS.values() if codec[3]) +
+    r')?)(?P<enc>\.enc)?(\.part[0-9]+|\.manifest|\.index|' + re.escape(checksum.CHECKSUM_SUFFIX) + r')?$')
+
+# state of synchronizations from the previous run: numbers of files in top-level directories, used to balance
+# shards of rsync, and file list caches of the native engine
+SYNC_STATE_DIR = '/var/lib/backup'
+
+
+def decrypt_data(file_name, password, threads=1):
     """
-    It decrypts the file using the provided password
+    It decrypts the file using the provided password, files encrypted with `openssl enc` by older versions
+    are decrypted with openssl
 
     :param file_name: The name of the file to be encrypted
     :param password: The password used to encrypt the file
+    :param threads: Number of threads used for decryption, defaults to 1 (optional)
     :return: The name of the file without the .enc extension.
     """
 
-    enc_cmd = ('openssl enc -aes-256-cbc -d -in ' + file_name + ' -out ' +
-               file_name[:len(file_name) - 4] + ' -pass pass:' + password)
     logger.info("---------------------------------------")
     logger.info("start description")
     logger.info("---------------------------------------")
     start = timer()
-    code, out, err = utils.run(enc_cmd)
-    end = timer()
-    if code > 0:
-        logger.error("Error while decrypting file, status code: " + str(code) +
-                     " , standard output: " + out + ", standard error: " + err)
+    try:
+        if encryption.is_chunked(file_name):
+            encryption.decrypt_file(file_name, file_name[:len(file_name) - 4], password, threads)
+        else:
+            env = dict(os.environ)
+            env['BACKUP_ENC_PASS'] = password
+            proc = subprocess.run(['openssl', 'enc', '-aes-256-cbc', '-d', '-in', file_name, '-out',
+                                   file_name[:len(file_name) - 4], '-pass', 'env:BACKUP_ENC_PASS'],
+                                  env=env, capture_output=True, text=True)
+            if proc.returncode > 0:
+                raise RuntimeError("openssl failed with status code: " + str(proc.returncode) +
+                                   ", standard error: " + proc.stderr)
+    except (OSError, RuntimeError) as e:
+        logger.error("Error while decrypting file: " + file_name + ", error: " + str(e))
+        if os.path.isfile(file_name[:len(file_name) - 4]):
+            os.remove(file_name[:len(file_name) - 4])
         return
-    else:
-        logger.info("Time took for decrypting :" +
-                    str(timedelta(seconds=end - start)))
-        logger.debug("Standard output: " + out)
-        utils.run('rm ' + file_name)
-        return file_name[:len(file_name) - 4]
+    end = timer()
+    logger.info("Time took for decrypting :" +
+                str(timedelta(seconds=end - start)))
+    archive.remove_archive(file_name)
+    return file_name[:len(file_name) - 4]
 
 
-def encrypt_data(file_name, password):
+def encrypt_data(file_name, password, threads=1):
     """
-    It encrypts the file using the provided password
+    It encrypts the file using the provided password, the encrypted file is hashed while it is written,
+    so it gets its checksums without another read
 
     :param file_name: The name of the file to be encrypted
     :param password: The password used to encrypt the file
+    :param threads: Number of threads used for encryption, defaults to 1 (optional)
     :return: The encrypted file name is being returned.
     """
 
-    enc_cmd = ('openssl ' + 'enc ' + '-aes-256-cbc ' + '-in ' + file_name + ' ' +
-               '-out ' + file_name + '.enc ' + '-pass pass:' + password)
-    enc_cmd_log = ('openssl ' + 'enc ' + '-aes-256-cbc ' + '-in ' + file_name + ' ' +
-                   '-out ' + file_name + '.enc ' + '-pass pass:***************')
     logger.info("---------------------------------------")
     logger.info("start encryption")
     logger.info("---------------------------------------")
     start = timer()
-    code, out, err = utils.run(enc_cmd, enc_cmd_log)
-    end = timer()
-    if code > 0:
-        logger.error("Error while encrypting file, status code: " + str(code) +
-                     " , standard output: " + out + ", standard error: " + err)
+    try:
+        sink = archive.ChecksumStage(archive.FileSink(file_name + '.enc'), [file_name + '.enc'])
+        encryption.encrypt_file(file_name, sink, password, threads)
+    except (OSError, RuntimeError) as e:
+        logger.error("Error while encrypting file: " + file_name + ", error: " + str(e))
+        archive.remove_archive(file_name + '.enc')
         return
-    else:
-        logger.info("Time took for encrypting :" +
-                    str(timedelta(seconds=end - start)))
-        logger.debug("Standard output: " + out)
-        utils.run('rm ' + file_name)
-        return file_name + '.enc'
+    end = timer()
+    logger.info("Time took for encrypting :" +
+                str(timedelta(seconds=end - start)))
+    try:
+        os.remove(file_name)
+    except OSError as e:
+        # the encrypted file is complete, only the unencrypted one is left in the directory
+        logger.error("Error while removing unencrypted file: " + file_name + ", error: " + str(e))
+    return file_name + '.enc'
 
 
 def encrypt_data_remote(host, file_name, password):
@@ -98,6 +145,142 @@ def encrypt_data_remote(host, file_name, password):
         return file_name + '.enc'
 
 
+def copy_file(source, target):
+    """
+    It copies the file without reading it into this process: as a reflink (FICLONE) if the filesystem
+    supports it, so blocks are shared, otherwise with copy_file_range or sendfile in the kernel, and
+    with a buffered copy as the last resort. The copy is written to target.tmp and renamed.
+
+    :param source: The file to copy
+    :param target: The file that will be created
+    :return: The method that was used.
+    """
+    size = os.path.getsize(source)
+    with open(source, 'rb') as src, open(target + '.tmp', 'wb') as dst:
+        method = None
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            method = 'reflink'
+        except OSError:
+            pass
+        for name, func in [('copy_file_range', getattr(os, 'copy_file_range', None)), ('sendfile', os.sendfile)]:
+            if method is not None or func is None:
+                continue
+            copied = 0
+            try:
+                while copied < size:
+                    if name == 'sendfile':
+                        count = func(dst.fileno(), src.fileno(), copied, min(size - copied, COPY_SIZE))
+                    else:
+                        count = func(src.fileno(), dst.fileno(), min(size - copied, COPY_SIZE))
+                    if count == 0:
+                        break
+                    copied += count
+                method = name
+            except OSError as e:
+                # the method isn't supported between these filesystems, nothing is written yet
+                if copied > 0:
+                    raise
+                logger.debug(name + " isn't supported for file: " + source + ", error: " + str(e))
+        if method is None:
+            shutil.copyfileobj(src, dst, COPY_SIZE)
+            method = 'buffered'
+    if os.path.getsize(target + '.tmp') != size:
+        os.remove(target + '.tmp')
+        raise OSError("Copy of file: " + source + " is incomplete")
+    shutil.copymode(source, target + '.tmp')
+    os.replace(target + '.tmp', target)
+    return method
+
+
+def known_checksums(sources):
+    """
+    :param sources: A list of files
+    :return: Dictionary name -> (chunk size, checksums of the file) for files listed in .sums files among sources.
+    """
+    known = {}
+    for source in sources:
+        if not source.endswith(checksum.CHECKSUM_SUFFIX):
+            continue
+        try:
+            sums = checksum.load(source)
+        except (OSError, ValueError) as e:
+            logger.warning("Can't read checksums: " + source + ", error: " + str(e))
+            continue
+        for f in sums['files']:
+            known[f['name']] = (sums['chunk_size'], f)
+    return known
+
+
+def copy_files(sources, destinations, names=None):
+    """
+    It copies files to several destinations, every destination is copied by its own thread. Every copy is
+    verified: files listed in a .sums file among sources are checked against their chunk hashes, other files
+    against sha256 of the source. Throughput is logged for every destination.
+
+    :param sources: A list of files to copy
+    :param destinations: A list of directories
+    :param names: A list of names of copies relative to the destination, defaults to names of sources (optional)
+    :return: A list of destinations where some file couldn't be copied or verified.
+    """
+    names = names or [os.path.basename(source) for source in sources]
+    known = known_checksums(sources)
+    source_hashes = {}
+    lock = threading.Lock()
+
+    def source_sha256(source):
+        with lock:
+            if source not in source_hashes:
+                source_hashes[source] = archive_index.file_sha256(source)
+            return source_hashes[source]
+
+    def verify(source, target):
+        name = os.path.basename(target)
+        if name in known and os.path.basename(source) == name:
+            chunk_size, f = known[name]
+            if os.path.getsize(target) != f['size']:
+                return False
+            sums = {'chunk_size': chunk_size, 'files': [f]}
+            return checksum.verify(sums, archive_index.local_reader(os.path.dirname(target))) == []
+        return archive_index.file_sha256(target) == source_sha256(source)
+
+    def copy_to(destination):
+        start = timer()
+        copied = 0
+        copy_time = 0
+        methods = set()
+        for i in range(len(sources)):
+            target = os.path.join(destination, names[i])
+            try:
+                copy_start = timer()
+                methods.add(copy_file(sources[i], target))
+                copy_time += timer() - copy_start
+                copied += os.path.getsize(target)
+                if not verify(sources[i], target):
+                    logger.error("Copy: " + target + " doesn't match the source, it is removed")
+                    os.remove(target)
+                    return False
+            except OSError as e:
+                logger.error("Error while copying file: " + sources[i] + " to: " + destination + ", error: " + str(e))
+                if os.path.isfile(target + '.tmp'):
+                    os.remove(target + '.tmp')
+                return False
+        logger.info("Files copied to: " + destination + ", bytes: " + str(copied) + ", method: " +
+                    ', '.join(sorted(methods)) + ", speed: " +
+                    str(round(copied / max(copy_time, 0.000001) / 1048576, 1)) + " MB/s, time with verification: " +
+                    str(timedelta(seconds=timer() - start)))
+        return True
+
+    logger.info("---------------------------------------")
+    logger.info("start coping files")
+    logger.info("---------------------------------------")
+    if len(destinations) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=len(destinations), thread_name_prefix='copy') as executor:
+        results = list(executor.map(copy_to, destinations))
+    return [destinations[i] for i in range(len(destinations)) if not results[i]]
+
+
 def copy(file, destination, file_name):
     """
     It copies a file from one location to another
@@ -105,33 +288,27 @@ def copy(file, destination, file_name):
     :param file: The file you want to copy
     :param destination: The destination folder where the file will be copied to
     :param file_name: The name of the file you want to copy
-    :return: the time it took to copy the file.
+    :return: True if the file is copied and verified, otherwise False.
     """
-
-    cp_cmd = 'cp ' + file + ' ' + destination + '/' + file_name
-    logger.info("---------------------------------------")
-    logger.info("start coping files")
-    logger.info("---------------------------------------")
-    start = timer()
-    code, out, err = utils.run(cp_cmd)
-    end = timer()
-    if code > 0:
-        logger.error(err)
-        return
-    else:
-        logger.info("File successfully copied to: " + destination)
-        logger.info("Time took for coping: " +
-                    str(timedelta(seconds=end - start)))
-        logger.debug("Standard output: " + out)
+    return len(copy_files([file], [destination], [file_name])) == 0
 
 
-def sync(src, dst):
+def sync(src, dst, engine='rsync', threads=4, parallelism=1, full_scan_interval=24, whole_file='True'):
     """
-    It synchronizes the source and destination directories
+    It synchronizes the source and destination directories, with rsync or with the native engine that
+    transfers several files at once and sends only changed blocks of files
 
     :param src: The source directory to be synchronized
     :param dst: The destination directory
-    :return: the code, out, and err.
+    :param engine: rsync or native, defaults to rsync (optional)
+    :param threads: Number of threads of the native engine, defaults to 4 (optional)
+    :param parallelism: Number of rsync processes that synchronize top-level directories at the same time,
+    defaults to 1 (optional)
+    :param full_scan_interval: Hours between full scans of both trees by the native engine, in other runs only
+    changed directories of the source are listed, 0 scans them as a whole every time, defaults to 24 (optional)
+    :param whole_file: True/False, False makes the native engine transfer only changed blocks of files that exist
+    in the destination, defaults to True (optional)
+    :return: Dictionary with counters of the synchronization, or None if it failed.
     """
 
     logger.info("---------------------------------------")
@@ -139,31 +316,61 @@ def sync(src, dst):
     logger.info("---------------------------------------")
     logger.info("Synchronizing directories: " +
                 src + " Dst: " + dst)
-    if src[-1] != '/':
-        src = src + '/'
-    rsync_cmd = 'rsync -a --delete ' + src + ' ' + dst
     start = timer()
-    code, out, err = utils.run(rsync_cmd)
-    if code > 0:
-        logger.error("Error while synchronizing directories, \
-                     standard Error: " + err + ", Standard output: " + out)
-        return
+    if str(engine).strip().lower() == 'native':
+        try:
+            cache = delta_sync.FileListCache(sync_state_file(None, src, dst, '.db'))
+            stats = delta_sync.sync_tree(src, dst, threads, cache, float(full_scan_interval) * 3600,
+                                         str(whole_file).upper() != 'FALSE')
+        except (OSError, sqlite3.Error) as e:
+            logger.error("Error while synchronizing directories, error: " + str(e))
+            return
+        if stats['errors'] > 0:
+            logger.error("Directories " + src + ' and ' + dst + " are synchronized with errors: " +
+                         delta_sync.format_stats(stats))
+            return stats
+    elif int(parallelism) > 1:
+        try:
+            directories = [e.name for e in os.scandir(src) if e.is_dir(follow_symlinks=False)]
+        except OSError as e:
+            logger.error("Error while listing directory: " + src + ", error: " + str(e))
+            return
+        stats = sync_sharded(src, dst, parallelism, 'rsync -a --delete --stats',
+                             lambda cmd: utils.run(cmd, keep_lines=1000), directories,
+                             sync_state_file(None, src, dst))
+        if stats is None:
+            return
     else:
-        logger.debug("Directories " + src + ' and ' +
-                     dst + " are successfully synchronized")
-        end = timer()
-        logger.info("Time took for synchronization: " +
-                    str(timedelta(seconds=end - start)))
+        if src[-1] != '/':
+            src = src + '/'
+        rsync_cmd = ['rsync', '-a', '--delete', '--stats', src, dst]
+        code, out, err = utils.run(rsync_cmd, keep_lines=1000)
+        if code > 0:
+            logger.error("Error while synchronizing directories, \
+                         standard Error: " + err + ", Standard output: " + out)
+            return
+        stats = delta_sync.parse_rsync_stats(out)
+    logger.debug("Directories " + src + ' and ' +
+                 dst + " are successfully synchronized")
+    end = timer()
+    logger.info("Synchronization: " + delta_sync.format_stats(stats))
+    logger.info("Time took for synchronization: " +
+                str(timedelta(seconds=end - start)))
+    return stats
 
 
-def sync_remote(host, source, destination):
+def sync_remote(host, source, destination, io_policy=None, parallelism=1):
     """
     It uses rsync to synchronize the contents of two directories
 
     :param host: The hostname of the remote machine
     :param source: The source directory to be synchronized
     :param destination: The destination directory on the remote machine
-    :return: the code, out, and err.
+    :param io_policy: The IoPolicy, rsync is executed with its ionice and nice values and its bandwidth is limited
+    to its rate (optional)
+    :param parallelism: Number of rsync processes that synchronize top-level directories at the same time, they
+    share the bandwidth limit, defaults to 1 (optional)
+    :return: Dictionary with counters of the synchronization, or None if it failed.
     """
 
     logger.info("---------------------------------------")
@@ -173,29 +380,379 @@ def sync_remote(host, source, destination):
     logger.info("Host: " + str(host))
     logger.info("Synchronizing directories: " +
                 source + " Dst: " + destination)
-    if source[-1] != '/':
-        source = source + '/'
-    rsync_cmd = 'rsync -a --delete ' + source + ' ' + destination
+    if io_policy is None:
+        io_policy = utils.IoPolicy()
     start = timer()
-    code, out, err = utils.run_remote(rsync_cmd, host)
+    if int(parallelism) > 1:
+        batch = RemoteBatch(host)
+        batch.run('ls -1Ap -- ' + shlex.quote(source))
+        code, out = batch.execute()[0]
+        if code is None or code > 0:
+            logger.error("Error while listing directory: " + source + " on host: " + host + ", error: " + out)
+            return
+        directories = [line[:-1] for line in out.split('\n') if line.endswith('/')]
+        rsync_cmd = io_policy.command_prefix() + 'rsync -a --delete --stats' + io_policy.rsync_options(parallelism)
+        stats = sync_sharded(source, destination, parallelism, rsync_cmd, lambda cmd: utils.run_remote(cmd, host),
+                             directories, sync_state_file(host, source, destination))
+        if stats is None:
+            return
+    else:
+        if source[-1] != '/':
+            source = source + '/'
+        rsync_cmd = io_policy.command_prefix() + 'rsync -a --delete --stats' + io_policy.rsync_options() + ' ' + \
+            source + ' ' + destination
+        code, out, err = utils.run_remote(rsync_cmd, host)
+        if code > 0:
+            logger.error("Error while synchronizing directories, \
+                         standard Error: " + err + ", Standard output: " + out)
+            return
+        stats = delta_sync.parse_rsync_stats(out)
+    logger.debug("Directories " + source + ' and ' +
+                 destination + " are successfully synchronized")
+    end = timer()
+    logger.info("Synchronization: " + delta_sync.format_stats(stats))
+    logger.info("Time took for synchronization: " +
+                str(timedelta(seconds=end - start)))
+    return stats
+
+
+def sync_state_file(host, source, destination, extension='.json'):
+    """
+    :return: The file with the state of the synchronization from the previous run, weights of top-level
+    directories (.json) or the file list cache (.db).
+    """
+    key = hashlib.sha1((str(host) + ':' + source + ':' + destination).encode('utf-8')).hexdigest()
+    return os.path.join(SYNC_STATE_DIR, 'sync-' + key[:16] + extension)
+
+
+def load_sync_weights(state_file):
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_sync_weights(state_file, weights):
+    try:
+        os.makedirs(os.path.dirname(state_file), exist_ok=True)
+        with open(state_file + '.tmp', 'w') as f:
+            json.dump(weights, f)
+        os.replace(state_file + '.tmp', state_file)
+    except OSError as e:
+        logger.warning("Can't save weights of the synchronization to: " + state_file + ", error: " + str(e))
+
+
+def shard_directories(directories, weights, parallelism):
+    """
+    It splits directories into balanced shards, the heaviest directory is added to the lightest shard first.
+    A directory without a weight from the previous run gets the average weight.
+
+    :param directories: Names of directories
+    :param weights: Dictionary name -> number of files from the previous run
+    :param parallelism: Number of shards
+    :return: A list of shards, every shard is a list of names of directories.
+    """
+    known = [weights[d] for d in directories if d in weights]
+    default = sum(known) / len(known) if known else 1
+    shards = [[] for _ in range(max(1, min(int(parallelism), len(directories))))]
+    loads = [(0, i) for i in range(len(shards))]
+    for d in sorted(directories, key=lambda name: (-weights.get(name, default), name)):
+        load, i = heapq.heappop(loads)
+        shards[i].append(d)
+        heapq.heappush(loads, (load + max(1, weights.get(d, default)), i))
+    return shards
+
+
+def sync_sharded(source, destination, parallelism, rsync_cmd, run, directories, state_file):
+    """
+    It synchronizes the tree with several rsync processes at the same time. The first rsync copies only the top
+    level of the tree (--no-recursive --dirs) and deletes everything at the top level that isn't in the source,
+    then every top-level directory is synchronized by its own `rsync --delete`, so deletions stay correct in
+    the whole tree. Directories are split into shards that are balanced by numbers of files from the previous
+    run, and the shards run at the same time.
+
+    :param source: The source directory
+    :param destination: The destination directory, can be host:directory
+    :param parallelism: Number of shards
+    :param rsync_cmd: The rsync command with options, i.e. rsync -a --delete --stats
+    :param run: Function that executes the command with a shell, waits until it finishes and returns its exit
+    status, out, and err
+    :param directories: Names of top-level directories of the source
+    :param state_file: The file with weights of directories from the previous run
+    :return: Dictionary with counters of the synchronization, or None if it failed.
+    """
+    source = source if source.endswith('/') else source + '/'
+    destination = destination if destination.endswith('/') else destination + '/'
+    code, out, err = run(rsync_cmd + ' --no-recursive --dirs ' + shlex.quote(source) + ' ' +
+                         shlex.quote(destination))
     if code > 0:
-        logger.error("Error while synchronizing directories, \
-                     standard Error: " + err + ", Standard output: " + out)
+        logger.error("Error while synchronizing top level of: " + source + ", standard Error: " + err +
+                     ", Standard output: " + out)
         return
-    else:
-        logger.debug("Directories " + source + ' and ' +
-                     destination + " are successfully synchronized")
-        end = timer()
-        logger.info("Time took for synchronization: " +
-                    str(timedelta(seconds=end - start)))
+    stats = delta_sync.parse_rsync_stats(out)
+    weights = load_sync_weights(state_file)
+    shards = shard_directories(directories, weights, parallelism)
+    logger.info("Directories: " + str(len(directories)) + ", shards: " + str(len(shards)))
+    lock = threading.Lock()
+    failed = []
+
+    def run_shard(shard):
+        for d in shard:
+            code, out, err = run(rsync_cmd + ' ' + shlex.quote(source + d + '/') + ' ' +
+                                 shlex.quote(destination + d + '/'))
+            if code > 0:
+                logger.error("Error while synchronizing directory: " + source + d + ", standard Error: " + err +
+                             ", Standard output: " + out)
+                with lock:
+                    failed.append(d)
+                continue
+            result = delta_sync.parse_rsync_stats(out)
+            with lock:
+                # without the statistics the weight from the previous run is kept, 0 would spoil the balance
+                if 'Number of files:' in out:
+                    weights[d] = result['files']
+                else:
+                    logger.warning("Statistics of rsync for directory: " + source + d + " weren't received")
+                for key in delta_sync.STATS_KEYS:
+                    stats[key] += result[key]
+
+    if shards[0]:
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='sync') as executor:
+            list(executor.map(run_shard, shards))
+    save_sync_weights(state_file, {d: weights[d] for d in directories if d in weights})
+    if failed:
+        logger.error("Synchronization failed for directories: " + ', '.join(failed))
+        return
+    return stats
+
+
+def parse_backup_name(file_name):
+    """
+    It parses the name of a backup file, i.e. data-www-full-20240101120000.tar.gz.enc.part0001 or
+    mysqldump_shop_20240101120000.sql.zst
+
+    :param file_name: The name of the file, without the directory
+    :return: Tuple (job prefix, time, encrypted, name of the archive), or None if the file isn't a backup.
+    """
+    match = BACKUP_NAME.match(file_name)
+    if match is None:
+        return None
+    archive_name = file_name[:match.end('enc')] if match.group('enc') else file_name[:match.end('ext')]
+    return match.group('prefix'), match.group('time'), match.group('enc') is not None, archive_name
+
+
+def retention_plan(file_names, jobs):
+    """
+    It computes which files are deleted for all jobs that keep backups in one directory, in one pass over the
+    listing of the directory. Backups are grouped by the exact prefix of the job, so the job `data` doesn't
+    match backups of `data-old`, and ordered by the time in their names. Parts, the manifest, the index and
+    checksums of an archive are counted as one copy and deleted together.
+
+    :param file_names: Names of files in the directory
+    :param jobs: A list of tuples (prefix, encrypt, no_copies), no_copies None keeps only the oldest and the newest
+    backup
+    :return: A list of names of files to delete.
+    """
+    rules = {}
+    for prefix, encrypt, no_copies in jobs:
+        rules[(prefix, str(encrypt).upper() == 'TRUE')] = no_copies
+    backups = {}
+    for file_name in file_names:
+        parsed = parse_backup_name(file_name)
+        if parsed is None or (parsed[0], parsed[2]) not in rules:
+            continue
+        prefix, time, encrypted, archive_name = parsed
+        backups.setdefault((prefix, encrypted), {}).setdefault((time, archive_name), []).append(file_name)
+    delete = []
+    for key, groups in backups.items():
+        newest_first = sorted(groups, reverse=True)
+        if rules[key] is None:
+            old = newest_first[1:-1]
+        else:
+            old = newest_first[max(0, int(rules[key])):]
+        logger.debug("Backups of: " + key[0] + ", encrypted: " + str(key[1]) + ", total: " +
+                     str(len(newest_first)) + ", for deletion: " + str(len(old)))
+        for group in old:
+            delete += sorted(groups[group])
+    return delete
+
+
+class RemoteBatch:
+
+    def __init__(self, host):
+        """
+        Filesystem operations on one remote host that are collected and executed by one remote command, every
+        operation returns the number of its result in the list returned by execute
+
+        :param host: The hostname or IP address of the remote host
+        """
+        self.host = host
+        self.__commands = []
+        self.__logs = []
+        self.__parsers = []
+
+    def __add(self, command, parser, command_log=None):
+        self.__commands.append(command)
+        self.__logs.append(command if command_log is None else command_log)
+        self.__parsers.append(parser)
+        return len(self.__commands) - 1
+
+    def __received(self, code, out, operation):
+        """
+        :return: True if the result of the operation was received from the host, otherwise the error is logged.
+        """
+        if code is None:
+            logger.error("Result of " + operation + " wasn't received from host: " + self.host + ", error: " + out)
+            return False
+        return True
+
+    def path_exists(self, path):
+        """
+        :return: Number of the result, True if the path is a directory, None if it couldn't be checked.
+        """
+        def parse(code, out):
+            if not self.__received(code, out, "check of path: " + path):
+                return None
+            return code == 0
+        return self.__add('[ -d ' + shlex.quote(path) + ' ]', parse)
+
+    def list_files(self, directory):
+        """
+        :return: Number of the result, a list of names of files in the directory or None if it can't be listed.
+        """
+        def parse(code, out):
+            if not self.__received(code, out, "listing of directory: " + directory):
+                return None
+            if code > 0:
+                logger.error("Error while listing directory: " + directory + " on host: " + self.host +
+                             ", error: " + out + " code: " + str(code))
+                return None
+            return [line for line in out.split('\n') if line != '']
+        return self.__add('ls -1A -- ' + shlex.quote(directory), parse)
+
+    def remove_files(self, directory, file_names):
+        """
+        :return: Number of the result, number of files that couldn't be removed.
+        """
+        def parse(code, out):
+            if not self.__received(code, out, "removing of files from directory: " + directory):
+                return len(file_names)
+            if code > 0:
+                logger.error("Error while removing files from directory: " + directory + " on host: " + self.host +
+                             ", error: " + out + " code: " + str(code))
+                return len(file_names)
+            logger.debug("Files successfully deleted: " + ', '.join(file_names))
+            return 0
+        return self.__add('rm -f -- ' + ' '.join(shlex.quote(directory + '/' + f) for f in file_names), parse)
+
+    def run(self, command, command_log=None):
+        """
+        :param command: The shell command
+        :param command_log: The command that will be logged instead of the command, i.e. without a password (optional)
+        :return: Number of the result, tuple (exit status, output with standard error) of the command, the status
+        is None if the result wasn't received.
+        """
+        return self.__add(command, lambda code, out: (code, out), command_log)
+
+    def execute(self):
+        """
+        It executes all collected operations with one remote command
+
+        :return: A list of results, in the order of operations.
+        """
+        if len(self.__commands) == 0:
+            return []
+        logger.debug("Executing " + str(len(self.__commands)) + " operations on host: " + self.host)
+        results = utils.run_remote_batch(self.__commands, self.host, '; '.join(self.__logs))
+        parsed = [self.__parsers[i](results[i][0], results[i][1]) for i in range(len(results))]
+        self.__commands = []
+        self.__logs = []
+        self.__parsers = []
+        return parsed
+
+
+def list_files(directory, host=None):
+    """
+    It lists names of files in the directory, with one os.scandir or with one command on the remote host
+
+    :param directory: The directory
+    :param host: The hostname or IP address of the remote host, the directory is local if it is None (optional)
+    :return: A list of names of files, or None if the directory can't be listed.
+    """
+    if host is None:
+        try:
+            with os.scandir(directory) as entries:
+                return [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
+        except OSError as e:
+            logger.error("Error while listing directory: " + directory + ", error: " + str(e))
+            return None
+    batch = RemoteBatch(host)
+    batch.list_files(directory)
+    return batch.execute()[0]
+
+
+def remove_files(directory, file_names, host=None):
+    """
+    It removes the files from the directory, on the remote host all files are removed with one command
+
+    :param directory: The directory where the files are located
+    :param file_names: Names of files to remove
+    :param host: The hostname or IP address of the remote host, the directory is local if it is None (optional)
+    :return: Number of files that couldn't be removed.
+    """
+    if len(file_names) == 0:
+        return 0
+    if host is not None:
+        batch = RemoteBatch(host)
+        batch.remove_files(directory, file_names)
+        return batch.execute()[0]
+    failed = 0
+    for f in file_names:
+        try:
+            os.remove(directory + '/' + f)
+            logger.debug("File " + directory + '/' + f + " successfully deleted")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Error while removing file: " + directory + '/' + f + ", error: " + str(e))
+            failed += 1
+    return failed
+
+
+def apply_retention(directory, jobs, host=None, file_names=None):
+    """
+    It deletes old backups of all jobs in the directory: the directory is listed once, deletions are computed
+    by retention_plan and files are removed without spawning a process per file. On a remote host the listing
+    can be taken by the same remote command as the backup, then the retention is one remote command.
+
+    :param directory: The directory where the backups are located
+    :param jobs: A list of tuples (prefix, encrypt, no_copies), no_copies None keeps only the oldest and the newest
+    backup
+    :param host: The hostname or IP address of the remote host, the directory is local if it is None (optional)
+    :param file_names: Names of files in the directory if it is already listed, i.e. by RemoteBatch.list_files
+    in the batch of the backup (optional)
+    :return: A list of names of deleted files, or None if the directory can't be listed.
+    """
+    if file_names is None:
+        file_names = list_files(directory, host)
+    if file_names is None:
+        return None
+    delete = retention_plan(file_names, jobs)
+    logger.debug("Number of files: " + str(len(file_names)) + ", for deletion: " + str(len(delete)))
+    failed = remove_files(directory, delete, host)
+    if failed > 0:
+        logger.error("Files that couldn't be deleted from directory: " + directory + ": " + str(failed))
+    logger.info("Finished deleting files from directory: " + directory)
+    return delete
 
 
 def rmold(directory, name, no_copies, encrypt):
     """
-    It deletes all but the most recent N files in a directory
+    It deletes all but the most recent N backups in a directory
 
     :param directory: The directory where the files are located
-    :param name: The name of the file to be backed up
+    :param name: The prefix of the backup job, i.e. data-www-full
     :param no_copies: The number of copies to keep
     :param encrypt: True/False
     """
@@ -205,42 +762,21 @@ def rmold(directory, name, no_copies, encrypt):
     logger.info("---------------------------------------")
     logger.info("Deleting files from directory: " + str(directory))
     logger.debug("Number of files to save: " + str(no_copies))
-    if encrypt.upper() == "FALSE":
-        list_cmd = 'ls -t ' + directory + ' | grep \'' + name + '\' | grep -v \'.enc$\''
-    else:
-        list_cmd = 'ls -t ' + directory + ' | grep -E \'' + name + '.*.enc*\''
-    code, out, err = utils.run(list_cmd)
-    if code == 0:
-        line = out.split('\n')
-        logger.debug("Number of files: " + str(len(line) - 1))
-        logger.debug("Number of files for deletion: " +
-                     str(len(line) - int(no_copies) - 1))
-        for i in range(int(no_copies), len(line) - 1):
-            f = directory + '/' + line[i].split(' ')[0]
-            rm_cmd = 'rm ' + f
-            code, out, err = utils.run(rm_cmd)
-            if code > 0:
-                logger.error("Error while removing file: " + f +
-                             ", Standard Error: " + err + ", Standard output: " + out)
-            else:
-                logger.debug("File " + f + " successfully deleted")
-
-        logger.info("Finished deleting files from directory: " + directory)
-    else:
-        logger.error("Error while listing files with error: " + err +
-                     " out: " + out + " code: " + str(code))
+    apply_retention(directory, [(name, encrypt, no_copies)])
 
 
-def rmold_remote(host, directory, name, no_copies, encrypt):
+def rmold_remote(host, directory, name, no_copies, encrypt, file_names=None):
     """
-    It deletes old files from a remote host
+    It deletes old backups from a remote host with one command. The directory is listed by another command,
+    unless the listing is provided, i.e. from the batch that created the backup.
 
     :param host: The hostname or IP address of the remote host
     :param directory: The directory where the files are located
-    :param name: The name of the file to be backed up
+    :param name: The prefix of the backup job, i.e. mysqldump_shop_db01
     :param no_copies: The number of copies to keep
     :param encrypt: This is a boolean value that tells the script
                     whether to encrypt the backup
+    :param file_names: Names of files in the directory, listed after the backup was created (optional)
     """
 
     logger.info("---------------------------------------")
@@ -249,38 +785,15 @@ def rmold_remote(host, directory, name, no_copies, encrypt):
     logger.info("Deleting files on host: " + host)
     logger.info("Deleting files from directory: " + str(directory))
     logger.debug("Number of files to save: " + str(no_copies))
-    if encrypt.upper() == "FALSE":
-        list_cmd = 'ls -t ' + directory + ' | grep \'' + name + '\' | grep -v \'.enc$\''
-    else:
-        list_cmd = 'ls -t ' + directory + ' | grep -E \'' + name + '.*.enc*\''
-    code, out, err = utils.run_remote(list_cmd, host)
-    if code == 0:
-        line = out.split('\n')
-        logger.debug("Number of files: " + str(len(line) - 1))
-        logger.debug("Number of files for deletion: " +
-                     str(len(line) - int(no_copies) - 1))
-        for i in range(int(no_copies), len(line) - 1):
-            f = directory + '/' + line[i].split(' ')[0]
-            rm_cmd = 'rm ' + f
-            code, out, err = utils.run_remote(rm_cmd, host)
-            if code > 0:
-                logger.error("Error while removing file: " + f +
-                             ", Standard Error: " + err + ", Standard output: " + out)
-            else:
-                logger.debug("File " + f + " successfully deleted")
-
-        logger.info("Finished deleting files from directory: " + directory)
-    else:
-        logger.error("Error while listing files with error: " + err +
-                     " out: " + out + " code: " + str(code))
+    apply_retention(directory, [(name, encrypt, no_copies)], host, file_names)
 
 
 def keep_only_oldest_and_newest(directory, name, encrypt):
     """
-    It deletes all but the newest and oldest files in a directory
+    It deletes all but the newest and oldest backups in a directory
 
     :param directory: The directory where the files are located
-    :param name: The name of the file to be deleted
+    :param name: The prefix of the backup job, i.e. data-www-inc
     :param encrypt: This is a boolean value that tells the script
                     whether to encrypt the file
     """
@@ -289,43 +802,55 @@ def keep_only_oldest_and_newest(directory, name, encrypt):
     logger.info("start delete")
     logger.info("---------------------------------------")
     logger.info("Deleting files from directory: " + directory)
-    if encrypt.upper() == "FALSE":
-        list_cmd = 'ls -t ' + directory + ' | grep \'' + name + \
-                   '\' | grep -v \'.enc$\' | grep -v \'.snap$\' | grep -v \'.snap.bak$\''
-    else:
-        list_cmd = 'ls -t ' + directory + ' | grep -E \'' + name + '.*.enc*\''
-    code, out, err = utils.run(list_cmd)
-    if code == 0:
-        line = out.split('\n')
-        logger.debug("Number of files: " + str(len(line) - 1))
-        for i in range(1, len(line) - 2):
-            f = directory + '/' + line[i].split(' ')[0]
-            rm_cmd = 'rm ' + f
-            code, out, err = utils.run(rm_cmd)
-            if code > 0:
-                logger.error("Error while removing file: " + f +
-                             ", Standard Error: " + err + ", Standard output: " + out)
-            else:
-                logger.debug("File " + f + " successfully deleted")
-    else:
-        logger.error("Error while listing files: " + err)
+    apply_retention(directory, [(name, encrypt, None)])
+
+
+def rmold_all(directories, jobs):
+    """
+    It deletes old backups of several jobs, i.e. of all paths of one run, every directory is listed once and
+    deletions of all jobs in it are computed in one pass
+
+    :param directories: A list of directories where the backups are located
+    :param jobs: A list of tuples (prefix, encrypt, no_copies), no_copies None keeps only the oldest and the newest
+    backup
+    """
+    if len(jobs) == 0:
+        return
+    logger.info("---------------------------------------")
+    logger.info("start delete")
+    logger.info("---------------------------------------")
+    for directory in directories:
+        logger.info("Deleting files of " + str(len(jobs)) + " jobs from directory: " + str(directory))
+        apply_retention(directory, jobs)
+
+
+def paths_exist(paths, host):
+    """
+    It checks all paths on the remote host with one remote command
+
+    :param paths: A list of paths
+    :param host: The hostname or IP address of the remote host
+    :return: Dictionary path -> True if the path is a directory on the host, None if it couldn't be checked.
+    """
+    batch = RemoteBatch(host)
+    for path in paths:
+        batch.path_exists(path)
+    results = batch.execute()
+    return {paths[i]: results[i] for i in range(len(paths))}
 
 
 def path_exists(path, host=None):
+    if host is not None:
+        logger.debug("Checking path: " + path + " on host: " + host)
+        return paths_exist([path], host)[path]
     path_check_command = (
             '[ -d "' + path + '" ] && echo "true" || echo "false"'
     )
     logger.debug("Check path command: "+path_check_command)
-    if host is not None:
-        logger.debug("Checking path: " + path + " on host: " + host)
-        path_cmd_code, path_cmd_out, path_cmd_err = utils.run_remote(path_check_command, host)
-        logger.debug("path_cmd_code: " + str(path_cmd_code) + " path_cmd_out: " + str(path_cmd_out) +
-                     " path_cmd_err: " + str(path_cmd_err))
-    else:
-        logger.debug("Checking path: " + path + " locally")
-        path_cmd_code, path_cmd_out, path_cmd_err = utils.run(path_check_command)
-        logger.debug("path_cmd_code: " + str(path_cmd_code) + " path_cmd_out: " + str(path_cmd_out) +
-                     " path_cmd_err: " + str(path_cmd_err))
+    logger.debug("Checking path: " + path + " locally")
+    path_cmd_code, path_cmd_out, path_cmd_err = utils.run(path_check_command)
+    logger.debug("path_cmd_code: " + str(path_cmd_code) + " path_cmd_out: " + str(path_cmd_out) +
+                 " path_cmd_err: " + str(path_cmd_err))
     if path_cmd_out:
         return path_cmd_out.strip().lower() == 'true'
     return False
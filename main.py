@@ -12,6 +12,12 @@ def catch_hup(signal_umber, frame):
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'restore':
+        from restore import restore
+        sys.exit(0 if restore.main(sys.argv[2:]) else 1)
+    if len(sys.argv) > 1 and sys.argv[1] == 'verify':
+        from checksum import checksum
+        sys.exit(0 if checksum.main(sys.argv[2:]) else 1)
     path = '/etc/backup/backup.cnf'
     if len(sys.argv) > 1:
         path = str(sys.argv[1])
@@ -1,5 +1,8 @@
+import shlex
 import logging
 from utils import utils
+from archive import archive
+from compression import compression as compression_module
 from file_management import file_management
 from datetime import timedelta
 from timeit import default_timer as timer
@@ -8,7 +11,7 @@ logger = logging.getLogger("backup_logger")
 
 
 def mysqldump(database, user, password, dest, encrypt="False", enc_password=None, no_copies=3, one_drive=None,
-              one_drive_dir=None):
+              one_drive_dir=None, compression='none', split_size=0):
     """
     It takes a database name, user, password, destination directory, encryption password, number of copies to keep, and
     OneDrive object and directory, and then dumps the database to a file in the destination directory, encrypts it if
@@ -23,41 +26,44 @@ def mysqldump(database, user, password, dest, encrypt="False", enc_password=None
     :param no_copies: The number of copies you want to keep, defaults to 3 (optional)
     :param one_drive: This is the OneDrive object that you created in the previous step
     :param one_drive_dir: The directory in OneDrive where the backup will be stored
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to none (optional)
+    :param split_size: Size of one part of the dump i.e. 512M or 4G, the dump isn't split if it is 0,
+    defaults to 0 (optional)
     """
 
     try:
+        codec = compression_module.parse_codec(compression)
         file_name = 'mysqldump_' + database + \
-                    '_' + utils.get_curr_date_time() + '.sql'
+                    '_' + utils.get_curr_date_time() + '.sql' + codec.extension
+        if str(encrypt).upper() == 'TRUE':
+            file_name = file_name + '.enc'
 
-        mysqldump_cmd = ('/usr/bin/mysqldump -u ' + user +
-                         ' -p' + password +
-                         ' --single-transaction --quick --lock-tables=false ' +
-                         database + ' > "' +
-                         dest + '/' + file_name + '"')
-        mysqldump_cmd_log = ('/usr/bin/mysqldump -u ' + user +
-                             ' -p *********** --single-transaction --quick --lock-tables=false ' +
-                             database + ' > "' +
-                             dest + '/' + file_name + '"')
+        mysqldump_cmd = ['/usr/bin/mysqldump', '-u', user, '-p' + password,
+                         '--single-transaction', '--quick', '--lock-tables=false', database]
+        mysqldump_cmd_log = ['/usr/bin/mysqldump', '-u', user, '-p', '***********',
+                             '--single-transaction', '--quick', '--lock-tables=false', database]
         logger.info("---------------------------------------")
         logger.info("start mysqldump")
         logger.info("---------------------------------------")
         start = timer()
-        code, out, err = utils.run(mysqldump_cmd, mysqldump_cmd_log)
+        created = archive.create_archive(
+            paths=None,
+            file_name=dest + '/' + file_name,
+            encrypt=encrypt,
+            enc_pass=enc_password,
+            cmd=mysqldump_cmd,
+            compression=codec,
+            cmd_log=mysqldump_cmd_log,
+            split_size=utils.parse_size(split_size)
+        )
         end = timer()
-        if code > 0:
-            logger.error("Mysqldump failed with status code: " + str(code) + " Standard Error: " + err +
-                         ', Standard Output: ' + out)
+        if not created:
+            logger.error("Mysqldump failed for database: " + database)
         else:
             logger.info("Time took for mysqldump :" +
                         str(timedelta(seconds=end - start)))
             logger.info("Created file: " + file_name)
             logger.debug("Directory for primary backup :" + dest)
-            if encrypt == 'True':
-                file_management.encrypt_data(
-                    file_name=dest + '/' + file_name,
-                    password=enc_password
-                )
-                file_name = file_name + '.enc'
 
             file_management.rmold(
                 directory=dest,
@@ -67,8 +73,8 @@ def mysqldump(database, user, password, dest, encrypt="False", enc_password=None
             )
 
         if one_drive is not None:
-            one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                  local_dir=dest, file_name=file_name)
+            one_drive.upload_files(one_drive_dir=one_drive_dir, local_dir=dest,
+                                   file_names=archive.archive_file_names(dest + '/' + file_name))
             one_drive.remove_old_files(
                 file_name='mysqldump_' + database, one_drive_dir=one_drive_dir, encrypt=encrypt, no_copies=no_copies)
 
@@ -77,7 +83,8 @@ def mysqldump(database, user, password, dest, encrypt="False", enc_password=None
 
 
 def mysqldump_remote(host, database, user, password, destination, encrypt, enc_pass, no_copies,
-                     one_drive=None, one_drive_dir=None):
+                     one_drive=None, one_drive_dir=None, compression='none', stream='False', split_size=0,
+                     io_policy=None):
     """
     It takes a database name, a hostname, a username, a password, a destination directory, a boolean value for
     encryption, an encryption password, a number of copies to keep, and an optional OneDrive object and OneDrive
@@ -95,56 +102,173 @@ def mysqldump_remote(host, database, user, password, destination, encrypt, enc_p
     :param no_copies: The number of copies to keep
     :param one_drive: This is the OneDrive object that we created in the previous step
     :param one_drive_dir: The directory in OneDrive where the backup will be stored
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to none (optional)
+    :param stream: If True, the dump is streamed over SSH and compressed, encrypted and written locally, so the
+    destination doesn't have to be shared with the remote host, defaults to False (optional)
+    :param split_size: Size of one part of the dump i.e. 512M or 4G in stream mode, the dump isn't split if it is 0,
+    defaults to 0 (optional)
+    :param io_policy: The IoPolicy, mysqldump is executed with its ionice and nice values, in stream mode the dump
+    is read at most at its rate (optional)
     """
 
+    if io_policy is None:
+        io_policy = utils.IoPolicy()
+    if str(stream).upper() == 'TRUE':
+        return mysqldump_remote_stream(host, database, user, password, destination, encrypt, enc_pass, no_copies,
+                                       one_drive, one_drive_dir, compression, split_size, io_policy)
     try:
         logger.info("---------------------------------------")
         logger.info("start mysqldump")
         logger.info("---------------------------------------")
-        file_name = 'mysqldump_' + database + '_' + host + \
-                    '_' + utils.get_curr_date_time() + '.sql'
+        codec = compression_module.parse_codec(compression)
+        # the same prefix is used by the retention of the destination and of OneDrive
+        prefix = 'mysqldump_' + database + '_' + host
+        file_name = prefix + '_' + utils.get_curr_date_time() + '.sql' + codec.extension
+        compress_cmd = ''
+        if codec.command() is not None:
+            compress_cmd = ' | ' + codec.command()
 
-        mysqldump_cmd = ('/usr/bin/mysqldump -u ' + user +
+        mysqldump_cmd = (io_policy.command_prefix() + '/usr/bin/mysqldump -u ' + user +
                          ' -p' + password +
                          ' --single-transaction --quick --lock-tables=false ' +
-                         database + ' > "' +
+                         database + compress_cmd + ' > "' +
                          destination + '/' + file_name + '"')
-        mysqldump_cmd_log = ('/usr/bin/mysqldump -u ' + user +
+        mysqldump_cmd_log = (io_policy.command_prefix() + '/usr/bin/mysqldump -u ' + user +
                              ' -p ************ --single-transaction --quick --lock-tables=false ' +
-                             database + ' > "' +
+                             database + compress_cmd + ' > "' +
                              destination + '/' + file_name + '"')
+        if compress_cmd != '':
+            # the status of the pipe is the status of the compressor, pipefail returns the status of mysqldump too
+            mysqldump_cmd = 'bash -o pipefail -c ' + shlex.quote(mysqldump_cmd)
+            mysqldump_cmd_log = 'bash -o pipefail -c ' + shlex.quote(mysqldump_cmd_log)
 
+        # the destination is listed by the same remote command as the dump, the retention then needs only
+        # the remote command that removes old copies
+        batch = file_management.RemoteBatch(host)
+        batch.run(mysqldump_cmd, mysqldump_cmd_log)
+        batch.list_files(destination)
         start = timer()
-        code, out, err = utils.run_remote(mysqldump_cmd, host, mysqldump_cmd_log)
+        (code, out), listed = batch.execute()
         end = timer()
-        if code > 0:
-            logger.error("Mysqldump failed with status code: " + str(code) + " Standard Error: " + err +
-                         ', Standard Output: ' + out)
+        if code is None or code > 0:
+            logger.error("Mysqldump failed with status code: " + str(code) + ", output: " + out)
+            # the incomplete dump isn't counted as a copy by the next retention
+            utils.run_remote('rm -f -- ' + shlex.quote(destination + '/' + file_name), host)
         else:
             logger.info("Time took for mysqldump :" +
                         str(timedelta(seconds=end - start)))
             logger.info("Created file: " + file_name)
             logger.debug("Directory for primary backup :" + destination)
             if encrypt == 'True':
-                file_management.encrypt_data(
+                encrypted = file_management.encrypt_data(
                     file_name=destination + '/' + file_name,
                     password=enc_pass
                 )
+                if encrypted is None:
+                    listed = None
+                elif listed is not None:
+                    listed = [f + '.enc' if f == file_name else f for f in listed]
                 file_name = file_name + '.enc'
 
             file_management.rmold_remote(
                 host=host,
                 directory=destination,
-                name='mysqldump_' + database,
+                name=prefix,
                 no_copies=no_copies,
-                encrypt=encrypt
+                encrypt=encrypt,
+                file_names=listed
             )
 
         if one_drive is not None:
-            one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                  local_dir=destination, file_name=file_name)
+            one_drive.upload_files(one_drive_dir=one_drive_dir, local_dir=destination,
+                                   file_names=archive.archive_file_names(destination + '/' + file_name))
+            # OneDrive matches files by substring, with '_' after the prefix host db1 doesn't match db10
+            one_drive.remove_old_files(
+                file_name=prefix + '_', one_drive_dir=one_drive_dir,
+                encrypt=encrypt,
+                no_copies=no_copies)
+
+    except Exception as e:
+        logger.error(e)
+
+
+def mysqldump_remote_stream(host, database, user, password, destination, encrypt, enc_pass, no_copies,
+                            one_drive=None, one_drive_dir=None, compression='none', split_size=0, io_policy=None):
+    """
+    It runs mysqldump on the remote host with the output to its standard output, the dump is streamed over SSH
+    into the local compress -> encrypt -> write pipeline, so nothing is written on the remote host
+
+    :param host: The hostname or IP address of the remote server
+    :param database: The name of the database to back up
+    :param user: The user to connect to the database with
+    :param password: The password for the user
+    :param destination: The local directory where the backup will be stored
+    :param encrypt: True/False
+    :param enc_pass: The password used to encrypt the backup file
+    :param no_copies: The number of copies to keep
+    :param one_drive: This is the OneDrive object
+    :param one_drive_dir: The directory in OneDrive where the backup will be stored
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to none (optional)
+    :param split_size: Size of one part of the dump i.e. 512M or 4G, the dump isn't split if it is 0,
+    defaults to 0 (optional)
+    :param io_policy: The IoPolicy, mysqldump is executed with its ionice and nice values and the dump is read at
+    most at its rate (optional)
+    """
+
+    if io_policy is None:
+        io_policy = utils.IoPolicy()
+    try:
+        logger.info("---------------------------------------")
+        logger.info("start mysqldump stream")
+        logger.info("---------------------------------------")
+        codec = compression_module.parse_codec(compression)
+        # the same prefix is used by the retention of the destination and of OneDrive
+        prefix = 'mysqldump_' + database + '_' + host
+        file_name = prefix + '_' + utils.get_curr_date_time() + '.sql' + codec.extension
+        if str(encrypt).upper() == 'TRUE':
+            file_name = file_name + '.enc'
+
+        mysqldump_cmd = (io_policy.command_prefix() + '/usr/bin/mysqldump -u ' + user +
+                         ' -p' + password +
+                         ' --single-transaction --quick --lock-tables=false ' + database)
+        mysqldump_cmd_log = (io_policy.command_prefix() + '/usr/bin/mysqldump -u ' + user +
+                             ' -p ************ --single-transaction --quick --lock-tables=false ' + database)
+
+        start = timer()
+        created = archive.create_archive(
+            paths=None,
+            file_name=destination + '/' + file_name,
+            encrypt=encrypt,
+            enc_pass=enc_pass,
+            cmd=mysqldump_cmd,
+            compression=codec,
+            cmd_log=mysqldump_cmd_log,
+            host=host,
+            split_size=utils.parse_size(split_size),
+            io_policy=io_policy
+        )
+        end = timer()
+        if not created:
+            logger.error("Mysqldump failed for database: " + database + " on host: " + host)
+            return
+        logger.info("Time took for mysqldump :" +
+                    str(timedelta(seconds=end - start)))
+        logger.info("Created file: " + file_name)
+        logger.debug("Directory for primary backup :" + destination)
+
+        file_management.rmold(
+            directory=destination,
+            name=prefix,
+            no_copies=no_copies,
+            encrypt=encrypt
+        )
+
+        if one_drive is not None:
+            one_drive.upload_files(one_drive_dir=one_drive_dir, local_dir=destination,
+                                   file_names=archive.archive_file_names(destination + '/' + file_name))
+            # OneDrive matches files by substring, with '_' after the prefix host db1 doesn't match db10
             one_drive.remove_old_files(
-                file_name='mysqldump_' + database, one_drive_dir=one_drive_dir,
+                file_name=prefix + '_', one_drive_dir=one_drive_dir,
                 encrypt=encrypt,
                 no_copies=no_copies)
 
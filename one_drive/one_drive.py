@@ -1,3 +1,4 @@
+import re
 import time
 from datetime import timedelta
 import os
@@ -7,8 +8,12 @@ import requests
 import pathlib
 import json
 import logging
+import tempfile
 from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser
+from archive_index import archive_index
+from checksum import checksum
 
 logger = logging.getLogger("backup_logger")
 
@@ -249,25 +254,98 @@ class OneDrive:
         :param one_drive_dir: The directory on OneDrive where you want to upload the file
         :param local_dir: The local directory where the file is located, defaults to . (optional)
         :param file_name: The name of the file you want to upload, defaults to bck (optional)
+        :return: True if the file is uploaded, otherwise False.
         """
         if one_drive_dir[0] == '/':
             one_drive_dir = one_drive_dir[1:]
         if self.tokens is None:
             self.__perform_login()
+            return False
         else:
             self.check_tokens()
-            try:
-                upload_url = self.__get_upload_url(
-                    one_drive_dir=one_drive_dir, file_name=file_name)
-                logger.debug("Upload URL: " + str(upload_url))
-                self.__upload_to_one_drive(
-                    url=upload_url,
-                    file=(local_dir + '/' + file_name)
-                )
+            return self.__upload(one_drive_dir, local_dir, file_name)
 
-            except Exception as e:
-                logger.error(
-                    "Error while performing upload to OneDrive: " + str(e))
+    def __upload(self, one_drive_dir, local_dir, file_name):
+        try:
+            upload_url = self.__get_upload_url(
+                one_drive_dir=one_drive_dir, file_name=file_name)
+            logger.debug("Upload URL: " + str(upload_url))
+            if upload_url is None:
+                return False
+            return self.__upload_to_one_drive(
+                url=upload_url,
+                file=(local_dir + '/' + file_name)
+            )
+        except Exception as e:
+            logger.error(
+                "Error while performing upload to OneDrive: " + str(e))
+            return False
+
+    def upload_files(self, one_drive_dir="", local_dir=".", file_names=None, threads=4, retries=3, verify_sample=1):
+        """
+        It uploads several files at the same time, i.e. parts of a split archive. Every file has its own
+        upload session, so a file that fails is retried alone. If checksums of the archive are uploaded too,
+        random chunks of every uploaded file are downloaded and compared with them.
+
+        :param one_drive_dir: The directory on OneDrive where you want to upload the files
+        :param local_dir: The local directory where the files are located, defaults to . (optional)
+        :param file_names: A list of names of the files you want to upload
+        :param threads: Number of files that are uploaded at the same time, defaults to 4 (optional)
+        :param retries: Number of attempts for every file, defaults to 3 (optional)
+        :param verify_sample: Number of chunks of every file that are verified after upload, 0 disables it,
+        defaults to 1, the last chunk (optional)
+        :return: A list of files that couldn't be uploaded.
+        """
+        if one_drive_dir[0] == '/':
+            one_drive_dir = one_drive_dir[1:]
+        if self.tokens is None:
+            self.__perform_login()
+            return list(file_names)
+        # tokens are checked once, before the upload threads are started
+        self.check_tokens()
+
+        def upload(file_name):
+            for attempt in range(1, int(retries) + 1):
+                if self.__upload(one_drive_dir, local_dir, file_name):
+                    return True
+                logger.warning("Upload of file: " + file_name + " failed, attempt " + str(attempt) +
+                               " of " + str(retries))
+                time.sleep(attempt * 5)
+            return False
+
+        with ThreadPoolExecutor(max_workers=max(1, int(threads)), thread_name_prefix='upload') as executor:
+            results = list(executor.map(upload, file_names))
+        failed = [file_names[i] for i in range(len(file_names)) if not results[i]]
+        if int(verify_sample) > 0:
+            failed += self.__verify_upload(one_drive_dir, local_dir, file_names, failed, verify_sample, threads)
+        if len(failed) > 0:
+            logger.error("Files that aren't uploaded to OneDrive: " + ', '.join(failed))
+        return failed
+
+    def __verify_upload(self, one_drive_dir, local_dir, file_names, failed, sample, threads):
+        """
+        It verifies uploaded files against the checksums that are uploaded with them, only sampled chunks are
+        downloaded, with range requests
+
+        :return: A list of files that are damaged on OneDrive.
+        """
+        damaged = []
+        for sums_name in file_names:
+            if not sums_name.endswith(checksum.CHECKSUM_SUFFIX) or sums_name in failed:
+                continue
+            try:
+                sums = checksum.load(local_dir + '/' + sums_name)
+                sums['files'] = [f for f in sums['files'] if f['name'] in file_names and f['name'] not in failed]
+                damaged += checksum.verify(
+                    sums, lambda name, offset, length: self.download_range(one_drive_dir, name, offset, length),
+                    threads, sample)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Error while verifying upload with checksums: " + sums_name + ", error: " + str(e))
+        if len(damaged) > 0:
+            logger.error("Files that are damaged on OneDrive: " + ', '.join(damaged))
+        else:
+            logger.debug("Uploaded files are verified with checksums")
+        return damaged
 
     def __get_upload_url(self, one_drive_dir, file_name):
         """
@@ -343,7 +421,7 @@ class OneDrive:
 
         :param url: The URL of the upload session
         :param file: The file to be uploaded
-        :return: the response from the server.
+        :return: True if the file is uploaded, otherwise False.
         """
         f = open(file, 'rb')
         file_size = os.path.getsize(file)
@@ -378,11 +456,14 @@ class OneDrive:
                                  str(file) + " to OneDrive!")
                     logger.error("Response code: " + str(response.status_code) +
                                  "\nResponse text: " + response.text)
-                    return
+                    return False
                 uploaded_bytes += size_curr_request
 
         except Exception as e:
             logger.error(str(e))
+            return False
+        finally:
+            f.close()
         end = timer()
         logger.info("Successfully uploaded file")
         logger.debug("Terminating upload session from OneDrive")
@@ -394,6 +475,92 @@ class OneDrive:
         else:
             logger.warning("Session is terminated with status code: " +
                            str(response.status_code) + "\nand content: " + str(response.content))
+        return True
+
+    def __download_request(self, one_drive_dir, file_name, headers=None, stream=False):
+        request_headers = {
+            'Authorization': 'Bearer ' + self.tokens['access_token'],
+        }
+        request_headers.update(headers or {})
+        download_url = self.__GRAPH_API_URL + '/me/drive/items/root:/' + one_drive_dir + '/' + file_name + ':/content'
+        logger.debug("URL for download: " + download_url)
+        response = requests.get(download_url, headers=request_headers, stream=stream)
+        if response.status_code == 401:
+            logger.warning("Access token is expired, renewing it! ")
+            self.renew_tokens()
+            request_headers['Authorization'] = 'Bearer ' + self.tokens['access_token']
+            response = requests.get(download_url, headers=request_headers, stream=stream)
+        if response.status_code >= 300:
+            raise RuntimeError("Download of file: " + file_name + " failed with status code: " +
+                               str(response.status_code) + ", response: " + response.text)
+        return response
+
+    def download_range(self, one_drive_dir, file_name, offset, length):
+        """
+        It downloads only the range of bytes of the file, with the HTTP Range header
+
+        :param one_drive_dir: The directory on OneDrive where the file is stored
+        :param file_name: The name of the file
+        :param offset: The first byte of the range
+        :param length: Number of bytes to download
+        :return: The content of the range.
+        """
+        if one_drive_dir[0] == '/':
+            one_drive_dir = one_drive_dir[1:]
+        response = self.__download_request(
+            one_drive_dir, file_name, {'Range': 'bytes=' + str(offset) + '-' + str(offset + length - 1)})
+        if response.status_code == 206:
+            return response.content
+        # the whole file is returned if the range isn't supported
+        return response.content[offset:offset + length]
+
+    def download_file(self, one_drive_dir, file_name, local_file):
+        """
+        It downloads the file from OneDrive, in chunks
+
+        :param one_drive_dir: The directory on OneDrive where the file is stored
+        :param file_name: The name of the file
+        :param local_file: The local file where the content will be written
+        """
+        if one_drive_dir[0] == '/':
+            one_drive_dir = one_drive_dir[1:]
+        logger.info("Downloading file: " + file_name)
+        response = self.__download_request(one_drive_dir, file_name, stream=True)
+        with open(local_file, 'wb') as f:
+            for data in response.iter_content(chunk_size=1048576):
+                f.write(data)
+
+    def restore_file(self, one_drive_dir, archive_name, path, target_dir='/', enc_pass=None):
+        """
+        It restores one file or directory from an archive stored on OneDrive. Only the index of the archive is
+        downloaded, and then only the ranges of the archive that contain the path.
+
+        :param one_drive_dir: The directory on OneDrive where the archive is stored
+        :param archive_name: The name of the archive
+        :param path: The path of the file or directory in the archive
+        :param target_dir: The directory where files will be extracted, defaults to / (optional)
+        :param enc_pass: The password to decrypt the archive with
+        :return: True if the path is restored, otherwise False.
+        """
+        if self.tokens is None:
+            self.__perform_login()
+            return False
+        self.check_tokens()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                index_file = tmp_dir + '/' + archive_name + archive_index.INDEX_SUFFIX
+                self.download_file(one_drive_dir, archive_name + archive_index.INDEX_SUFFIX, index_file)
+                return archive_index.restore_file(
+                    archive_file=archive_name,
+                    path=path,
+                    target_dir=target_dir,
+                    enc_pass=enc_pass,
+                    index_file=index_file,
+                    read=lambda name, offset, length: self.download_range(one_drive_dir, name, offset, length))
+        except Exception as e:
+            logger.error("Error while restoring: " + path + " from OneDrive archive: " + archive_name +
+                         ", error: " + str(e))
+            return False
 
     def remove_old_files(self, file_name, one_drive_dir, encrypt, no_copies=3):
         """
@@ -416,6 +583,7 @@ class OneDrive:
                 one_drive_dir=one_drive_dir,
                 encrypt=encrypt
             )
+            list_of_files = self.__group_parts(list_of_files)
             keep_list = []
             rem_list = []
             for i in list_of_files:
@@ -444,7 +612,7 @@ class OneDrive:
 
             logger.info("Removing files")
             for i in rem_list:
-                self.__remove_file(i)
+                self.__remove_group(i)
             logger.debug("Keeping files:")
             for i in keep_list:
                 logger.debug("File name: " + i['name'])
@@ -477,12 +645,14 @@ class OneDrive:
             if 200 <= response.status_code < 300:
                 for i in response.json()["value"]:
                     if file_name in str(i["name"]):
+                        # parts of a split archive are checked by the name of the archive
+                        name = re.sub(r'(\.part[0-9]+|\.manifest|\.index|\.sums)$', '', str(i["name"]))
                         if str(encrypt).upper() == "TRUE":
-                            if str(i["name"]).endswith(".enc"):
+                            if name.endswith(".enc"):
                                 logger.debug("Find file: " + i["name"])
                                 list_of_files.append(i)
                         else:
-                            if not str(i["name"]).endswith(".enc"):
+                            if not name.endswith(".enc"):
                                 logger.debug("Find file: " + i["name"])
                                 list_of_files.append(i)
 
@@ -502,6 +672,32 @@ class OneDrive:
 
         return list_of_files
 
+    def __group_parts(self, list_of_files):
+        """
+        It groups the archive, parts and the manifest of a split archive and the index and checksums of
+        the archive into one element, so retention counts every backup once. The element of the group has
+        the name of the archive and the newest modification time of its files.
+
+        :param list_of_files: A list of OneDrive elements
+        :return: A list of groups, files of every group are in its parts.
+        """
+        groups = {}
+        result = []
+        for i in list_of_files:
+            name = re.sub(r'(\.part[0-9]+|\.manifest|\.index|\.sums)$', '', str(i["name"]))
+            if name not in groups:
+                groups[name] = {"name": name, "lastModifiedDateTime": i["lastModifiedDateTime"], "parts": []}
+                result.append(groups[name])
+            group = groups[name]
+            group["parts"].append(i)
+            if parser.parse(i["lastModifiedDateTime"]) > parser.parse(group["lastModifiedDateTime"]):
+                group["lastModifiedDateTime"] = i["lastModifiedDateTime"]
+        return result
+
+    def __remove_group(self, one_drive_element):
+        for i in one_drive_element.get("parts", [one_drive_element]):
+            self.__remove_file(i)
+
     def __remove_file(self, one_drive_element):
         """
         It removes a file from OneDrive
@@ -533,6 +729,44 @@ class OneDrive:
         except Exception as e:
             logger.error(str(e))
 
+    def remove_files(self, one_drive_dir, file_names):
+        """
+        It removes the files with the provided names from the OneDrive directory, the directory is listed once
+
+        :param one_drive_dir: The directory on OneDrive where the files are located
+        :param file_names: Names of files to remove
+        """
+        if one_drive_dir[0] == '/':
+            one_drive_dir = one_drive_dir[1:]
+        file_names = set(file_names)
+        if len(file_names) == 0:
+            return
+        try:
+            headers = {
+                'Authorization': 'Bearer ' + self.tokens['access_token'],
+            }
+            url = self.__GRAPH_API_URL + f'/me/drive/items/root:/' + one_drive_dir + ':/children'
+            found = []
+            while url is not None:
+                response = requests.get(url, headers=headers)
+                if response.status_code == 401:
+                    logger.warning("Access token is expired, renewing it! ")
+                    self.renew_tokens()
+                    headers['Authorization'] = 'Bearer ' + self.tokens['access_token']
+                    continue
+                if not 200 <= response.status_code < 300:
+                    logger.error("Listing directory: " + one_drive_dir + " failed with status code: " +
+                                 str(response.status_code))
+                    return
+                found += [i for i in response.json()["value"] if i["name"] in file_names]
+                # large directories are listed in pages, files are removed after the last page,
+                # so removals don't shift the pages
+                url = response.json().get("@odata.nextLink")
+            for i in found:
+                self.__remove_file(i)
+        except Exception as e:
+            logger.error(str(e))
+
     def keep_only_oldest_and_newest(self, file_name, one_drive_dir, encrypt):
         """
         It fetches a list of files from OneDrive, sorts them by date, and removes all but the newest and oldest files
@@ -559,6 +793,7 @@ class OneDrive:
                 one_drive_dir=one_drive_dir,
                 encrypt=encrypt
             )
+            list_of_files = self.__group_parts(list_of_files)
             newest = None
             oldest = None
             rem_list = []
@@ -588,7 +823,7 @@ class OneDrive:
                          oldest["lastModifiedDateTime"])
             logger.debug("Removing list: ")
             for j in rem_list:
-                self.__remove_file(j)
+                self.__remove_group(j)
 
         except Exception as e:
             logger.error(str(e))
@@ -0,0 +1,490 @@
+#!/usr/bin/python3
+import os
+import re
+import sys
+import shutil
+import getpass
+import tarfile
+import argparse
+import logging
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
+from archive import archive
+from archive_index import archive_index
+from block_delta import block_delta
+from change_index import change_index
+from compression import compression as compression_module
+from utils import utils
+
+logger = logging.getLogger("backup_logger")
+
+# backup_type from configuration -> type in the name of the archive
+TYPES = {'full': 'full', 'incremental': 'inc', 'differential': 'diff'}
+
+# members that describe the chain, they are never restored
+CHAIN_MEMBERS = [change_index.DELETED_MEMBER, change_index.BASE_MEMBER]
+
+
+def file_prefix(path):
+    """
+    It creates the prefix of the archive name from the backed up path, the same way as targz does
+
+    :param path: The backed up path, i.e. /data/www
+    :return: The prefix, i.e. data-www.
+    """
+    return path.replace('/', '-').strip('-')
+
+
+def list_archives(directory, prefix, host=None):
+    """
+    It finds the archives of the path in the directory, split archives are found by their manifest
+
+    :param directory: The directory where archives are stored
+    :param prefix: The prefix of archive names, as returned by file_prefix
+    :param host: The host for remote backups (optional)
+    :return: A list of dictionaries with name, file, type, time and host of every archive, the oldest first.
+    """
+    pattern = re.compile(
+        '^' + re.escape(prefix) + '-(full|inc|diff)' + ('-' + re.escape(host) if host else '') +
+        '-([0-9]{14})\\.tar(\\.gz|\\.zst|\\.lz4|\\.xz)?(\\.enc)?$'
+    )
+    archives = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            name = entry.name
+            if name.endswith(archive.MANIFEST_SUFFIX):
+                name = name[:-len(archive.MANIFEST_SUFFIX)]
+            elif os.path.exists(entry.path + archive.MANIFEST_SUFFIX):
+                continue
+            match = pattern.match(name)
+            if match is None:
+                continue
+            archives.append({
+                'name': name,
+                'file': os.path.join(directory, name),
+                'type': match.group(1),
+                'time': datetime.strptime(match.group(2), '%Y%m%d%H%M%S'),
+                'host': host,
+            })
+    archives.sort(key=lambda a: a['time'])
+    return archives
+
+
+def is_base(item):
+    """
+    :param item: The archive
+    :return: True if the archive is marked as the first archive of its chain, None if it isn't known.
+    """
+    index = archive_index.ArchiveIndex(item['file'] + archive_index.INDEX_SUFFIX)
+    if not index.exists():
+        return None
+    return index.find(change_index.BASE_MEMBER) is not None
+
+
+def find_chain(archives, target_time=None, backup_type=None):
+    """
+    It finds the shortest list of archives that restores the state at the target time. A full backup is one
+    archive, a differential backup is the first archive and the last one, and an incremental backup is every
+    archive from the last base archive. If more types are available, the chain that ends closest to the target
+    time is used, and the shorter one if they end at the same time.
+
+    :param archives: A list of archives, as returned by list_archives
+    :param target_time: The datetime of the state to restore, defaults to the newest state (optional)
+    :param backup_type: full, incremental or differential, defaults to any (optional)
+    :return: A list of archives that have to be applied, the oldest first.
+    """
+    if target_time is not None:
+        archives = [a for a in archives if a['time'] <= target_time]
+    chains = []
+    for name, short_name in TYPES.items():
+        if backup_type is not None and backup_type.lower() != name:
+            continue
+        items = [a for a in archives if a['type'] == short_name]
+        if len(items) == 0:
+            continue
+        if short_name == 'full':
+            chains.append([items[-1]])
+        elif short_name == 'diff':
+            chains.append([items[0], items[-1]] if len(items) > 1 else [items[0]])
+        else:
+            chain = []
+            for item in reversed(items):
+                chain.insert(0, item)
+                if is_base(item):
+                    break
+            chains.append(chain)
+    if len(chains) == 0:
+        return []
+    return max(chains, key=lambda c: (c[-1]['time'], -len(c)))
+
+
+def select_members(chain, indexes, readers, only=None):
+    """
+    It decides which archive restores every path: the newest archive that contains the path, unless a newer
+    archive lists the path as deleted. Files that later archives overwrite are never written. Deltas of large
+    files that are newer than the archive that restores the whole file are applied to it in order.
+
+    :param chain: The list of archives, the oldest first
+    :param indexes: The ArchiveIndex of every archive
+    :param readers: The RangeReader of every archive
+    :param only: Only paths under this path are restored (optional)
+    :return: A list with the dictionary member name -> member for every archive of the chain, and the dictionary
+    path -> positions of archives with deltas of the path, the oldest first.
+    """
+    owners = {}
+    deltas = {}
+    for position in range(len(chain) - 1, -1, -1):
+        members = indexes[position].members()
+        for member in members:
+            if member[0] in CHAIN_MEMBERS or member[0] in owners:
+                continue
+            path = member[0]
+            if path.endswith(block_delta.DELTA_SUFFIX):
+                path = path[:-len(block_delta.DELTA_SUFFIX)]
+            if path in owners or (only is not None and not is_under(path, only)):
+                continue
+            if path != member[0]:
+                deltas.setdefault(path, []).insert(0, (position, member))
+                continue
+            owners[path] = (position, member)
+    deleted = {}
+    for position in range(len(chain)):
+        data = archive_index.read_member(indexes[position], readers[position], change_index.DELETED_MEMBER)
+        if data is None:
+            continue
+        for path in data.decode('utf-8', 'surrogateescape').split('\n'):
+            if path != '':
+                deleted[path] = position
+    selected = [{} for _ in chain]
+    skipped = 0
+    for path, (position, member) in owners.items():
+        if deleted.get(path, -1) > position:
+            skipped += 1
+            deltas.pop(path, None)
+            continue
+        selected[position][path] = member
+    for path in list(deltas):
+        if path not in owners:
+            logger.error("File: " + path + " has only deltas in the chain, it can't be restored")
+            del deltas[path]
+            continue
+        for position, member in deltas[path]:
+            selected[position][member[0]] = member
+        deltas[path] = [position for position, member in deltas[path]]
+    logger.info("Members to restore: " + str(len(owners) - skipped) + ", deleted in later archives: " + str(skipped) +
+                ", files with deltas: " + str(len(deltas)))
+    return selected, deltas
+
+
+def is_under(path, only):
+    path = '/' + path.strip('/')
+    only = '/' + only.strip('/')
+    return path == only or path.startswith(only.rstrip('/') + '/')
+
+
+def apply_directory(tarinfo, target_dir):
+    """
+    It creates the directory and sets its owner, mode and modification time, it is done after every file
+    is written, so the modification time isn't changed by the files
+
+    :param tarinfo: The TarInfo of the directory
+    :param target_dir: The directory where files are extracted
+    """
+    path = os.path.join(target_dir, tarinfo.name.lstrip('/'))
+    os.makedirs(path, exist_ok=True)
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        try:
+            os.chown(path, tarinfo.uid, tarinfo.gid)
+        except OSError as e:
+            logger.debug("Can't change owner of: " + path + ", error: " + str(e))
+    os.chmod(path, tarinfo.mode)
+    os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+
+
+def apply_link(tarinfo, target_dir):
+    """
+    It creates the hard link after every file is written, the target of the link can be in another archive
+
+    :param tarinfo: The TarInfo of the hard link
+    :param target_dir: The directory where files are extracted
+    """
+    path = os.path.join(target_dir, tarinfo.name.lstrip('/'))
+    source = os.path.join(target_dir, tarinfo.linkname.lstrip('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    try:
+        os.link(source, path)
+    except OSError:
+        shutil.copy2(source, path)
+
+
+def delta_file(target_dir, path, position):
+    """
+    :return: The temporary file where the delta of the path from the archive at the position is extracted.
+    """
+    return os.path.join(target_dir, path.lstrip('/')) + block_delta.DELTA_SUFFIX + '.' + str(position)
+
+
+def restore_parallel(chain, target_dir, enc_pass, threads, only=None):
+    """
+    It restores the chain of indexed archives. Every archive is decrypted and decompressed in its own thread,
+    and only the range of the archive with the selected members is read. Archives write different paths, so
+    files are written in parallel, deltas are extracted next to their files and applied in order at the end,
+    before directories and hard links are created.
+
+    :param chain: The list of archives, the oldest first
+    :param target_dir: The directory where files are extracted
+    :param enc_pass: The password to decrypt the archives with
+    :param threads: Number of threads
+    :param only: Only paths under this path are restored (optional)
+    :return: True if every member is restored, otherwise False.
+    """
+    indexes = [archive_index.ArchiveIndex(a['file'] + archive_index.INDEX_SUFFIX) for a in chain]
+    readers = [archive_index.RangeReader(a['name'], indexes[i], archive_index.local_reader(os.path.dirname(a['file'])),
+                                         enc_pass) for i, a in enumerate(chain)]
+    selected, deltas = select_members(chain, indexes, readers, only)
+    positions = [i for i in range(len(chain)) if len(selected[i]) > 0]
+    if len(positions) == 0:
+        logger.warning("There is nothing to restore")
+        return True
+    # parent directories are created before the threads start, so they don't create the same directory
+    for position in positions:
+        for path, member in selected[position].items():
+            os.makedirs(os.path.dirname(os.path.join(target_dir, path.lstrip('/'))), exist_ok=True)
+    workers = min(len(positions), threads)
+    # threads that are left decompress frames of the same archive
+    archive_threads = max(1, threads // workers)
+    lock = threading.Lock()
+    directories = []
+    links = []
+
+    def restore_archive(position):
+        wanted = selected[position]
+        codec = compression_module.parse_codec(indexes[position].meta().get('codec'))
+        stream = archive_index.MemberStream(
+            indexes[position], readers[position], codec,
+            min(m[1] for m in wanted.values()), max(m[2] for m in wanted.values()), archive_threads)
+        restored = 0
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                for tarinfo in tar:
+                    if tarinfo.name not in wanted:
+                        continue
+                    restored += 1
+                    if tarinfo.isdir():
+                        with lock:
+                            directories.append(tarinfo)
+                    elif tarinfo.islnk():
+                        with lock:
+                            links.append(tarinfo)
+                    elif tarinfo.name.endswith(block_delta.DELTA_SUFFIX):
+                        path = tarinfo.name[:-len(block_delta.DELTA_SUFFIX)]
+                        with open(delta_file(target_dir, path, position), 'wb') as f:
+                            shutil.copyfileobj(tar.extractfile(tarinfo), f, archive_index.READ_SIZE)
+                    else:
+                        tarinfo.name = tarinfo.name.lstrip('/')
+                        tar.extract(tarinfo, path=target_dir)
+                    if restored == len(wanted):
+                        break
+        finally:
+            stream.close()
+        logger.info("Restored " + str(restored) + " of " + str(len(wanted)) + " members from: " +
+                    chain[position]['name'])
+        return restored == len(wanted)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='restore') as executor:
+        results = list(executor.map(restore_archive, positions))
+    for path, delta_positions in deltas.items():
+        failed = False
+        for position in delta_positions:
+            name = delta_file(target_dir, path, position)
+            try:
+                if not failed:
+                    with open(name, 'rb') as f:
+                        block_delta.apply_delta(f, os.path.join(target_dir, path.lstrip('/')))
+            except Exception as e:
+                logger.error("Error while applying delta of file: " + path + ", error: " + str(e))
+                results.append(False)
+                failed = True
+            finally:
+                if os.path.exists(name):
+                    os.remove(name)
+    for tarinfo in links:
+        apply_link(tarinfo, target_dir)
+    for tarinfo in sorted(directories, key=lambda t: t.name, reverse=True):
+        apply_directory(tarinfo, target_dir)
+    return all(results)
+
+
+def restore_sequential(chain, target_dir, enc_pass, only=None, threads=1):
+    """
+    It restores the chain of archives without index one after another, the oldest first. Archives created by
+    GNU tar on remote hosts are extracted with `tar --listed-incremental`, so files deleted between backups are
+    removed, for other archives paths listed as deleted are removed if they were restored from older archives.
+
+    :param chain: The list of archives, the oldest first
+    :param target_dir: The directory where files are extracted
+    :param enc_pass: The password to decrypt the archives with
+    :param only: Only paths under this path are restored (optional)
+    :param threads: Number of threads used for decryption, defaults to 1 (optional)
+    :return: True if every archive is restored, otherwise False.
+    """
+    restored = set()
+    for item in chain:
+        logger.info("Restoring archive: " + item['name'])
+        reader, processes = archive.open_reader(item['file'], enc_pass, threads)
+        try:
+            if item['host'] is not None:
+                args = ['tar', '-x', '--listed-incremental=/dev/null', '-f', '-', '-C', target_dir]
+                if only is not None:
+                    args.append(only.strip('/'))
+                proc = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                processes.append(proc)
+                err = utils.OutputReader(proc.stderr, keep_lines=100)
+                err.start()
+                archive.pump(reader, proc.stdin)
+                err.join()
+                if proc.wait() > 0:
+                    raise RuntimeError("tar failed with status code: " + str(proc.returncode) +
+                                       ", Standard Error: " + err.text())
+            else:
+                directories = []
+                links = []
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    for tarinfo in tar:
+                        if tarinfo.name == change_index.DELETED_MEMBER:
+                            data = tar.extractfile(tarinfo).read().decode('utf-8', 'surrogateescape')
+                            for path in data.split('\n'):
+                                if path in restored:
+                                    remove_path(os.path.join(target_dir, path.lstrip('/')))
+                                    restored.discard(path)
+                            continue
+                        if tarinfo.name.endswith(block_delta.DELTA_SUFFIX):
+                            path = tarinfo.name[:-len(block_delta.DELTA_SUFFIX)]
+                            if only is None or is_under(path, only):
+                                block_delta.apply_delta(tar.extractfile(tarinfo),
+                                                        os.path.join(target_dir, path.lstrip('/')))
+                            continue
+                        if tarinfo.name in CHAIN_MEMBERS or (only is not None and not is_under(tarinfo.name, only)):
+                            continue
+                        restored.add(tarinfo.name)
+                        if tarinfo.isdir():
+                            directories.append(tarinfo)
+                        elif tarinfo.islnk():
+                            links.append(tarinfo)
+                        else:
+                            tarinfo.name = tarinfo.name.lstrip('/')
+                            tar.extract(tarinfo, path=target_dir)
+                for tarinfo in links:
+                    apply_link(tarinfo, target_dir)
+                for tarinfo in sorted(directories, key=lambda t: t.name, reverse=True):
+                    apply_directory(tarinfo, target_dir)
+            for proc in processes:
+                if proc.wait() > 0:
+                    raise RuntimeError("Decryption failed with status code: " + str(proc.returncode))
+        except Exception as e:
+            logger.error("Error while restoring archive: " + item['name'] + ", error: " + str(e))
+            return False
+        finally:
+            reader.close()
+            for proc in processes:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+    return True
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def restore(directory, path, target_dir='/', target_time=None, backup_type=None, host=None, enc_pass=None,
+            threads=1, only=None):
+    """
+    It restores the backed up path to the state at the target time. It finds the shortest chain of archives,
+    and if every archive of the chain has an index, archives are restored in parallel and every file is
+    written only once, from the newest archive that contains it.
+
+    :param directory: The directory where archives are stored
+    :param path: The backed up path, i.e. /data/www
+    :param target_dir: The directory where files are extracted, defaults to / (optional)
+    :param target_time: The datetime of the state to restore, defaults to the newest state (optional)
+    :param backup_type: full, incremental or differential, defaults to any (optional)
+    :param host: The host for remote backups (optional)
+    :param enc_pass: The password to decrypt the archives with
+    :param threads: Number of threads, defaults to 1 (optional)
+    :param only: Only paths under this path are restored (optional)
+    :return: True if the path is restored, otherwise False.
+    """
+    archives = list_archives(directory, file_prefix(path), host)
+    chain = find_chain(archives, target_time, backup_type)
+    if len(chain) == 0:
+        logger.error("There is no archive of path: " + path + " in directory: " + directory)
+        return False
+    logger.info("Archives to restore: " + ', '.join(a['name'] for a in chain))
+    if enc_pass is None and any(a['name'].endswith('.enc') for a in chain):
+        logger.error("Archives are encrypted, the password is needed")
+        return False
+    os.makedirs(target_dir, exist_ok=True)
+    start = timer()
+    if host is None and all(os.path.exists(a['file'] + archive_index.INDEX_SUFFIX) for a in chain):
+        restored = restore_parallel(chain, target_dir, enc_pass, max(1, int(threads)), only)
+    else:
+        restored = restore_sequential(chain, target_dir, enc_pass, only, max(1, int(threads)))
+    end = timer()
+    logger.info("Time took for restore: " + str(timedelta(seconds=end - start)))
+    return restored
+
+
+def main(args):
+    """
+    Command line interface for restore, i.e.
+    main.py restore --directory /data/backup --path /data/www --time 20240101120000 --target /tmp/restore
+
+    :param args: Command line arguments after `restore`
+    :return: True if the path is restored, otherwise False.
+    """
+    parser = argparse.ArgumentParser(prog='main.py restore', description='Restore a backed up path')
+    parser.add_argument('--directory', required=True, help='directory where archives are stored')
+    parser.add_argument('--path', required=True, help='backed up path, i.e. /data/www')
+    parser.add_argument('--target', default='/', help='directory where files are restored, defaults to /')
+    parser.add_argument('--time', default=None, help='restore the state at this time, YYYYMMDDHHMMSS')
+    parser.add_argument('--type', default=None, choices=list(TYPES), help='use only this type of backup')
+    parser.add_argument('--host', default=None, help='host of a remote backup')
+    parser.add_argument('--only', default=None, help='restore only this file or directory')
+    parser.add_argument('--threads', default=4, type=int, help='number of threads, defaults to 4')
+    parser.add_argument('--log-level', default='INFO', help='log level, defaults to INFO')
+    options = parser.parse_args(args)
+
+    handler = logging.StreamHandler(stream=sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s  %(levelname)s: %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(options.log_level.upper())
+
+    target_time = None
+    if options.time is not None:
+        target_time = datetime.strptime(options.time, '%Y%m%d%H%M%S')
+    # the password is read from the environment or asked for, so it isn't visible in the process list
+    enc_pass = os.environ.get('BACKUP_ENC_PASS')
+    if enc_pass is None and sys.stdin.isatty() and \
+            any(a['name'].endswith('.enc') for a in list_archives(options.directory, file_prefix(options.path),
+                                                                  options.host)):
+        enc_pass = getpass.getpass('Password for encrypted archives: ')
+    return restore(
+        directory=options.directory,
+        path=options.path,
+        target_dir=options.target,
+        target_time=target_time,
+        backup_type=options.type,
+        host=options.host,
+        enc_pass=enc_pass,
+        threads=options.threads,
+        only=options.only
+    )
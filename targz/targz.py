@@ -4,14 +4,24 @@ from os.path import exists
 from os import mkdir
 from utils import utils
 import logging
+from archive import archive
+from block_delta import block_delta
+from change_index import change_index
+from compression import compression as compression_module
+from exclude import exclude as exclude_module
 from file_management import file_management
 from datetime import timedelta
 from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger("backup_logger")
 
+# directory on the remote host where GNU tar snapshot files are kept in stream mode
+REMOTE_SNAPSHOT_DIR = '/var/lib/backup'
 
-def targz(paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, one_drive_dir=None):
+
+def targz(paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, one_drive_dir=None, threads=1,
+          compression=None, parallel_paths=1, split_size=0, exclude=None, io_policy=None):
     """
     It compresses the provided directories and encrypts the compressed file if the encrypt parameter is set to True
 
@@ -23,11 +33,22 @@ def targz(paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, o
     :param no_copies: The number of copies to keep, defaults to 3 (optional)
     :param one_drive: the OneDrive object
     :param one_drive_dir: The directory on OneDrive where you want to store the backup
-    :return: Nothing is being returned.
+    :param threads: Number of threads used for compression, defaults to 1 (optional)
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param split_size: Size of one part of the archive i.e. 512M or 4G, the archive isn't split if it is 0,
+    defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy that limits reads of the files (optional)
+    :return: Dictionary with the result, True or False, for every path.
     """
 
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    split_size = utils.parse_size(split_size)
     check_destination_directories(destinations)
-    for dir2compress in paths:
+
+    def backup_path(dir2compress):
         logger.info("---------------------------------------")
         logger.info("start targz full")
         logger.info("---------------------------------------")
@@ -43,27 +64,30 @@ def targz(paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, o
             if file_prefix[len(file_prefix)-1] == '-':
                 file_prefix = file_prefix[:len(file_prefix)-1]
             file_prefix = file_prefix + "-full"
-            file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+            file_name = archive_name(file_prefix, encrypt, codec)
             fn = file_name
             file_name = destinations[0] + '/' + file_name
 
             if exists(file_name):
                 logger.warning("File already exist, waiting 2 seconds!")
                 time.sleep(2)
-                file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+                file_name = archive_name(file_prefix, encrypt, codec)
                 fn = file_name
                 file_name = destinations[0] + '/' + file_name
 
-            targz_cmd = (
-                    'tar -czvf ' + file_name + ' --absolute-names ' + dir2compress
-            )
             start = timer()
-            code, out, err = utils.run(targz_cmd)
-            if code > 0:
-                logger.error(err)
-                logger.debug("Status code: " + str(code) + "\tStandard Output: "
-                             + out + "\tStandard Error: " + err)
-                return
+            if not archive.create_archive(
+                    paths=[dir2compress],
+                    file_name=file_name,
+                    encrypt=encrypt,
+                    enc_pass=enc_pass,
+                    threads=threads,
+                    compression=codec,
+                    copies=destination_copies(destinations, fn),
+                    split_size=split_size,
+                    exclude=exclude,
+                    io_policy=io_policy):
+                return False
 
             logger.info("Directory is compressed. File :" +
                         file_name + " successfully created.")
@@ -71,27 +95,27 @@ def targz(paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, o
             logger.info("Time took for targz :" +
                         str(timedelta(seconds=end - start)))
 
-            if str(encrypt).upper() == 'TRUE':
-                file_name = file_management.encrypt_data(
-                    file_name, enc_pass)
-                fn = fn + '.enc'
-
             if one_drive is not None:
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=fn)
+                one_drive.upload_files(one_drive_dir=one_drive_dir,
+                                       local_dir=destinations[0], file_names=archive.archive_file_names(file_name))
                 one_drive.remove_old_files(
                     file_name=file_prefix, one_drive_dir=one_drive_dir, encrypt=encrypt, no_copies=no_copies)
             if len(destinations) > 1:
-                for i in range(0, len(destinations)):
-                    if i != 0 and file_management.path_exists(destinations[i]):
-                        file_management.copy(file_name, destinations[i], fn)
-                    file_management.rmold(
-                        directory=destinations[i], name=file_prefix, encrypt=encrypt, no_copies=no_copies)
+                retention.append((file_prefix, encrypt, no_copies))
+            return True
         else:
             logger.error("Path: " + dir2compress + " , doesn't exists!")
+            return False
+
+    retention = []
+    results = run_paths(paths, backup_path, parallel_paths)
+    file_management.rmold_all(destinations, retention)
+    return results
 
 
-def targz_incremental(paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None):
+def targz_incremental(paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None, threads=1,
+                      compression=None, parallel_paths=1, split_size=0, block_threshold=0,
+                      exclude=None, io_policy=None):
     """
     It takes a list of directories, compresses them in incremental way, encrypts them, and uploads them to OneDrive
     
@@ -101,11 +125,25 @@ def targz_incremental(paths, destinations, encrypt, enc_pass, one_drive=None, on
     :param enc_pass: The password to encrypt the file with
     :param one_drive: the OneDrive object
     :param one_drive_dir: The directory on OneDrive where you want to store the backup
-    :return: Nothing is being returned.
+    :param threads: Number of threads used for compression, defaults to 1 (optional)
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param split_size: Size of one part of the archive i.e. 512M or 4G, the archive isn't split if it is 0,
+    defaults to 0 (optional)
+    :param block_threshold: Changed files of this size or bigger i.e. 1G are archived as deltas with only changed
+    blocks of 4MB, 0 disables it, defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy that limits reads of the files (optional)
+    :return: Dictionary with the result, True or False, for every path.
     """
 
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    split_size = utils.parse_size(split_size)
+    block_threshold = utils.parse_size(block_threshold)
     check_destination_directories(destinations)
-    for dir2compress in paths:
+
+    def backup_path(dir2compress):
         logger.info("---------------------------------------")
         logger.info("start targz incremental")
         logger.info("---------------------------------------")
@@ -121,56 +159,54 @@ def targz_incremental(paths, destinations, encrypt, enc_pass, one_drive=None, on
             if file_prefix[len(file_prefix)-1] == '-':
                 file_prefix = file_prefix[:len(file_prefix)-1]
             file_prefix = file_prefix + "-inc"
-            file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+            file_name = archive_name(file_prefix, encrypt, codec)
             fn = file_name
             file_name = destinations[0] + '/' + file_name
-            snap_file = destinations[0] + '/' + file_prefix + '.snap'
+            index_file = destinations[0] + '/' + file_prefix + '.idx'
 
             if exists(file_name):
                 logger.warning("File already exist, waiting 2 seconds!")
                 time.sleep(2)
-                file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+                file_name = archive_name(file_prefix, encrypt, codec)
                 fn = file_name
                 file_name = destinations[0] + '/' + file_name
 
-            targz_cmd = (
-                    'tar -czPg ' + snap_file + ' -f ' + file_name +
-                    ' --absolute-names ' + dir2compress
-            )
             start = timer()
-            code, out, err = utils.run(targz_cmd)
-            if code > 0:
-                logger.error(err)
-                logger.debug("Status code: " + str(code) + "\tStandard Output: "
-                             + out + "\tStandard Error: " + err)
-                return
+            if not archive_changes(
+                    path=dir2compress,
+                    file_name=file_name,
+                    index_file=index_file,
+                    update_index=True,
+                    encrypt=encrypt,
+                    enc_pass=enc_pass,
+                    threads=threads,
+                    codec=codec,
+                    copies=destination_copies(destinations, fn),
+                    split_size=split_size,
+                    block_threshold=block_threshold,
+                    exclude=exclude,
+                    io_policy=io_policy):
+                return False
             logger.info("Directory is compressed. File :" +
                         file_name + " successfully created.")
             end = timer()
             logger.info("Time took for targz :" +
                         str(timedelta(seconds=end - start)))
 
-            if str(encrypt).upper() == 'TRUE':
-                file_name = file_management.encrypt_data(
-                    file_name, enc_pass)
-                fn = fn + '.enc'
-
             if one_drive is not None:
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=fn)
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=file_prefix + '.snap')
-            if len(destinations) > 1:
-                for i in range(1, len(destinations)):
-                    if file_management.path_exists(destinations[i]):
-                        file_management.copy(file_name, destinations[i], fn)
-                        file_management.copy(
-                            snap_file, destinations[i], file_prefix + '.snap')
+                one_drive.upload_files(one_drive_dir=one_drive_dir,
+                                       local_dir=destinations[0], file_names=archive.archive_file_names(file_name))
+            return True
         else:
             logger.error("Path: " + dir2compress + " , doesn't exists!")
+            return False
+
+    return run_paths(paths, backup_path, parallel_paths)
 
 
-def targz_differential(paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None):
+def targz_differential(paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None, threads=1,
+                       compression=None, parallel_paths=1, split_size=0, block_threshold=0,
+                       exclude=None, io_policy=None):
     """
     It creates a tar.gz file of the provided directory, and then compares it to the previous tar.gz file,
     and only keeps the new files
@@ -181,11 +217,25 @@ def targz_differential(paths, destinations, encrypt, enc_pass, one_drive=None, o
     :param enc_pass: The password to use for encryption
     :param one_drive: the OneDrive object
     :param one_drive_dir: The directory on OneDrive where you want to store the backup
-    :return: Nothing is being returned.
+    :param threads: Number of threads used for compression, defaults to 1 (optional)
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param split_size: Size of one part of the archive i.e. 512M or 4G, the archive isn't split if it is 0,
+    defaults to 0 (optional)
+    :param block_threshold: Changed files of this size or bigger i.e. 1G are archived as deltas with only changed
+    blocks of 4MB, 0 disables it, defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy that limits reads of the files (optional)
+    :return: Dictionary with the result, True or False, for every path.
     """
 
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    split_size = utils.parse_size(split_size)
+    block_threshold = utils.parse_size(block_threshold)
     check_destination_directories(destinations)
-    for dir2compress in paths:
+
+    def backup_path(dir2compress):
         logger.info("---------------------------------------")
         logger.info("start targz differential")
         logger.info("---------------------------------------")
@@ -201,72 +251,63 @@ def targz_differential(paths, destinations, encrypt, enc_pass, one_drive=None, o
             if file_prefix[len(file_prefix)-1] == '-':
                 file_prefix = file_prefix[:len(file_prefix)-1]
             file_prefix = file_prefix + "-diff"
-            file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+            file_name = archive_name(file_prefix, encrypt, codec)
             fn = file_name
             file_name = destinations[0] + '/' + file_name
-            snap_file = destinations[0] + '/' + file_prefix + '.snap'
-            snap_file_bak = destinations[0] + '/' + file_prefix + '.snap.bak'
+            index_file = destinations[0] + '/' + file_prefix + '.idx'
 
             if exists(file_name):
                 logger.warning("File already exist, waiting 2 seconds!  ")
                 time.sleep(2)
-                file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+                file_name = archive_name(file_prefix, encrypt, codec)
                 fn = file_name
                 file_name = destinations[0] + '/' + file_name
 
-            targz_cmd = (
-                    'tar -czPg ' + snap_file + ' -f ' + file_name +
-                    ' --absolute-names ' + dir2compress
-            )
+            # the index is written only by the first run, every next run is compared to it
             start = timer()
-            code, out, err = utils.run(targz_cmd)
-            if code > 0:
-                logger.error(err)
-                logger.debug("Status code: " + str(code) + "\tStandard Output: "
-                             + out + "\tStandard Error: " + err)
-                return
+            if not archive_changes(
+                    path=dir2compress,
+                    file_name=file_name,
+                    index_file=index_file,
+                    update_index=False,
+                    encrypt=encrypt,
+                    enc_pass=enc_pass,
+                    threads=threads,
+                    codec=codec,
+                    copies=destination_copies(destinations, fn),
+                    split_size=split_size,
+                    block_threshold=block_threshold,
+                    exclude=exclude,
+                    io_policy=io_policy):
+                return False
             logger.info("Directory is compressed. File :" +
                         file_name + " successfully created.")
 
-            if not exists(snap_file_bak):
-                utils.run("cp " + snap_file + " " + snap_file_bak)
-            else:
-                utils.run("cp " + snap_file_bak + " " + snap_file)
-
             end = timer()
             logger.info("Time took for targz :" +
                         str(timedelta(seconds=end - start)))
 
-            if str(encrypt).upper() == 'TRUE':
-                file_name = file_management.encrypt_data(
-                    file_name, enc_pass)
-                fn = fn + '.enc'
-
             if one_drive is not None:
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=fn)
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=file_prefix + '.snap')
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=file_prefix + '.snap.bak')
+                one_drive.upload_files(one_drive_dir=one_drive_dir,
+                                       local_dir=destinations[0], file_names=archive.archive_file_names(file_name))
                 one_drive.keep_only_oldest_and_newest(
                     file_name=file_prefix, one_drive_dir=one_drive_dir, encrypt=encrypt)
 
-            if len(destinations) >= 1:
-                for i in range(0, len(destinations)):
-                    if i != 0 and file_management.path_exists(destinations[i]):
-                        file_management.copy(file_name, destinations[i], fn)
-                        file_management.copy(
-                            snap_file, destinations[i], file_prefix + '.snap')
-                        file_management.copy(
-                            snap_file_bak, destinations[i], file_prefix + '.snap.bak')
-                    file_management.keep_only_oldest_and_newest(
-                        directory=destinations[i], name=file_prefix, encrypt=encrypt)
+            retention.append((file_prefix, encrypt, None))
+            return True
         else:
             logger.error("Path: " + dir2compress + " , doesn't exists!")
+            return False
+
+    retention = []
+    results = run_paths(paths, backup_path, parallel_paths)
+    file_management.rmold_all(destinations, retention)
+    return results
 
 
-def targz_remote(host, paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, one_drive_dir=None):
+def targz_remote(host, paths, destinations, encrypt, enc_pass, no_copies=3, one_drive=None, one_drive_dir=None,
+                 compression=None, parallel_paths=1, stream='False', threads=1, split_size=0,
+                 exclude=None, io_policy=None):
     """
     It takes a list of directories, compresses them, encrypts them, uploads them to OneDrive, and then deletes the old
     copies and all of that is done one the remote host
@@ -279,11 +320,30 @@ def targz_remote(host, paths, destinations, encrypt, enc_pass, no_copies=3, one_
     :param no_copies: The number of copies to keep, defaults to 3 (optional)
     :param one_drive: the OneDrive object
     :param one_drive_dir: The directory in OneDrive where you want to store the backup
-    :return: Nothing is being returned.
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param stream: If True, tar writes to its standard output and the archive is compressed, encrypted and written
+    locally, so the destination doesn't have to be shared with the remote host, defaults to False (optional)
+    :param threads: Number of threads used for compression in stream mode, defaults to 1 (optional)
+    :param split_size: Size of one part of the archive i.e. 512M or 4G in stream mode, the archive isn't split
+    if it is 0, defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy, tar is executed with its ionice and nice values and its reads are limited
+    to its rate (optional)
+    :return: Dictionary with the result, True or False, for every path.
     """
 
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    if io_policy is None:
+        io_policy = utils.IoPolicy()
+    split_size = utils.parse_size(split_size)
     check_destination_directories(destinations)
-    for path in paths:
+    stream_mode = str(stream).upper() == 'TRUE'
+    # all paths are checked on the host with one remote command
+    remote_paths = file_management.paths_exist(paths, host)
+
+    def backup_path(path):
         logger.info("---------------------------------------")
         logger.info("start targz full remote")
         logger.info("---------------------------------------")
@@ -293,33 +353,56 @@ def targz_remote(host, paths, destinations, encrypt, enc_pass, no_copies=3, one_
             '/',
             '-',
         )
-        if file_management.path_exists(path, host):
+        if remote_paths[path] is None:
+            logger.error("Path: " + path + " couldn't be checked on host: " + host)
+            return False
+        if remote_paths[path]:
             if file_prefix[0] == '-':
                 file_prefix = file_prefix[1:len(file_prefix)]
             if file_prefix[len(file_prefix)-1] == '-':
                 file_prefix = file_prefix[:len(file_prefix)-1]
             file_prefix = file_prefix + "-full-" + host
-            file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+            file_name = archive_name(file_prefix, encrypt if stream_mode else 'False', codec)
             fn = file_name
             file_name = destinations[0] + '/' + file_name
 
             if exists(file_name):
                 logger.warning("File already exist, waiting 2 seconds!")
                 time.sleep(2)
-                file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+                file_name = archive_name(file_prefix, encrypt if stream_mode else 'False', codec)
                 fn = file_name
                 file_name = destinations[0] + '/' + file_name
 
             targz_cmd = (
-                    'tar -czvf ' + file_name + ' --absolute-names ' + path
+                    io_policy.command_prefix() + 'tar -cv' + tar_compress_option(codec) + io_policy.tar_options() +
+                    ' -f ' + file_name + ' --absolute-names' + tar_exclude_option(exclude) + ' ' + path
+            )
+            stream_cmd = (
+                    io_policy.command_prefix() + 'tar -c -f - --absolute-names' + tar_exclude_option(exclude) + ' ' +
+                    path
             )
             start = timer()
-            code, out, err = utils.run_remote(targz_cmd, host)
-            if code > 0:
-                logger.error(err)
-                logger.debug("Status code: " + str(code) + "\tStandard Output: "
-                             + out + "\tStandard Error: " + err)
-                return
+            if stream_mode:
+                if not archive.create_archive(
+                        paths=None,
+                        file_name=file_name,
+                        encrypt=encrypt,
+                        enc_pass=enc_pass,
+                        cmd=stream_cmd,
+                        threads=threads,
+                        compression=codec,
+                        host=host,
+                        copies=destination_copies(destinations, fn),
+                        split_size=split_size,
+                        io_policy=io_policy):
+                    return False
+            else:
+                code, out, err = utils.run_remote(targz_cmd, host)
+                if code > 0:
+                    logger.error(err)
+                    logger.debug("Status code: " + str(code) + "\tStandard Output: "
+                                 + out + "\tStandard Error: " + err)
+                    return False
 
             logger.info("Directory is compressed. File :" +
                         file_name + " successfully created.")
@@ -327,16 +410,18 @@ def targz_remote(host, paths, destinations, encrypt, enc_pass, no_copies=3, one_
             logger.info("Time took for targz :" +
                         str(timedelta(seconds=end - start)))
 
-            if str(encrypt).upper() == 'TRUE':
+            if str(encrypt).upper() == 'TRUE' and not stream_mode:
                 file_name = file_management.encrypt_data(
-                    file_name, enc_pass)
+                    file_name, enc_pass, threads)
+                if file_name is None:
+                    return False
                 fn = fn + '.enc'
 
             if one_drive is not None:
-                one_drive.upload_file(
+                one_drive.upload_files(
                     one_drive_dir=one_drive_dir,
                     local_dir=destinations[0],
-                    file_name=fn)
+                    file_names=archive.archive_file_names(file_name))
 
                 one_drive.remove_old_files(
                     file_name=file_prefix,
@@ -344,23 +429,24 @@ def targz_remote(host, paths, destinations, encrypt, enc_pass, no_copies=3, one_
                     encrypt=encrypt,
                     no_copies=no_copies)
 
-                file_management.rmold(
-                    directory=destinations[0],
-                    name=file_prefix,
-                    encrypt=encrypt,
-                    no_copies=no_copies)
-
-            if len(destinations) >= 1:
-                for i in range(0, len(destinations)):
-                    if i != 0 and file_management.path_exists(destinations[i]):
-                        file_management.copy(file_name, destinations[i], fn)
-                    file_management.rmold(
-                        directory=destinations[i], name=file_prefix, encrypt=encrypt, no_copies=no_copies)
+            if len(destinations) > 1 and not stream_mode:
+                file_management.copy_files(archive.archive_files(file_name),
+                                           existing_destinations(destinations[1:]))
+            retention.append((file_prefix, encrypt, no_copies))
+            return True
         else:
             logger.error("Path: " + path + " , doesn't exists!")
+            return False
+
+    retention = []
+    results = run_paths(paths, backup_path, parallel_paths)
+    file_management.rmold_all(destinations, retention)
+    return results
 
 
-def targz_incremental_remote(host, paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None):
+def targz_incremental_remote(host, paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None,
+                             compression=None, parallel_paths=1, stream='False', threads=1, split_size=0,
+                             exclude=None, io_policy=None):
     """
     It takes a list of paths, and creates a tar.gz file of each path, and then uploads the tar.gz file to OneDrive
 
@@ -371,11 +457,30 @@ def targz_incremental_remote(host, paths, destinations, encrypt, enc_pass, one_d
     :param enc_pass: The password to encrypt the file with
     :param one_drive: the OneDrive object
     :param one_drive_dir: The directory in OneDrive where you want to store the backup files
-    :return: The return value is a tuple (status, output)
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param stream: If True, tar writes to its standard output and the archive is compressed, encrypted and written
+    locally, so the destination doesn't have to be shared with the remote host, defaults to False (optional)
+    :param threads: Number of threads used for compression in stream mode, defaults to 1 (optional)
+    :param split_size: Size of one part of the archive i.e. 512M or 4G in stream mode, the archive isn't split
+    if it is 0, defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy, tar is executed with its ionice and nice values and its reads are limited
+    to its rate (optional)
+    :return: Dictionary with the result, True or False, for every path.
     """
 
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    if io_policy is None:
+        io_policy = utils.IoPolicy()
+    split_size = utils.parse_size(split_size)
     check_destination_directories(destinations)
-    for path in paths:
+    stream_mode = str(stream).upper() == 'TRUE'
+    # all paths are checked on the host with one remote command
+    remote_paths = file_management.paths_exist(paths, host)
+
+    def backup_path(path):
         logger.info("---------------------------------------")
         logger.info("start targz incremental remote")
         logger.info("---------------------------------------")
@@ -385,13 +490,16 @@ def targz_incremental_remote(host, paths, destinations, encrypt, enc_pass, one_d
             '/',
             '-',
         )
-        if file_management.path_exists(path, host):
+        if remote_paths[path] is None:
+            logger.error("Path: " + path + " couldn't be checked on host: " + host)
+            return False
+        if remote_paths[path]:
             if file_prefix[0] == '-':
                 file_prefix = file_prefix[1:len(file_prefix)]
             if file_prefix[len(file_prefix)-1] == '-':
                 file_prefix = file_prefix[:len(file_prefix)-1]
             file_prefix = file_prefix + "-inc-" + host
-            file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+            file_name = archive_name(file_prefix, encrypt if stream_mode else 'False', codec)
             fn = file_name
             file_name = destinations[0] + '/' + file_name
             snap_file = destinations[0] + '/' + file_prefix + '.snap'
@@ -399,48 +507,77 @@ def targz_incremental_remote(host, paths, destinations, encrypt, enc_pass, one_d
             if exists(file_name):
                 logger.warning("File already exist, waiting 2 seconds!")
                 time.sleep(2)
-                file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+                file_name = archive_name(file_prefix, encrypt if stream_mode else 'False', codec)
                 fn = file_name
                 file_name = destinations[0] + '/' + file_name
 
             targz_cmd = (
-                    'tar -czPg ' + snap_file + ' -f ' + file_name +
-                    ' --absolute-names ' + path + " && echo 'done'"
+                    io_policy.command_prefix() + 'tar -cPg ' + snap_file + tar_compress_option(codec) +
+                    io_policy.tar_options() + ' -f ' + file_name +
+                    ' --absolute-names' + tar_exclude_option(exclude) + ' ' + path + " && echo 'done'"
+            )
+            # in stream mode the snapshot file stays on the remote host
+            remote_snap_file = REMOTE_SNAPSHOT_DIR + '/' + file_prefix + '.snap'
+            stream_cmd = (
+                    'mkdir -p ' + REMOTE_SNAPSHOT_DIR + ' && ' + io_policy.command_prefix() + 'tar -cPg ' +
+                    remote_snap_file + ' -f -' +
+                    tar_exclude_option(exclude) + ' ' + path
             )
             start = timer()
-            code, out, err = utils.run_remote(targz_cmd, host)
-            if code > 0:
-                logger.error(err)
-                logger.debug("Status code: " + str(code) + "\tStandard Output: "
-                             + out + "\tStandard Error: " + err)
-                return
+            if stream_mode:
+                if not archive.create_archive(
+                        paths=None,
+                        file_name=file_name,
+                        encrypt=encrypt,
+                        enc_pass=enc_pass,
+                        cmd=stream_cmd,
+                        threads=threads,
+                        compression=codec,
+                        host=host,
+                        copies=destination_copies(destinations, fn),
+                        split_size=split_size,
+                        io_policy=io_policy):
+                    return False
+            else:
+                code, out, err = utils.run_remote(targz_cmd, host)
+                if code > 0:
+                    logger.error(err)
+                    logger.debug("Status code: " + str(code) + "\tStandard Output: "
+                                 + out + "\tStandard Error: " + err)
+                    return False
             logger.info("Directory is compressed. File :" +
                         file_name + " successfully created.")
             end = timer()
             logger.info("Time took for targz :" +
                         str(timedelta(seconds=end - start)))
 
-            if str(encrypt).upper() == 'TRUE':
+            if str(encrypt).upper() == 'TRUE' and not stream_mode:
                 file_name = file_management.encrypt_data(
-                    file_name, enc_pass)
+                    file_name, enc_pass, threads)
+                if file_name is None:
+                    return False
                 fn = fn + '.enc'
 
             if one_drive is not None:
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=fn)
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=file_prefix + '.snap')
-            if len(destinations) >= 1:
-                for i in range(1, len(destinations)):
-                    if file_management.path_exists(destinations[i]):
-                        file_management.copy(file_name, destinations[i], fn)
-                        file_management.copy(
-                            snap_file, destinations[i], file_prefix + '.snap')
+                one_drive.upload_files(one_drive_dir=one_drive_dir,
+                                       local_dir=destinations[0], file_names=archive.archive_file_names(file_name))
+                if not stream_mode:
+                    one_drive.upload_file(one_drive_dir=one_drive_dir,
+                                          local_dir=destinations[0], file_name=file_prefix + '.snap')
+            if len(destinations) > 1 and not stream_mode:
+                file_management.copy_files(archive.archive_files(file_name) + [snap_file],
+                                           existing_destinations(destinations[1:]))
+            return True
         else:
             logger.error("Path: " + path + " , doesn't exists!")
+            return False
 
+    return run_paths(paths, backup_path, parallel_paths)
 
-def targz_differential_remote(host, paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None):
+
+def targz_differential_remote(host, paths, destinations, encrypt, enc_pass, one_drive=None, one_drive_dir=None,
+                              compression=None, parallel_paths=1, stream='False', threads=1, split_size=0,
+                              exclude=None, io_policy=None):
     """
     It takes a directory, creates a snapshot of it, compresses the directory, encrypts it, and uploads it to OneDrive
 
@@ -451,11 +588,30 @@ def targz_differential_remote(host, paths, destinations, encrypt, enc_pass, one_
     :param enc_pass: The password to use for encryption
     :param one_drive: the OneDrive object
     :param one_drive_dir: The directory on OneDrive where you want to store the backup files
-    :return: The return value is a tuple (status, output)
+    :param compression: The compression option i.e. zstd:3, lz4, gzip:6, xz or none, defaults to gzip:6 (optional)
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :param stream: If True, tar writes to its standard output and the archive is compressed, encrypted and written
+    locally, so the destination doesn't have to be shared with the remote host, defaults to False (optional)
+    :param threads: Number of threads used for compression in stream mode, defaults to 1 (optional)
+    :param split_size: Size of one part of the archive i.e. 512M or 4G in stream mode, the archive isn't split
+    if it is 0, defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher or a list of patterns of paths that aren't backed up (optional)
+    :param io_policy: The IoPolicy, tar is executed with its ionice and nice values and its reads are limited
+    to its rate (optional)
+    :return: Dictionary with the result, True or False, for every path.
     """
 
+    codec = compression_module.parse_codec(compression)
+    exclude = exclude_module.load(exclude)
+    if io_policy is None:
+        io_policy = utils.IoPolicy()
+    split_size = utils.parse_size(split_size)
     check_destination_directories(destinations)
-    for path in paths:
+    stream_mode = str(stream).upper() == 'TRUE'
+    # all paths are checked on the host with one remote command
+    remote_paths = file_management.paths_exist(paths, host)
+
+    def backup_path(path):
         logger.info("---------------------------------------")
         logger.info("start targz differential remote")
         logger.info("---------------------------------------")
@@ -466,13 +622,16 @@ def targz_differential_remote(host, paths, destinations, encrypt, enc_pass, one_
             '-',
         )
 
-        if file_management.path_exists(path, host):
+        if remote_paths[path] is None:
+            logger.error("Path: " + path + " couldn't be checked on host: " + host)
+            return False
+        if remote_paths[path]:
             if file_prefix[0] == '-':
                 file_prefix = file_prefix[1:len(file_prefix)]
             if file_prefix[len(file_prefix)-1] == '-':
                 file_prefix = file_prefix[:len(file_prefix)-1]
             file_prefix = file_prefix + "-diff-" + host
-            file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+            file_name = archive_name(file_prefix, encrypt if stream_mode else 'False', codec)
             fn = file_name
             snap_file = destinations[0] + '/' + file_prefix + '.snap'
             file_name = destinations[0] + '/' + file_name
@@ -481,60 +640,247 @@ def targz_differential_remote(host, paths, destinations, encrypt, enc_pass, one_
             if exists(file_name):
                 logger.warning("File already exist, waiting 2 seconds!")
                 time.sleep(2)
-                file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar.gz'
+                file_name = archive_name(file_prefix, encrypt if stream_mode else 'False', codec)
                 fn = file_name
                 file_name = destinations[0] + '/' + file_name
 
             targz_cmd = (
-                    'tar -czPg ' + snap_file + ' -f ' + file_name +
-                    ' --absolute-names ' + path + " && echo 'done'"
+                    io_policy.command_prefix() + 'tar -cPg ' + snap_file + tar_compress_option(codec) +
+                    io_policy.tar_options() + ' -f ' + file_name +
+                    ' --absolute-names' + tar_exclude_option(exclude) + ' ' + path + " && echo 'done'"
+            )
+            # in stream mode the snapshot files stay on the remote host, the full backup state (.snap.bak)
+            # is restored before every run and saved after the first one
+            remote_snap_file = REMOTE_SNAPSHOT_DIR + '/' + file_prefix + '.snap'
+            stream_cmd = (
+                    'mkdir -p ' + REMOTE_SNAPSHOT_DIR +
+                    ' && { [ ! -f ' + remote_snap_file + '.bak ] || cp ' + remote_snap_file + '.bak ' +
+                    remote_snap_file + '; }' +
+                    ' && ' + io_policy.command_prefix() + 'tar -cPg ' + remote_snap_file + ' -f -' +
+                    tar_exclude_option(exclude) + ' ' + path +
+                    ' && { [ -f ' + remote_snap_file + '.bak ] || cp ' + remote_snap_file + ' ' +
+                    remote_snap_file + '.bak; }'
             )
             start = timer()
-            code, out, err = utils.run_remote(targz_cmd, host)
-            if code > 0:
-                logger.error(err)
-                logger.debug("Status code: " + str(code) + "\tStandard Output: "
-                             + out + "\tStandard Error: " + err)
-                return
+            if stream_mode:
+                if not archive.create_archive(
+                        paths=None,
+                        file_name=file_name,
+                        encrypt=encrypt,
+                        enc_pass=enc_pass,
+                        cmd=stream_cmd,
+                        threads=threads,
+                        compression=codec,
+                        host=host,
+                        copies=destination_copies(destinations, fn),
+                        split_size=split_size,
+                        io_policy=io_policy):
+                    return False
+            else:
+                code, out, err = utils.run_remote(targz_cmd, host)
+                if code > 0:
+                    logger.error(err)
+                    logger.debug("Status code: " + str(code) + "\tStandard Output: "
+                                 + out + "\tStandard Error: " + err)
+                    return False
             logger.info("Directory is compressed. File :" +
                         file_name + " successfully created.")
 
-            if not exists(snap_file_bak):
-                utils.run("cp " + snap_file + " " + snap_file_bak)
-            else:
-                utils.run("cp " + snap_file_bak + " " + snap_file)
+            if not stream_mode:
+                try:
+                    if not exists(snap_file_bak):
+                        file_management.copy_file(snap_file, snap_file_bak)
+                    else:
+                        file_management.copy_file(snap_file_bak, snap_file)
+                except OSError as e:
+                    logger.error("Error while copying snapshot file: " + snap_file + ", error: " + str(e))
 
             end = timer()
             logger.info("Time took for targz :" +
                         str(timedelta(seconds=end - start)))
 
-            if str(encrypt).upper() == 'TRUE':
+            if str(encrypt).upper() == 'TRUE' and not stream_mode:
                 file_name = file_management.encrypt_data(
-                    file_name, enc_pass)
+                    file_name, enc_pass, threads)
+                if file_name is None:
+                    return False
                 fn = fn + '.enc'
 
             if one_drive is not None:
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=fn)
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=file_prefix + '.snap')
-                one_drive.upload_file(one_drive_dir=one_drive_dir,
-                                      local_dir=destinations[0], file_name=file_prefix + '.snap.bak')
+                one_drive.upload_files(one_drive_dir=one_drive_dir,
+                                       local_dir=destinations[0], file_names=archive.archive_file_names(file_name))
+                if not stream_mode:
+                    one_drive.upload_file(one_drive_dir=one_drive_dir,
+                                          local_dir=destinations[0], file_name=file_prefix + '.snap')
+                    one_drive.upload_file(one_drive_dir=one_drive_dir,
+                                          local_dir=destinations[0], file_name=file_prefix + '.snap.bak')
                 one_drive.keep_only_oldest_and_newest(
                     file_name=file_prefix, one_drive_dir=one_drive_dir, encrypt=encrypt)
 
-            if len(destinations) >= 1:
-                for i in range(0, len(destinations)):
-                    if i != 0 and file_management.path_exists(destinations[i]):
-                        file_management.copy(file_name, destinations[i], fn)
-                        file_management.copy(
-                            snap_file, destinations[i], file_prefix + '.snap')
-                        file_management.copy(
-                            snap_file_bak, destinations[i], file_prefix + '.snap.bak')
-                    file_management.keep_only_oldest_and_newest(
-                        directory=destinations[i], name=file_prefix, encrypt=encrypt)
+            if len(destinations) > 1 and not stream_mode:
+                file_management.copy_files(archive.archive_files(file_name) + [snap_file, snap_file_bak],
+                                           existing_destinations(destinations[1:]))
+            retention.append((file_prefix, encrypt, None))
+            return True
         else:
             logger.error("Path: " + path + " , doesn't exists!")
+            return False
+
+    retention = []
+    results = run_paths(paths, backup_path, parallel_paths)
+    file_management.rmold_all(destinations, retention)
+    return results
+
+
+def archive_name(file_prefix, encrypt, codec):
+    """
+    It creates the name of the archive, the archive is encrypted while it is written so the name already
+    contains the .enc extension
+
+    :param file_prefix: The prefix of the archive
+    :param encrypt: True/False
+    :param codec: The Codec object used for compression
+    :return: The name of the archive.
+    """
+    file_name = file_prefix + '-' + utils.get_curr_date_time() + '.tar' + codec.extension
+    if str(encrypt).upper() == 'TRUE':
+        file_name = file_name + '.enc'
+    return file_name
+
+
+def tar_compress_option(codec):
+    """
+    It creates the tar option that compresses the archive with the command line tool of the codec
+
+    :param codec: The Codec object used for compression
+    :return: The tar option, empty string if the archive isn't compressed.
+    """
+    if codec.command() is None:
+        return ''
+    return " -I '" + codec.command() + "'"
+
+
+def tar_exclude_option(exclude):
+    """
+    It creates GNU tar options for the exclude patterns, used on remote hosts
+
+    :param exclude: The ExcludeMatcher
+    :return: The tar options, empty string if there are no patterns.
+    """
+    return ''.join(" --exclude='" + pattern.replace("'", "'\\''") + "'" for pattern in exclude.patterns)
+
+
+def archive_changes(path, file_name, index_file, update_index, encrypt, enc_pass, threads, codec, copies=None,
+                    split_size=None, block_threshold=0, exclude=None, io_policy=None):
+    """
+    It archives only the entries of the path that are new or changed compared to the index file, deleted
+    entries are listed in the archive member .backup-deleted. If the index doesn't exist every entry is
+    archived, the index is created and the archive is marked as the base of the chain.
+
+    :param path: The directory to archive
+    :param file_name: The archive that will be created
+    :param index_file: The index of the previous backup
+    :param update_index: True if the index should be updated with the current state (incremental backup)
+    :param encrypt: True/False
+    :param enc_pass: The password to encrypt the archive with
+    :param threads: Number of threads used for compression
+    :param codec: The Codec object used for compression
+    :param copies: A list of additional files that are written at the same time (optional)
+    :param split_size: Size of one part of the archive in bytes, the archive isn't split if it is 0 or None (optional)
+    :param block_threshold: Changed files of this size or bigger are archived as deltas with only the blocks that
+    changed since the indexed backup, 0 disables it, defaults to 0 (optional)
+    :param exclude: The ExcludeMatcher, excluded directories are not scanned (optional)
+    :param io_policy: The IoPolicy that limits reads of the files (optional)
+    :return: True if the archive is created, otherwise False.
+    """
+    index = change_index.ChangeIndex(index_file)
+    index_exists = index.exists()
+    start = timer()
+    previous = index.load()
+    current = change_index.scan([path], exclude=exclude)
+    changed, deleted = change_index.changes(previous, current)
+    end = timer()
+    logger.info("Scanned entries: " + str(len(current)) + ", changed: " + str(len(changed)) +
+                ", deleted: " + str(len(deleted)) + ", time took for scan: " + str(timedelta(seconds=end - start)))
+    extra = {}
+    if len(deleted) > 0:
+        extra[change_index.DELETED_MEMBER] = ('\n'.join(deleted) + '\n').encode('utf-8', 'surrogateescape')
+    if not index_exists:
+        extra[change_index.BASE_MEMBER] = b''
+    blocks = block_delta.BlockState(index.load_blocks() if block_threshold > 0 else {}, block_threshold)
+    if not archive.create_archive(
+            paths=changed,
+            file_name=file_name,
+            encrypt=encrypt,
+            enc_pass=enc_pass,
+            threads=threads,
+            compression=codec,
+            recursive=False,
+            extra=extra,
+            copies=copies,
+            split_size=split_size,
+            blocks=blocks,
+            io_policy=io_policy):
+        return False
+    if blocks.delta_files > 0:
+        logger.info("Files archived as deltas: " + str(blocks.delta_files) +
+                    ", size of deltas: " + str(blocks.delta_bytes))
+    if update_index or not index_exists:
+        index.update(changed, deleted, current)
+        index.update_blocks(blocks.current, [name for name in changed + deleted if name not in blocks.current])
+    return True
+
+
+def existing_destinations(destinations):
+    """
+    :param destinations: a list of directories
+    :return: A list of directories that exist, others are skipped.
+    """
+    return [destination for destination in destinations if file_management.path_exists(destination)]
+
+
+def destination_copies(destinations, file_name):
+    """
+    It creates the paths of the archive on every destination except the first one, destinations
+    that don't exist are skipped
+
+    :param destinations: a list of directories where the backup will be stored
+    :param file_name: The name of the archive
+    :return: A list of paths.
+    """
+    return [destination + '/' + file_name for destination in existing_destinations(destinations[1:])]
+
+
+def run_paths(paths, job, parallel_paths=1):
+    """
+    It runs the job for every path, at most parallel_paths jobs are running at the same time. A failure of one
+    path doesn't stop the other paths, all failures are reported at the end.
+
+    :param paths: A list of paths
+    :param job: Function that takes a path and returns True if the backup of the path succeeded
+    :param parallel_paths: Number of paths that are processed at the same time, defaults to 1 (optional)
+    :return: Dictionary with the result, True or False, for every path.
+    """
+    results = {}
+    workers = max(1, min(int(parallel_paths), len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='targz') as executor:
+        futures = {}
+        for path in paths:
+            futures[executor.submit(job, path)] = path
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results[path] = future.result() is True
+            except Exception as e:
+                logger.error("Backup of path: " + path + " failed with exception: " + str(e))
+                results[path] = False
+    failed = [path for path in paths if not results[path]]
+    if len(failed) > 0:
+        logger.error("Backup failed for " + str(len(failed)) + " of " + str(len(paths)) + " paths: " +
+                     ', '.join(failed))
+    else:
+        logger.info("Backup succeeded for all " + str(len(paths)) + " paths")
+    return results
 
 
 def check_destination_directories(destinations):
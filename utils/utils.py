@@ -1,7 +1,15 @@
 #!/usr/bin/python3
+import os
+import time
+import uuid
+import atexit
 import logging
+import threading
+import contextlib
 import subprocess
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
 
 import paramiko
 import schedule
@@ -10,30 +18,139 @@ from paramiko import SSHClient,AutoAddPolicy
 logger = logging.getLogger("backup_logger")
 
 
-def run(cmd, cmd_log=None):
+# how often a long running command logs its progress, in seconds
+PROGRESS_INTERVAL = 60
+
+# pages of a file that is read by the backup are dropped from the page cache after every 8MB
+DROP_CACHE_SIZE = 8388608
+
+# size of one tar record with the default blocking factor, tar checkpoints are counted in records
+TAR_RECORD_SIZE = 10240
+
+# ionice classes by name
+IONICE_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+
+# SSH connections to remote hosts send a keepalive every 30 seconds and are closed after 10 minutes without use
+SSH_KEEPALIVE = 30
+SSH_IDLE_TIMEOUT = 600
+
+# channels that are open on one connection at the same time, OpenSSH allows 10 sessions by default (MaxSessions)
+SSH_MAX_CHANNELS = 8
+
+# a channel that is refused on a live connection is requested again, after 1, 2, 3... seconds
+SSH_CHANNEL_RETRIES = 5
+
+
+class OutputReader(threading.Thread):
+
+    def __init__(self, pipe, callback=None, keep_lines=None):
+        """
+        It reads the output of a process line by line in a background thread, so memory usage doesn't grow
+        with the size of the output when only the last lines are kept
+
+        :param pipe: The pipe to read
+        :param callback: Function that is called with every line as a string (optional)
+        :param keep_lines: Number of last lines that are kept, None keeps all lines (optional)
+        """
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.callback = callback
+        self.lines = deque(maxlen=keep_lines)
+        self.line_count = 0
+        self.byte_count = 0
+
+    def run(self):
+        for line in self.pipe:
+            self.line_count += 1
+            self.byte_count += len(line)
+            line = str(line, "utf-8", errors="replace")
+            if self.callback is not None:
+                try:
+                    self.callback(line.rstrip('\n'))
+                except Exception as e:
+                    logger.debug("Error in output callback: " + str(e))
+            self.lines.append(line)
+        self.pipe.close()
+
+    def text(self):
+        return ''.join(self.lines)
+
+
+def wait_with_usage(proc):
     """
-    It runs a command and returns the return code, stdout, and stderr
+    It waits for the process to finish and collects its resource usage, the process is reaped here instead
+    of in Popen.wait so the rusage of the child isn't lost
 
-    :param cmd: The command to be executed
+    :param proc: The Popen object
+    :return: The resource usage (resource.struct_rusage) of the process.
+    """
+    pid, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return usage
+
+
+def format_usage(usage, elapsed):
+    """
+    It formats the resource usage of a process for the log
+
+    :param usage: The resource usage returned by wait_with_usage
+    :param elapsed: Elapsed time in seconds
+    :return: The formatted string.
+    """
+    return ("elapsed: " + str(timedelta(seconds=elapsed)) +
+            ", user CPU: " + "{0:.2f}".format(usage.ru_utime) + "s" +
+            ", system CPU: " + "{0:.2f}".format(usage.ru_stime) + "s" +
+            ", max RSS: " + "{0:.1f}".format(usage.ru_maxrss / 1024) + "MB" +
+            ", read: " + "{0:.1f}".format(usage.ru_inblock * 512 / 1048576) + "MB" +
+            ", written: " + "{0:.1f}".format(usage.ru_oublock * 512 / 1048576) + "MB")
+
+
+def run(cmd, cmd_log=None, stdout_callback=None, stderr_callback=None, keep_lines=None):
+    """
+    It runs a command and returns the return code, stdout, and stderr. The output is read line by line while
+    the command is running, passed to the callbacks and only the last keep_lines lines are kept in memory.
+    Progress is logged every minute and the resource usage of the command is logged when it finishes.
+
+    :param cmd: The command to be executed, a list of arguments is executed without a shell
     :param cmd_log: This is the command that will be logged
+    :param stdout_callback: Function that is called with every line of the standard output (optional)
+    :param stderr_callback: Function that is called with every line of the standard error (optional)
+    :param keep_lines: Number of last lines of stdout and stderr that are returned, None returns all (optional)
     :return: The return code, stdout, and stderr.
     """
 
     if cmd_log is None:
         cmd_log = cmd
+    if isinstance(cmd_log, list):
+        cmd_log = ' '.join(cmd_log)
     try:
         logger.info('Executing: ' + str(cmd_log))
+        start = timer()
         proc = subprocess.Popen(
             cmd,
-            shell=True,
+            shell=not isinstance(cmd, list),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
-
-        stdout, stderr = proc.communicate()
-        return proc.returncode, str(stdout, "utf-8"), str(stderr, "utf-8")
+        stdout = OutputReader(proc.stdout, stdout_callback, keep_lines)
+        stderr = OutputReader(proc.stderr, stderr_callback, keep_lines)
+        stdout.start()
+        stderr.start()
+        while True:
+            stdout.join(PROGRESS_INTERVAL)
+            if not stdout.is_alive():
+                break
+            logger.info("Still executing: " + str(cmd_log) + ", elapsed: " +
+                        str(timedelta(seconds=timer() - start)) + ", lines of output: " + str(stdout.line_count))
+        stderr.join()
+        usage = wait_with_usage(proc)
+        logger.debug("Finished: " + str(cmd_log) + ", status code: " + str(proc.returncode) + ", " +
+                     format_usage(usage, timer() - start) + ", output: " + str(stdout.line_count) + " lines, " +
+                     str(stdout.byte_count) + " bytes")
+        return proc.returncode, stdout.text(), stderr.text()
     except Exception as e:
         logger.error("Error while executing command, with exception: " + str(e))
+        return 1, "", str(e)
 
 
 def get_curr_date_time():
@@ -56,22 +173,208 @@ def get_curr_date_time_log_format():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S,%f")[:-3]
 
 
+class SSHPool:
+
+    def __init__(self, keepalive=SSH_KEEPALIVE, idle_timeout=SSH_IDLE_TIMEOUT, max_channels=SSH_MAX_CHANNELS):
+        """
+        Authenticated SSH connections, one per host, that are reused by all remote commands. Commands run on their
+        own channels of the connection, several at the same time. A broken connection is replaced by a new one,
+        and a connection without open channels is closed when it isn't used for idle_timeout.
+
+        :param keepalive: Seconds between keepalive messages, defaults to 30 (optional)
+        :param idle_timeout: Seconds after which an unused connection is closed, defaults to 600 (optional)
+        :param max_channels: Number of channels that are open on one connection at the same time, defaults to 8
+        (optional)
+        """
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.max_channels = max_channels
+        # host -> [SSHClient, time of the last use, number of open channels]
+        self.__clients = {}
+        self.__host_locks = {}
+        self.__semaphores = {}
+        self.__lock = threading.Lock()
+        self.__reaper = None
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.handshake_time = 0.0
+        self.handshake_max = 0.0
+
+    def __host(self, host):
+        with self.__lock:
+            if host not in self.__host_locks:
+                self.__host_locks[host] = threading.Lock()
+                self.__semaphores[host] = threading.BoundedSemaphore(self.max_channels)
+            return self.__host_locks[host], self.__semaphores[host]
+
+    def __connect(self, host):
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        client.load_system_host_keys()
+        start = timer()
+        client.connect(hostname=host, username='root')
+        elapsed = timer() - start
+        client.get_transport().set_keepalive(self.keepalive)
+        with self.__lock:
+            self.misses += 1
+            self.handshake_time += elapsed
+            self.handshake_max = max(self.handshake_max, elapsed)
+            if self.__reaper is None:
+                self.__reaper = threading.Thread(target=self.__reap, name='ssh-pool', daemon=True)
+                self.__reaper.start()
+        logger.debug("SSH connection to host: " + host + " established in " + "{0:.3f}".format(elapsed) + "s")
+        return client
+
+    def __open(self, host):
+        host_lock, _ = self.__host(host)
+        with host_lock:
+            pooled = self.__clients.get(host)
+            transport = pooled[0].get_transport() if pooled is not None else None
+            if transport is not None and transport.is_active():
+                with self.__lock:
+                    self.hits += 1
+            else:
+                if pooled is not None:
+                    pooled[0].close()
+                    with self.__lock:
+                        self.reconnects += 1
+                pooled = [self.__connect(host), 0, 0]
+                self.__clients[host] = pooled
+                transport = pooled[0].get_transport()
+            channel = transport.open_session()
+            pooled[1] = timer()
+            pooled[2] += 1
+            return channel, pooled
+
+    def __release(self, host, channel, pooled):
+        channel.close()
+        host_lock, _ = self.__host(host)
+        with host_lock:
+            pooled[1] = timer()
+            pooled[2] -= 1
+
+    def __active(self, host):
+        host_lock, _ = self.__host(host)
+        with host_lock:
+            pooled = self.__clients.get(host)
+            transport = pooled[0].get_transport() if pooled is not None else None
+            return transport is not None and transport.is_active()
+
+    def discard(self, host):
+        host_lock, _ = self.__host(host)
+        with host_lock:
+            pooled = self.__clients.pop(host, None)
+            if pooled is not None:
+                pooled[0].close()
+
+    @contextlib.contextmanager
+    def session(self, host):
+        """
+        It opens a new channel on the connection to the host, the channel is closed when the block ends.
+        If the connection was closed, i.e. by the server, the host is connected again once. If the server refuses
+        the channel on a live connection, i.e. too many sessions are open, the channel is requested again later
+        and the connection stays open for the commands that are running on it.
+
+        :param host: The hostname or IP address of the remote server
+        """
+        _, semaphore = self.__host(host)
+        with semaphore:
+            reconnected = False
+            attempt = 0
+            while True:
+                try:
+                    channel, pooled = self.__open(host)
+                    break
+                except (paramiko.SSHException, EOFError, OSError) as e:
+                    attempt += 1
+                    if self.__active(host):
+                        # the server refused the channel on a live connection, i.e. its MaxSessions is reached,
+                        # the connection isn't closed, channels of other commands keep running on it
+                        if attempt > SSH_CHANNEL_RETRIES:
+                            raise
+                        logger.debug("Can't open channel to host: " + host + ", trying again, error: " + str(e))
+                        time.sleep(attempt)
+                    elif not reconnected:
+                        # __open connects again when the connection isn't active
+                        logger.debug("Can't open channel to host: " + host + ", connecting again, error: " + str(e))
+                        reconnected = True
+                    else:
+                        raise
+            try:
+                yield channel
+            finally:
+                self.__release(host, channel, pooled)
+
+    def close_idle(self):
+        """
+        It closes connections without open channels that weren't used for idle_timeout
+        """
+        now = timer()
+        with self.__lock:
+            hosts = list(self.__clients)
+        for host in hosts:
+            host_lock, _ = self.__host(host)
+            with host_lock:
+                pooled = self.__clients.get(host)
+                if pooled is not None and pooled[2] == 0 and now - pooled[1] >= self.idle_timeout:
+                    logger.debug("Closing idle SSH connection to host: " + host)
+                    del self.__clients[host]
+                    pooled[0].close()
+
+    def __reap(self):
+        while True:
+            time.sleep(self.keepalive)
+            try:
+                self.close_idle()
+            except Exception as e:
+                logger.debug("Error while closing idle SSH connections: " + str(e))
+
+    def metrics(self):
+        """
+        :return: Dictionary with hits and misses of the pool, reconnects, number of open connections, and average
+        and maximum time of the SSH handshake in seconds.
+        """
+        with self.__lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reconnects': self.reconnects,
+                'connections': len(self.__clients),
+                'handshake_avg': round(self.handshake_time / self.misses, 3) if self.misses > 0 else 0.0,
+                'handshake_max': round(self.handshake_max, 3)
+            }
+
+    def log_metrics(self):
+        metrics = self.metrics()
+        logger.info("SSH connection pool: " + ', '.join(key + ': ' + str(metrics[key]) for key in metrics))
+
+    def close(self):
+        with self.__lock:
+            hosts = list(self.__clients)
+        for host in hosts:
+            self.discard(host)
+
+
+# connections of all remote modules
+SSH_POOL = SSHPool()
+atexit.register(SSH_POOL.close)
+
+
 def run_remote(cmd, host, cmd_log=None):
     """
-    It executes a command on a remote host and returns the output
+    It executes a command on a remote host and returns the output, on a channel of the pooled connection
 
     :param cmd: The command to be executed on the remote host
     :param host: The hostname or IP address of the remote server
     :param cmd_log: This is the command that will be logged
-    :return: The return value is a tuple of three values:
+    :return: The exit status, stdout, and stderr of the command, the status is 255 if the command couldn't be
+    executed or its status wasn't received.
     """
 
     try:
         if cmd_log is None:
             cmd_log = cmd
-        client = SSHClient()
-        client.set_missing_host_key_policy(AutoAddPolicy())
-        client.load_system_host_keys()
         logger.info("Executing command: " + str(cmd_log) + " on remote host: " + host)
         command = ""
         if len(cmd) >= 1:
@@ -83,22 +386,326 @@ def run_remote(cmd, host, cmd_log=None):
                 command_log += str(c)
         logger.debug("Command as string: " + command_log)
 
-        client.connect(hostname=host, username='root')
-        stdin, stdout, stderr = client.exec_command(
-            command=command,
-            timeout=10,
-            bufsize=-1)
-        out = ""
-        err = ""
-        try:
-            out = str(stdout.read(), "utf-8")
-        except:
-            logger.debug("There is no stdout")
-        client.close()
-        return 0, out, err
+        start = timer()
+        with SSH_POOL.session(host) as channel:
+            # no timeout, commands like tar or rsync can be quiet for a long time
+            channel.settimeout(None)
+            channel.exec_command(command)
+            # standard error is read at the same time, otherwise it fills the window of the channel and the
+            # command stops
+            stdout = OutputReader(channel.makefile('rb', -1))
+            stderr = OutputReader(channel.makefile_stderr('rb', -1))
+            stdout.start()
+            stderr.start()
+            while True:
+                stdout.join(PROGRESS_INTERVAL)
+                if not stdout.is_alive():
+                    break
+                logger.info("Still executing: " + command_log + " on remote host: " + host + ", elapsed: " +
+                            str(timedelta(seconds=timer() - start)) + ", lines of output: " + str(stdout.line_count))
+            stderr.join()
+            code = channel.recv_exit_status()
+        if code < 0:
+            # the connection was closed before the command finished, the same status as ssh returns
+            logger.error("Exit status of command: " + command_log + " wasn't received from host: " + host)
+            code = 255
+        logger.debug("Finished: " + command_log + ", status code: " + str(code) + ", elapsed: " +
+                     str(timedelta(seconds=timer() - start)))
+        return code, stdout.text(), stderr.text()
     except Exception as e:
         logger.error("Error while executing command, with exception: " + str(e))
-        return 0, "", str(e)
+        return 255, "", str(e)
+
+
+def run_remote_batch(commands, host, cmd_log=None):
+    """
+    It executes several commands on a remote host in one SSH session and one shell, so checks, listings and
+    deletes of a job need one connection instead of one per command. Every command runs in its own subshell,
+    also when the previous one failed, and its output and exit status are returned separately.
+
+    :param commands: A list of shell commands
+    :param host: The hostname or IP address of the remote server
+    :param cmd_log: This is the command that will be logged (optional)
+    :return: A list of tuples (exit status, output with standard error), in the order of the commands. The status
+    is None and the output is the error if the result of the command wasn't received, so it isn't mistaken for
+    a command that returned 255.
+    """
+    marker = 'backup-batch-' + uuid.uuid4().hex
+    script = ''
+    for i in range(len(commands)):
+        # the output of the command is between two markers, the end marker is on a new line and has the status
+        script += ("printf '%s\\n' '" + marker + " " + str(i) + "'; ( " + commands[i] + " ) 2>&1; " +
+                   "printf '\\n%s %s\\n' '" + marker + " " + str(i) + "' \"$?\"\n")
+    if cmd_log is None:
+        cmd_log = '; '.join(commands)
+    code, out, err = run_remote(script, host, cmd_log)
+    if code > 0 and err == '':
+        err = "Batch exited with status code: " + str(code)
+    results = [(None, err)] * len(commands)
+    current = None
+    lines = []
+    for line in out.split('\n'):
+        if line.startswith(marker + ' '):
+            fields = line.split(' ')
+            if len(fields) == 2:
+                current = int(fields[1])
+                lines = []
+            elif current is not None:
+                results[current] = (int(fields[2]), '\n'.join(lines))
+                current = None
+        elif current is not None:
+            lines.append(line)
+    return results
+
+
+def run_remote_stream(cmd, host, stream, cmd_log=None, chunk_size=1048576, policy=None):
+    """
+    It executes a command on a remote host and writes its standard output to the stream while the command
+    is running. Data is read from the channel only when the stream accepted the previous chunk, so a slow
+    stream stops the remote command through the SSH flow control instead of buffering the output in memory.
+
+    :param cmd: The command to be executed on the remote host
+    :param host: The hostname or IP address of the remote server
+    :param stream: File like object that receives the standard output
+    :param cmd_log: This is the command that will be logged
+    :param chunk_size: Maximum size of one read from the channel, defaults to 1MB (optional)
+    :param policy: The IoPolicy, reads from the channel are throttled with its rate, so the command on the remote
+    host is slowed down too (optional)
+    :return: The exit status and the last lines of standard error of the command, the status is 255 if it wasn't
+    received.
+    """
+
+    if cmd_log is None:
+        cmd_log = cmd
+    logger.info("Executing command: " + str(cmd_log) + " on remote host: " + host + ", streaming output")
+    with SSH_POOL.session(host) as channel:
+        # no timeout, the command can be quiet for a long time while it is reading files
+        channel.settimeout(None)
+        channel.exec_command(cmd)
+        # standard error is read by its own thread, a command that writes a lot to it and little to standard
+        # output would otherwise fill the window of the channel and stop
+        stderr = OutputReader(channel.makefile_stderr('rb', -1), keep_lines=1000)
+        stderr.start()
+        while True:
+            data = channel.recv(chunk_size)
+            if not data:
+                break
+            if policy is not None:
+                policy.throttle(len(data))
+            stream.write(data)
+        stderr.join()
+        code = channel.recv_exit_status()
+    if code < 0:
+        # the connection was closed before the command finished, the output is incomplete
+        logger.error("Exit status of command: " + str(cmd_log) + " wasn't received from host: " + host)
+        code = 255
+    return code, stderr.text()
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        """
+        Token bucket that limits the rate of bytes, it is shared by every thread that reads for the same job
+
+        :param rate: Number of bytes per second
+        :param burst: Number of bytes that can be read at once without waiting, defaults to one second (optional)
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        It takes the tokens for the bytes that were read and sleeps until the rate is below the limit
+
+        :param amount: Number of bytes
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class IoPolicy:
+
+    def __init__(self, rate_limit=0, ionice=None, nice=None):
+        """
+        Limits of the I/O of one backup job. Local reads are throttled with a token bucket and their pages are
+        dropped from the page cache after they are read, commands are executed with ionice and nice, and commands
+        on remote hosts are throttled with their own options or through the SSH flow control.
+
+        :param rate_limit: Maximum number of bytes read per second i.e. 50M, 0 means no limit (optional)
+        :param ionice: The ionice class i.e. idle, best-effort:7 or 2:7 (optional)
+        :param nice: The nice value i.e. 10 (optional)
+        """
+        self.rate = parse_size(rate_limit if rate_limit not in (None, '') else 0)
+        self.bucket = TokenBucket(self.rate) if self.rate > 0 else None
+        self.ionice = parse_ionice(ionice)
+        self.nice = None
+        if nice is not None and str(nice).strip() != '':
+            try:
+                self.nice = int(nice)
+            except ValueError:
+                logger.warning("Wrong nice value: " + str(nice) + ", it will be ignored")
+
+    def throttle(self, size):
+        if self.bucket is not None and size > 0:
+            self.bucket.consume(size)
+
+    def command_args(self):
+        """
+        :return: The command, as a list of arguments, that runs the next command with the I/O class and nice value.
+        """
+        args = []
+        if self.ionice is not None:
+            args += ['ionice', '-c', str(self.ionice[0])]
+            if self.ionice[1] is not None:
+                args += ['-n', str(self.ionice[1])]
+        if self.nice is not None:
+            args += ['nice', '-n', str(self.nice)]
+        return args
+
+    def command_prefix(self):
+        """
+        :return: The same as command_args, as a string for commands that are executed by a shell.
+        """
+        args = self.command_args()
+        return ' '.join(args) + ' ' if args else ''
+
+    def tar_options(self):
+        """
+        It creates GNU tar options that sleep one second after every rate bytes, used on remote hosts where
+        the reads can't be throttled locally
+
+        :return: The tar options, empty string if there is no limit.
+        """
+        if self.rate <= 0:
+            return ''
+        return ' --checkpoint=' + str(max(1, self.rate // TAR_RECORD_SIZE)) + ' --checkpoint-action=sleep=1'
+
+    def rsync_options(self, processes=1):
+        """
+        :param processes: Number of rsync processes that run at the same time and share the limit, defaults to 1
+        (optional)
+        :return: The rsync option that limits the bandwidth, empty string if there is no limit.
+        """
+        if self.rate <= 0:
+            return ''
+        return ' --bwlimit=' + str(max(1, self.rate // max(1, int(processes)) // 1024))
+
+    def open(self, file_name):
+        """
+        It opens the file for reading through the limits of the job
+
+        :param file_name: The file
+        :return: The PolicyReader.
+        """
+        return PolicyReader(open(file_name, 'rb'), self)
+
+
+class PolicyReader:
+
+    def __init__(self, fileobj, policy):
+        """
+        File like object that throttles reads with the token bucket of the policy and drops pages that were
+        read from the page cache, so the backup doesn't evict the cache of applications on the host
+
+        :param fileobj: Binary file object
+        :param policy: The IoPolicy
+        """
+        self.fileobj = fileobj
+        self.policy = policy
+        self.position = 0
+        self.dropped = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.position += len(data)
+        self.policy.throttle(len(data))
+        if self.position - self.dropped >= DROP_CACHE_SIZE or not data:
+            self.__drop()
+        return data
+
+    def __drop(self):
+        if hasattr(os, 'posix_fadvise') and self.position > self.dropped:
+            try:
+                os.posix_fadvise(self.fileobj.fileno(), self.dropped, self.position - self.dropped,
+                                 os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+        self.dropped = self.position
+
+    def close(self):
+        self.__drop()
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_file(file_name, policy=None):
+    """
+    It opens the file for reading, through the policy if it is provided
+
+    :param file_name: The file
+    :param policy: The IoPolicy (optional)
+    :return: Binary file like object.
+    """
+    if policy is None:
+        return open(file_name, 'rb')
+    return policy.open(file_name)
+
+
+def parse_ionice(ionice):
+    """
+    It parses the ionice option from configuration, i.e. `idle`, `best-effort:7` or `2:7`
+
+    :param ionice: The ionice option
+    :return: Tuple (class, level), the level is None if it isn't provided, or None if the option is empty.
+    """
+    if ionice is None or str(ionice).strip() == '':
+        return None
+    parts = str(ionice).strip().lower().split(':')
+    try:
+        io_class = IONICE_CLASSES[parts[0]] if parts[0] in IONICE_CLASSES else int(parts[0])
+        level = int(parts[1]) if len(parts) > 1 and parts[1] != '' else None
+    except ValueError:
+        logger.warning("Wrong ionice option: " + str(ionice) + ", it will be ignored")
+        return None
+    if io_class not in IONICE_CLASSES.values() or (level is not None and not 0 <= level <= 7):
+        logger.warning("Wrong ionice option: " + str(ionice) + ", it will be ignored")
+        return None
+    return io_class, level
+
+
+def parse_size(size):
+    """
+    It parses a size from configuration, i.e. `1048576`, `512K`, `100M` or `4G`
+
+    :param size: The size as a string
+    :return: The size in bytes, 0 if the size isn't proper.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = str(size).strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+    try:
+        if size != '' and size[-1] in units:
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(size)
+    except ValueError:
+        logger.warning("Wrong size: " + size + ", system will use 0")
+        return 0
 
 
 def parse_time(exec_time):